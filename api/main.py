@@ -1,18 +1,83 @@
+from contextlib import asynccontextmanager
+from time import perf_counter
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from api.routes import router
-from api.scheduler import start_scheduler
-from app.db import Base, engine
-from app.models import Entry
+from app import config, crud, group_commit, metrics, sharding
+from app.db import prepare_database
+
+class MetricsMiddleware:
+    """
+    Times each HTTP request until its last body chunk is sent (so streamed
+    exports count in full) and records it per route template and status,
+    together with the SQL it ran.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        started = perf_counter()
+        stats, token = metrics.start_request(scope)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.finish_request(token, stats, status, perf_counter() - started)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start-up work happens here rather than at import, so importing the app
+    (tests, tooling, a worker that fails fast) touches neither the database
+    nor starts threads.
+    """
+    await run_in_threadpool(prepare_database)
+    await run_in_threadpool(sharding.shards.prepare)
+
+    scheduler = None
+    if config.SCHEDULER_MODE == "embedded":
+        # apscheduler is only imported by processes that run it
+        from api.scheduler import scheduler, start_scheduler
+        start_scheduler()
+    elif config.SCHEDULER_MODE != "off":
+        raise ValueError(f"Unknown SCHEDULER_MODE {config.SCHEDULER_MODE!r}, expected 'embedded' or 'off'")
+    try:
+        yield
+    finally:
+        if scheduler is not None:
+            scheduler.shutdown(wait=False)
+        # Commit entries still queued for a group commit
+        await run_in_threadpool(group_commit.close_entry_writer)
 
 app = FastAPI(
     title="Personal Knowledge & Reflection Diary API",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Include all API routes
 app.include_router(router)
+app.add_middleware(MetricsMiddleware)
 
-Base.metadata.create_all(bind=engine)
+metrics.Gauge("user_cache_hits_total", "User cache hits", lambda: crud.user_cache.hits, kind="counter")
+metrics.Gauge("user_cache_misses_total", "User cache misses", lambda: crud.user_cache.misses, kind="counter")
+metrics.Gauge("user_cache_size", "Users currently cached", lambda: len(crud.user_cache))
 
-# Start the daily reflection prompt scheduler
-start_scheduler()
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
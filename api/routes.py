@@ -1,70 +1,424 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from datetime import date
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import json
+import zlib
 
-from app import crud, schemas
-from app.db import get_db
-from app.exporter import entries_to_markdown
+from collections import defaultdict
+from app import async_crud, crud, group_commit, models, schemas, sharding, stats
+from app.db import get_async_db, get_db
+from app.group_commit import GroupCommitWriter, get_entry_writer
+from app.sharding import get_user_async_db, get_user_db
+from app.pagination import split_page
 
 router = APIRouter()
 
+# app.exporter and app.export_jobs (zipfile, csv, a thread pool) are imported
+# by the routes that use them, so they don't add to worker start-up time.
+
 # -------------------- ENTRY ENDPOINTS --------------------
 
 @router.post("/entry", response_model=schemas.EntryOut)
-def create_entry(entry: schemas.EntryIn, db: Session = Depends(get_db)):
-    # Ensure the user exists
-    user = crud.get_user_by_id(db, entry.user_id)
+async def create_entry(entry: schemas.EntryIn,
+                       db: AsyncSession = Depends(get_async_db),
+                       writer: Optional[GroupCommitWriter] = Depends(get_entry_writer)):
+    # Ensure the user exists; usually answered by the user cache without a query
+    user = await async_crud.get_cached_user_by_id(db, entry.user_id)
     if not user:
         raise HTTPException(400, "User not found")
 
-    # Create the entry
-    return crud.create_entry(db, entry)
+    # Create the entry on the user's shard, committed together with concurrent
+    # ones if GROUP_COMMIT is on
+    if writer is not None:
+        if not sharding.shards.is_directory(user.shard_id):
+            writer = group_commit.get_shard_writer(user.shard_id)
+        return await writer.create_entry_async(entry)
+    async with sharding.shards.async_session(db, user.shard_id) as shard_db:
+        return await async_crud.create_entry(shard_db, entry)
+
+BULK_BATCH_SIZE = 500
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" if err["loc"] else err["msg"]
+        for err in e.errors()
+    )
+
+async def _iter_ndjson(request: Request) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+def _insert_bulk_batch(db: Session,
+                       batch: List[Tuple[int, schemas.EntryIn]],
+                       known_users: Dict[int, bool],
+                       results: List[schemas.BulkItemResult]):
+    # Each distinct user_id is looked up once per request, not once per entry
+    unknown = {entry.user_id for _, entry in batch} - known_users.keys()
+    if unknown:
+        found = crud.existing_user_ids(db, unknown)
+        known_users.update({user_id: user_id in found for user_id in unknown})
+
+    valid = [(index, entry) for index, entry in batch if known_users[entry.user_id]]
+    results.extend(
+        schemas.BulkItemResult(index=index, error="User not found")
+        for index, entry in batch if not known_users[entry.user_id]
+    )
+
+    by_shard = defaultdict(list)
+    for index, entry in valid:
+        by_shard[sharding.shards.user_shard(db, entry.user_id)].append((index, entry))
+    for shard_id, items in by_shard.items():
+        with sharding.shards.session(db, shard_id) as shard_db:
+            ids = crud.create_entries_bulk(shard_db, [entry for _, entry in items], batch_size=BULK_BATCH_SIZE)
+        results.extend(schemas.BulkItemResult(index=index, id=entry_id) for (index, _), entry_id in zip(items, ids))
+
+@router.post("/entries/bulk", response_model=schemas.BulkResult)
+async def create_entries_bulk(request: Request, db: Session = Depends(get_db)):
+    """
+    Create many entries at once from a JSON array or, with an
+    application/x-ndjson body, one JSON object per line.
+    NDJSON is read and inserted batch by batch as it arrives.
+    Returns the new id or the error for every item, by position.
+    """
+    results: List[schemas.BulkItemResult] = []
+    known_users: Dict[int, bool] = {}
+    batch: List[Tuple[int, schemas.EntryIn]] = []
+
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = _iter_ndjson(request)
+    else:
+        try:
+            payload = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+
+        async def _iter_list():
+            for item in payload:
+                yield item
+        items = _iter_list()
+
+    index = 0
+    async for item in items:
+        try:
+            if isinstance(item, bytes):
+                entry = schemas.EntryIn.model_validate_json(item)
+            else:
+                entry = schemas.EntryIn.model_validate(item)
+            batch.append((index, entry))
+        except ValidationError as e:
+            results.append(schemas.BulkItemResult(index=index, error=_validation_message(e)))
+        index += 1
+
+        if len(batch) >= BULK_BATCH_SIZE:
+            await run_in_threadpool(_insert_bulk_batch, db, batch, known_users, results)
+            batch = []
+
+    if batch:
+        await run_in_threadpool(_insert_bulk_batch, db, batch, known_users, results)
+
+    results.sort(key=lambda r: r.index)
+    created = sum(1 for r in results if r.id is not None)
+    return schemas.BulkResult(created=created, failed=len(results) - created, results=results)
+
+def _validators(request: Request, marker: Tuple[int, Optional[datetime]]) -> Dict[str, str]:
+    # The ETag combines the user's change version with the path and query
+    # string, since other routes, dates, filters and limits of the same data
+    # are different bodies.
+    # X-Sync-Version is the value to send back as since= on the next sync. It is
+    # read before the entries, so a concurrent write is fetched again, never lost.
+    version, changed_at = marker
+    headers = {
+        "ETag": f'"v{version}.{zlib.crc32(f"{request.url.path}?{request.url.query}".encode()):x}"',
+        "X-Sync-Version": str(version),
+        "Cache-Control": "private, no-cache",
+    }
+    if changed_at:
+        headers["Last-Modified"] = format_datetime(changed_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+def _not_modified(request: Request, headers: Dict[str, str]) -> Optional[Response]:
+    """
+    A 304 response if the client's cached copy is current, else None.
+    If-None-Match wins over If-Modified-Since, as in RFC 9110.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        fresh = "*" in tags or headers["ETag"] in tags
+    elif request.headers.get("if-modified-since") and "Last-Modified" in headers:
+        try:
+            fresh = parsedate_to_datetime(headers["Last-Modified"]) <= parsedate_to_datetime(request.headers["if-modified-since"])
+        except (TypeError, ValueError):
+            fresh = False
+    else:
+        fresh = False
+    return Response(status_code=304, headers=headers) if fresh else None
+
+def _entries_response(rows, headers: Optional[Dict[str, str]] = None) -> Response:
+    # Validate the rows once and render JSON bytes straight from pydantic-core.
+    # Returning a Response skips FastAPI's second pass over response_model,
+    # which stays on the route for the OpenAPI schema.
+    entries = schemas.EntryOutList.validate_python(rows, from_attributes=True)
+    return Response(schemas.EntryOutList.dump_json(entries), media_type="application/json", headers=headers)
 
 @router.get("/entry/{entry_date}", response_model=List[schemas.EntryOut])
-def read_entries_by_date(entry_date: date, user_id: int, db: Session = Depends(get_db)):
+async def read_entries_by_date(request: Request,
+                               entry_date: date,
+                               user_id: int,
+                               tag: Optional[str] = None,
+                               db: AsyncSession = Depends(get_user_async_db)):
     """
-    Get all entries for a specific user and date.
+    Get all entries for a specific user and date, optionally only those with a tag.
+    Answers If-None-Match / If-Modified-Since with 304 when nothing changed.
     """
-    entries = crud.get_entries_by_date(db, user_id=user_id, entry_date=entry_date)
-    return [schemas.EntryOut.model_validate(e, from_attributes=True) for e in entries]
+    headers = _validators(request, await async_crud.change_marker(db, user_id))
+    not_modified = _not_modified(request, headers)
+    if not_modified:
+        return not_modified
+
+    entries = await async_crud.get_entries_by_date(db, user_id=user_id, entry_date=entry_date, tag=tag)
+    return _entries_response(entries, headers)
 
 @router.get("/list", response_model=List[schemas.EntryOut])
-def list_recent_entries(user_id: int, limit: int = Query(5, le=50), db: Session = Depends(get_db)):
+async def list_recent_entries(request: Request,
+                              user_id: int,
+                              limit: int = Query(5, ge=1, le=50),
+                              cursor: Optional[str] = None,
+                              tag: Optional[str] = None,
+                              since: Optional[int] = Query(None, ge=0),
+                              db: AsyncSession = Depends(get_user_async_db)):
     """
-    Get recent entries for a user.
+    Get recent entries for a user, optionally only those with a tag.
+    If there are older entries, the X-Next-Cursor header holds the cursor for the next page.
+    With since (an X-Sync-Version from an earlier response), only entries written after it.
     """
-    entries = crud.list_recent_entries(db, user_id, limit)
-    return entries
+    headers = _validators(request, await async_crud.change_marker(db, user_id))
+    not_modified = _not_modified(request, headers)
+    if not_modified:
+        return not_modified
+
+    try:
+        entries = await async_crud.list_recent_entries(db, user_id, limit + 1, cursor, tag, since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    entries, next_cursor = split_page(entries, limit, key=lambda e: e.timestamp)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return _entries_response(entries, headers)
+
+def _stream_markdown(db: Session,
+                     user_id: int,
+                     start_date: Optional[date],
+                     end_date: Optional[date],
+                     tag: Optional[str],
+                     since: Optional[int]):
+    # The session is closed here rather than relying on get_db, because the
+    # body is produced after the route function has already returned.
+    from app.exporter import iter_entries_markdown
+    try:
+        yield from iter_entries_markdown(
+            crud.iter_export_entries(db, user_id, start_date, end_date, tag=tag, since=since)
+        )
+    finally:
+        db.close()
 
 @router.get("/export")
-def export_entries(user_id: int,
+def export_entries(request: Request,
+                   response: Response,
+                   user_id: int,
                    start_date: Optional[date] = None,
                    end_date: Optional[date] = None,
-                   db: Session = Depends(get_db)):
+                   tag: Optional[str] = None,
+                   since: Optional[int] = Query(None, ge=0),
+                   stream: bool = False,
+                   db: Session = Depends(get_user_db)):
     """
     Export entries as a Markdown-formatted string.
+    With stream=true the Markdown is sent as text/markdown, one date group at a time.
+    With since (an X-Sync-Version from an earlier response), only entries written after it.
+    Answers If-None-Match / If-Modified-Since with 304 when nothing changed.
     """
-    entries = crud.export_entries(db, user_id, start_date, end_date)
+    headers = _validators(request, crud.change_marker(db, user_id))
+    not_modified = _not_modified(request, headers)
+    if not_modified:
+        return not_modified
+
+    if stream:
+        return StreamingResponse(
+            _stream_markdown(db, user_id, start_date, end_date, tag, since),
+            media_type="text/markdown; charset=utf-8",
+            headers=headers
+        )
+
+    response.headers.update(headers)
+    entries = crud.export_entry_rows(db, user_id, start_date, end_date, tag, since)
     if not entries:
         return {"message": "No entries found in the given date range."}
-    entries_out = [schemas.EntryOut.model_validate(e) for e in entries]
+    from app.exporter import entries_to_markdown
+    entries_out = schemas.EntryOutList.validate_python(entries, from_attributes=True)
     markdown = entries_to_markdown(entries_out)
     return {"markdown": markdown}
 
+@router.get("/export/page", response_model=schemas.EntryPage)
+async def export_entries_page(request: Request,
+                              user_id: int,
+                              start_date: Optional[date] = None,
+                              end_date: Optional[date] = None,
+                              limit: int = Query(100, ge=1, le=500),
+                              cursor: Optional[str] = None,
+                              tag: Optional[str] = None,
+                              since: Optional[int] = Query(None, ge=0),
+                              db: AsyncSession = Depends(get_user_async_db)):
+    """
+    Page through the export range in date order using an opaque cursor.
+    With since, only entries written after that X-Sync-Version.
+    """
+    headers = _validators(request, await async_crud.change_marker(db, user_id))
+    not_modified = _not_modified(request, headers)
+    if not_modified:
+        return not_modified
+
+    try:
+        entries = await async_crud.export_entries_page(db, user_id, start_date, end_date, limit + 1, cursor, tag, since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    entries, next_cursor = split_page(entries, limit, key=lambda e: e.date_only)
+    page = schemas.EntryPage(items=schemas.EntryOutList.validate_python(entries, from_attributes=True),
+                             next_cursor=next_cursor)
+    return Response(page.model_dump_json(), media_type="application/json", headers=headers)
+
+@router.get("/search", response_model=schemas.SearchPage)
+async def search_entries(user_id: int,
+                         q: str = Query(..., min_length=1),
+                         limit: int = Query(20, ge=1, le=100),
+                         offset: int = Query(0, ge=0),
+                         db: AsyncSession = Depends(get_user_async_db)):
+    """
+    Full-text search in a user's entries, ranked by relevance.
+    All words must match; end a word with * to match it as a prefix.
+    Matches in the snippet are wrapped in **bold** markers.
+    """
+    rows = await async_crud.search_entries(db, user_id, q, limit + 1, offset)
+    items = [
+        schemas.SearchHit(**schemas.EntryOut.model_validate(entry).model_dump(), snippet=snippet, rank=rank)
+        for entry, snippet, rank in rows[:limit]
+    ]
+    next_offset = offset + limit if len(rows) > limit else None
+    return {"items": items, "next_offset": next_offset}
+
+@router.get("/tags", response_model=List[schemas.TagCount])
+async def list_tags(user_id: int, db: AsyncSession = Depends(get_user_async_db)):
+    """
+    Tags used by a user with the number of entries for each, most used first.
+    """
+    rows = await async_crud.tag_counts(db, user_id)
+    return [{"tag": name, "count": count} for name, count in rows]
+
+
+# -------------------- STATS ENDPOINTS --------------------
+
+@router.get("/stats", response_model=schemas.StatsOut)
+async def get_stats(user_id: int,
+                    start_date: Optional[date] = None,
+                    end_date: Optional[date] = None,
+                    db: AsyncSession = Depends(get_user_async_db)):
+    """
+    Entries per day and per type, with the current and longest daily streak.
+    Reads only the daily_stats summary table.
+    """
+    rows = await async_crud.get_daily_stats(db, user_id, start_date, end_date)
+    return stats.summarize(rows, today=datetime.now(timezone.utc).date())
+
+@router.get("/stats/heatmap", response_model=schemas.HeatmapOut)
+async def get_heatmap(user_id: int,
+                      year: Optional[int] = Query(None, ge=1, le=9999),
+                      db: AsyncSession = Depends(get_user_async_db)):
+    """
+    Entries per day for one calendar year (default: the current one).
+    """
+    year = year or datetime.now(timezone.utc).year
+    rows = await async_crud.get_daily_stats(db, user_id, date(year, 1, 1), date(year, 12, 31))
+    return stats.heatmap(rows, year)
+
+
+# -------------------- EXPORT JOB ENDPOINTS --------------------
+
+@router.post("/exports", response_model=schemas.ExportJobOut, status_code=202)
+def create_export_job(job: schemas.ExportJobIn, db: Session = Depends(get_db)):
+    """
+    Queue an export of a user's entries as JSONL, CSV or zipped monthly Markdown.
+    Poll GET /exports/{id} until status is "done", then download the file.
+    """
+    user = crud.get_cached_user_by_id(db, job.user_id)
+    if not user:
+        raise HTTPException(400, "User not found")
+
+    from app import export_jobs
+    db_job = crud.create_export_job(db, job)
+    # The worker opens its own sessions on the user's shard, or else on the
+    # same engine as this request
+    if sharding.shards.is_directory(user.shard_id):
+        session_factory = sessionmaker(autoflush=False, bind=db.get_bind())
+    else:
+        session_factory = sharding.shards.sessionmaker(user.shard_id)
+    export_jobs.submit_export_job(db_job.id, session_factory)
+    return db_job
+
+@router.get("/exports/{job_id}", response_model=schemas.ExportJobOut)
+def get_export_job(job_id: int, db: Session = Depends(get_db)):
+    job = crud.get_export_job(db, job_id)
+    if not job:
+        raise HTTPException(404, "Export not found")
+    return job
+
+@router.get("/exports/{job_id}/download")
+def download_export(job_id: int, db: Session = Depends(get_db)):
+    """
+    The finished export file. Supports Range requests for resumed downloads.
+    """
+    job = crud.get_export_job(db, job_id)
+    if not job:
+        raise HTTPException(404, "Export not found")
+    if job.status != models.ExportStatus.done:
+        raise HTTPException(409, f"Export is {job.status.value}")
+
+    from app import export_jobs
+    return FileResponse(
+        job.path,
+        media_type=export_jobs.MEDIA_TYPES[job.format],
+        filename=f"diary-export-{job.id}.{export_jobs.EXTENSIONS[job.format]}"
+    )
+
 
 # -------------------- USER ENDPOINTS --------------------
 
 @router.post("/users", response_model=schemas.UserOut)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     try:
-        return crud.create_user(db, user)
+        return crud.create_user(db, user, shard_id=sharding.shards.placement(user.external_id))
     except ValueError as e:
         raise HTTPException(status_code=400,  detail=f"User already exists {e}")
 
 @router.get("/users/{user_id}", response_model=schemas.UserOut)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = crud.get_user_by_id(db, user_id)
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await async_crud.get_cached_user_by_id(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -78,14 +432,20 @@ def update_user(user_id: int, updates: schemas.UserUpdate, db: Session = Depends
 
 @router.delete("/users/{user_id}")
 def delete_user(user_id: int, db: Session = Depends(get_db)):
+    # Entries first, wherever they are: the user row can't go while they reference it
+    with sharding.shards.session(db, sharding.shards.user_shard(db, user_id)) as shard_db:
+        crud.delete_user_entries(shard_db, user_id)
+        if shard_db is not db:
+            shard_db.commit()
+    # Commits the entry deletes too when they are in this database
     success = crud.delete_user_by_id(db, user_id)
     if not success:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted"}
 
 @router.get("/users/by_external_id/{external_id}", response_model=schemas.UserOut)
-def get_user_by_external_id(external_id: int, db: Session = Depends(get_db)):
-    user = crud.get_user_by_external_id(db, external_id)
+async def get_user_by_external_id(external_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await async_crud.get_cached_user_by_external_id(db, external_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
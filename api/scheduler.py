@@ -1,16 +1,109 @@
+"""
+Daily prompt scheduling.
+
+Users are prompted at their own local time, rounded up to a
+PROMPT_SLOT_MINUTES slot (app.prompt_schedule). The scheduler ticks at every
+slot boundary (UTC) and at start; each tick prompts the users whose slot has
+started, at most PROMPT_TICK_LIMIT of them, and sends their prompts if the
+bot is configured. Users a tick didn't get to, or a missed tick's users,
+are still due and go in the next one.
+
+Ticks go through app.jobs.run_exclusive, so however many processes run a
+scheduler, one of them runs each tick, and a tick is skipped while the
+previous one is still running. With ARCHIVE_AFTER_DAYS set, old entries are
+archived once a day at ARCHIVE_HOUR (UTC) the same way. With
+SCHEDULER_MODE=embedded every API worker schedules them too; with
+SCHEDULER_MODE=off (the default) only a separate process does:
+
+    python -m api.scheduler
+"""
+import logging
+from datetime import date, datetime
+from functools import partial
+from typing import Optional
+
 from apscheduler.schedulers.background import BackgroundScheduler
-from app.logic import generate_daily_prompts
-from app.config import PROMPT_HOUR, PROMPT_MINUTE
+from apscheduler.schedulers.blocking import BlockingScheduler
+from app import crud, jobs, metrics, prompt_schedule, sharding
+from app.db import SessionLocal, prepare_database
+from app.logic import archive_old_entries, create_due_prompts
+from app.config import ARCHIVE_AFTER_DAYS, ARCHIVE_HOUR, BOT_TOKEN, PROMPT_SLOT_MINUTES
 
-scheduler = BackgroundScheduler()
+PROMPT_TICK = "prompt_tick"
+ARCHIVE = "archive_entries"
 
-def start_scheduler():
-    scheduler.add_job(
-        generate_daily_prompts,
+logger = logging.getLogger(__name__)
+
+# Slots are UTC, so ticks must be too
+scheduler = BackgroundScheduler(timezone="UTC")
+
+def prompt_tick(now: datetime, session_factory=SessionLocal):
+    """
+    Create the due prompts, then send them if the bot is configured.
+    """
+    with metrics.job_timer("create_due_prompts"):
+        tick = create_due_prompts(now, session_factory)
+    logger.info("Prompt tick %s: %d users", now, tick.users)
+    if BOT_TOKEN:
+        from api.send_prompt import deliver_daily_prompts  # httpx, only for processes that send
+        with metrics.job_timer("deliver_daily_prompts"):
+            # Prompts are on their users' shards; each database is sent from separately
+            factories = [session_factory, *map(sharding.shards.sessionmaker, sharding.shards.shard_ids())]
+            for prompt_date in sorted(tick.dates):
+                for factory in factories:
+                    deliver_daily_prompts(prompt_date, session_factory=factory)
+
+def run_prompt_tick(now: Optional[datetime] = None, session_factory=SessionLocal) -> bool:
+    """
+    Run the tick for now's slot (naive UTC) once across all processes.
+    Returns whether this call ran it.
+    """
+    now = now or prompt_schedule.utc_now()
+    with session_factory() as db:
+        if crud.job_run_active(db, PROMPT_TICK):
+            return False
+    run_key = prompt_schedule.slot_start(now).isoformat(timespec="minutes")
+    return jobs.run_exclusive(PROMPT_TICK, run_key, partial(prompt_tick, now, session_factory), session_factory)
+
+def archive(today: date, session_factory=SessionLocal):
+    with metrics.job_timer(ARCHIVE):
+        archived = archive_old_entries(today, session_factory)
+    logger.info("Archive %s: %d entries", today, archived)
+
+def run_archive(today: Optional[date] = None, session_factory=SessionLocal) -> bool:
+    """
+    Archive old entries once per UTC day across all processes.
+    Returns whether this call ran it.
+    """
+    today = today or prompt_schedule.utc_now().date()
+    return jobs.run_exclusive(ARCHIVE, today.isoformat(), partial(archive, today, session_factory), session_factory)
+
+def add_jobs(target):
+    target.add_job(
+        run_prompt_tick,
         trigger="cron",
-        hour=PROMPT_HOUR,
-        minute=PROMPT_MINUTE,
-        id="daily_prompt_job",
+        minute=f"*/{PROMPT_SLOT_MINUTES}",
+        next_run_time=datetime.now(target.timezone),
+        id="prompt_tick",
         replace_existing=True
     )
+    if ARCHIVE_AFTER_DAYS > 0:
+        target.add_job(run_archive, trigger="cron", hour=ARCHIVE_HOUR, id=ARCHIVE, replace_existing=True)
+
+def start_scheduler():
+    add_jobs(scheduler)
     scheduler.start()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    # Same start-up checks as the API lifespan: ticks read and write the shards too
+    prepare_database()
+    sharding.shards.prepare()
+    standalone = BlockingScheduler(timezone="UTC")
+    add_jobs(standalone)
+    standalone.start()
+
+
+if __name__ == "__main__":
+    main()
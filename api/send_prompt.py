@@ -0,0 +1,262 @@
+"""
+Sends the day's reflection prompts to Telegram.
+
+The scheduler's ticks write one prompted entry per due user; this module
+delivers them. Pending entries are read in id order and sent by a
+pool of workers, paced by a global rate (Telegram allows about 30 messages
+a second per bot) and a per-chat rate. A 429 pauses every worker for the
+retry_after Telegram asks for, 5xx and network errors are retried with
+backoff, and any other error is permanent (e.g. the user blocked the bot).
+429s count against the retries like the rest, so a bot throttled for long
+leaves its prompts to the next run instead of never finishing.
+
+Outcomes are written to prompt_deliveries in batches, and only entries
+without a row (or given up on after transient errors) are pending, so
+rerunning the job sends what is left and nothing twice.
+
+    python -m api.send_prompt [--date 2025-06-30]
+"""
+import argparse
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import httpx
+
+from app import config, crud, metrics
+from app.db import SessionLocal
+from app.models import DeliveryStatus
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Hands out evenly spaced send slots at rate per second (0 = unlimited).
+    Callers reserve a slot and sleep until it; no await happens between
+    reading and moving the next slot, so no lock is needed.
+    """
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def acquire(self) -> None:
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hand out no slots for the next seconds.
+        """
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+@dataclass
+class DeliveryReport:
+    sent: int = 0
+    failed: int = 0
+    retry: int = 0
+    throttled: int = 0  # 429 responses
+    seconds: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.failed + self.retry
+
+    @property
+    def rate(self) -> float:
+        return self.total / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.sent} sent, {self.failed} failed, {self.retry} to retry, {self.throttled} throttled "
+                f"in {self.seconds:.1f}s ({self.rate:.1f} msg/s)")
+
+
+class PromptSender:
+    def __init__(self,
+                 token: Optional[str] = config.BOT_TOKEN,
+                 *,
+                 base_url: str = config.TELEGRAM_API_URL,
+                 session_factory=SessionLocal,
+                 global_rate: float = config.PROMPT_GLOBAL_RATE,
+                 chat_rate: float = config.PROMPT_CHAT_RATE,
+                 concurrency: int = config.PROMPT_CONCURRENCY,
+                 retries: int = config.PROMPT_RETRIES,
+                 backoff: float = 0.5,
+                 max_backoff: float = 30.0,
+                 chunk_size: int = 1000,
+                 flush_size: int = 200,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        if not token:
+            raise ValueError("BOT_TOKEN is not set")
+        self.token = token
+        self.base_url = base_url
+        self.session_factory = session_factory
+        self.global_limit = RateLimiter(global_rate)
+        self.chat_interval = 1 / chat_rate if chat_rate > 0 else 0.0
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.chunk_size = chunk_size
+        self.flush_size = flush_size
+        self.transport = transport
+
+        self.report = DeliveryReport()
+        self._chat_next: Dict[int, float] = {}
+        self._results: List[dict] = []
+        self._flush_lock = asyncio.Lock()
+
+    # ------------------------
+    # SENDING
+    # ------------------------
+
+    async def _wait_for_chat(self, chat_id: int) -> None:
+        delay = self._chat_next.get(chat_id, 0.0) - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _send(self, http: httpx.AsyncClient, entry_id: int, chat_id: int, text: str) -> dict:
+        """
+        Send one prompt and return its prompt_deliveries row.
+        """
+        attempts = 0
+        failures = 0
+        while True:
+            await self._wait_for_chat(chat_id)
+            await self.global_limit.acquire()
+            # Spaced from when the message actually goes out
+            self._chat_next[chat_id] = asyncio.get_running_loop().time() + self.chat_interval
+            attempts += 1
+            throttled = False
+            try:
+                response = await http.post(f"/bot{self.token}/sendMessage", json={"chat_id": chat_id, "text": text})
+            except httpx.TransportError as e:
+                # Telegram has no idempotency key: a timeout after the request
+                # went out may send the prompt twice, which beats not sending it
+                error = f"{type(e).__name__}: {e}"
+            else:
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = {}
+                if response.status_code == 200 and body.get("ok"):
+                    return {"entry_id": entry_id, "status": DeliveryStatus.sent, "attempts": attempts,
+                            "telegram_message_id": body["result"]["message_id"], "error": None}
+                error = body.get("description") or f"HTTP {response.status_code}"
+                throttled = response.status_code == 429
+                if throttled:
+                    # Applies to the whole bot, not just this chat
+                    self.report.throttled += 1
+                    metrics.prompt_deliveries.inc("throttled")
+                    self.global_limit.pause(float((body.get("parameters") or {}).get("retry_after", 1)))
+                elif response.status_code < 500:
+                    return {"entry_id": entry_id, "status": DeliveryStatus.failed, "attempts": attempts,
+                            "telegram_message_id": None, "error": error}
+
+            if failures == self.retries:
+                return {"entry_id": entry_id, "status": DeliveryStatus.retry, "attempts": attempts,
+                        "telegram_message_id": None, "error": error}
+            failures += 1
+            if throttled:
+                # The pause is the wait
+                continue
+            # Full jitter, so failed sends don't come back all at once
+            await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** failures)))
+
+    # ------------------------
+    # PIPELINE
+    # ------------------------
+
+    def _read_chunk(self, prompt_date: date, after_entry_id: int):
+        with self.session_factory() as db:
+            return crud.pending_prompt_deliveries(db, prompt_date, after_entry_id, self.chunk_size)
+
+    def _write(self, results: List[dict]) -> None:
+        with self.session_factory() as db:
+            crud.record_prompt_deliveries(db, results)
+
+    async def _flush(self, force: bool = False) -> None:
+        async with self._flush_lock:
+            if not self._results or (len(self._results) < self.flush_size and not force):
+                return
+            results, self._results = self._results, []
+            await asyncio.to_thread(self._write, results)
+
+    async def _produce(self, queue: asyncio.Queue, prompt_date: date) -> None:
+        after_entry_id = 0
+        while True:
+            rows = await asyncio.to_thread(self._read_chunk, prompt_date, after_entry_id)
+            if not rows:
+                break
+            # Chats whose next slot has passed would not wait anyway
+            now = asyncio.get_running_loop().time()
+            self._chat_next = {chat: slot for chat, slot in self._chat_next.items() if slot > now}
+            for row in rows:
+                await queue.put(row)
+            after_entry_id = rows[-1][0]
+        for _ in range(self.concurrency):
+            await queue.put(None)
+
+    async def _work(self, http: httpx.AsyncClient, queue: asyncio.Queue) -> None:
+        while True:
+            row = await queue.get()
+            if row is None:
+                return
+            result = await self._send(http, *row)
+            status = result["status"].value
+            setattr(self.report, status, getattr(self.report, status) + 1)
+            metrics.prompt_deliveries.inc(status)
+            self._results.append(result)
+            await self._flush()
+
+    async def run(self, prompt_date: date) -> DeliveryReport:
+        """
+        Deliver every pending prompt for prompt_date and return the report.
+        """
+        started = perf_counter()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.chunk_size)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=httpx.Timeout(30.0, connect=5.0),
+                                     limits=limits, transport=self.transport) as http:
+            try:
+                await asyncio.gather(
+                    self._produce(queue, prompt_date),
+                    *(self._work(http, queue) for _ in range(self.concurrency)),
+                )
+            finally:
+                # Whatever was sent before a failure is still recorded
+                await self._flush(force=True)
+        self.report.seconds = perf_counter() - started
+        logger.info("Prompts for %s: %s", prompt_date, self.report)
+        return self.report
+
+
+async def deliver_prompts(prompt_date: date, **kwargs) -> DeliveryReport:
+    return await PromptSender(**kwargs).run(prompt_date)
+
+def deliver_daily_prompts(prompt_date: Optional[date] = None, **kwargs) -> DeliveryReport:
+    """
+    Deliver today's prompts (the UTC date). For the scheduler's thread.
+    """
+    prompt_date = prompt_date or datetime.now(timezone.utc).date()
+    return asyncio.run(deliver_prompts(prompt_date, **kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send the daily reflection prompts to Telegram")
+    parser.add_argument("--date", type=date.fromisoformat, help="prompt date (default: today, UTC)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(deliver_daily_prompts(args.date))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+from sqlalchemy import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+from itertools import islice
+import heapq
+from app import crud, models, schemas
+
+# Async versions of the hot crud functions, used by the routes that run on the
+# event loop. They share the query builders in app.crud so both paths issue
+# exactly the same SQL. Entry reads return rows of crud.ENTRY_OUT_COLUMNS
+# rather than ORM objects, since the routes only serialize them.
+
+# ------------------------
+# USER CRUD
+# ------------------------
+
+async def get_user_by_external_id(db: AsyncSession, external_id: int, source: str = "telegram") -> Optional[models.User]:
+    """
+    Fetch a user by their external ID and source (e.g., Telegram user_id + platform).
+    """
+    result = await db.execute(crud.user_by_external_id_query(external_id, source))
+    return result.scalar_one_or_none()
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    """
+    Fetch a user by internal ID (primary key).
+    """
+    result = await db.execute(crud.user_by_id_query(user_id))
+    return result.scalar_one_or_none()
+
+async def get_cached_user_by_id(db: AsyncSession, user_id: int) -> Optional[schemas.UserOut]:
+    """
+    get_user_by_id through the user cache in app.crud. Returns a read-only snapshot.
+    """
+    return crud.user_cache.get(("id", user_id)) or crud.cache_user(await get_user_by_id(db, user_id))
+
+async def get_cached_user_by_external_id(db: AsyncSession, external_id: int, source: str = "telegram") -> Optional[schemas.UserOut]:
+    """
+    get_user_by_external_id through the user cache in app.crud. Returns a read-only snapshot.
+    """
+    return (crud.user_cache.get(("external_id", external_id, source))
+            or crud.cache_user(await get_user_by_external_id(db, external_id, source)))
+
+
+# ------------------------
+# ENTRY CRUD
+# ------------------------
+
+async def create_entry(db: AsyncSession, entry: schemas.EntryIn) -> models.Entry:
+    """
+    Create and store a new diary entry in the database. Repeating an entry
+    with the same user, source and message_id returns the stored one.
+    """
+    result = await db.execute(
+        crud.upsert_entries(models.Entry).values(crud.entry_values(entry)),
+        execution_options={"populate_existing": True}
+    )
+    db_entry, created = result.one()
+    if created:
+        await db.run_sync(crud.attach_tags, [(db_entry.id, db_entry.user_id, db_entry.tags)])
+    await db.commit()
+    return db_entry
+
+async def get_entries_by_date(db: AsyncSession, user_id: int, entry_date: date, tag: Optional[str] = None) -> List[Row]:
+    """
+    Retrieve all entries for a specific user and date, optionally only those with a tag.
+    """
+    result = await db.execute(crud.entry_columns(crud.entries_by_date_query(user_id, entry_date, tag)))
+    return result.all()
+
+async def list_recent_entries(
+    db: AsyncSession,
+    user_id: int,
+    limit: int = 5,
+    cursor: Optional[str] = None,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
+) -> List[Row]:
+    """
+    Get the most recent entries for a user, continuing after cursor if given.
+    """
+    result = await db.execute(crud.entry_columns(crud.recent_entries_query(user_id, limit, cursor, tag, since)))
+    return result.all()
+
+async def export_entries(
+    db: AsyncSession,
+    user_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
+) -> List[Row]:
+    """
+    Export all entries for a user between start_date and end_date (inclusive),
+    archived ones included.
+    """
+    result = await db.execute(crud.entry_columns(crud.export_query(user_id, start_date, end_date, tag, since)))
+    segments = await db.scalars(crud.archive_query(user_id, start_date, end_date))
+    archived = crud.filter_archived(segments, start_date, end_date, tag, since)
+    return list(heapq.merge(result.all(), archived, key=crud.export_key))
+
+async def export_entries_page(
+    db: AsyncSession,
+    user_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
+) -> List[Row]:
+    """
+    One page of export_entries, continuing after the (date_only, id) in cursor.
+    """
+    result = await db.execute(crud.entry_columns(
+        crud.export_page_query(user_id, start_date, end_date, limit, cursor, tag, since)
+    ))
+    segments = await db.scalars(crud.archive_query(user_id, start_date, end_date, cursor))
+    archived = crud.filter_archived(segments, start_date, end_date, tag, since, cursor)
+    return list(islice(heapq.merge(result.all(), archived, key=crud.export_key), limit))
+
+async def change_marker(db: AsyncSession, user_id: int) -> Tuple[int, Optional[datetime]]:
+    """
+    (version, changed_at) of a user's entries, see crud.change_marker.
+    """
+    result = await db.execute(crud.user_change_query(user_id))
+    return result.one_or_none() or (0, None)
+
+async def get_daily_stats(
+    db: AsyncSession,
+    user_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> List[Tuple[date, models.EntryType, int]]:
+    """
+    (date, entry type, count) rows from daily_stats, oldest first.
+    """
+    result = await db.execute(crud.daily_stats_query(user_id, start_date, end_date))
+    return result.all()
+
+async def search_entries(
+    db: AsyncSession,
+    user_id: int,
+    q: str,
+    limit: int = 20,
+    offset: int = 0
+) -> List[Tuple[models.Entry, str, float]]:
+    """
+    Full-text search over one user's entries, best matches first.
+    """
+    match = crud.fts_match_query(user_id, q)
+    if match is None:
+        return []
+    result = await db.execute(crud.search_query(user_id, match, limit, offset))
+    return result.all()
+
+async def tag_counts(db: AsyncSession, user_id: int) -> List[Tuple[str, int]]:
+    """
+    Number of entries per tag for a user, most used first.
+    """
+    result = await db.execute(crud.tag_counts_query(user_id))
+    return result.all()
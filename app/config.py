@@ -7,5 +7,72 @@ load_dotenv()
 # 2. Основні налаштування
 BOT_TOKEN = os.getenv("BOT_TOKEN")                 # Telegram токен
 DATABASE_URL = os.getenv("DATABASE_URL")           # Шлях до SQLite файлу
-PROMPT_HOUR = int(os.getenv("PROMPT_HOUR", 21))    # Година для щоденного запиту
-PROMPT_MINUTE = int(os.getenv("PROMPT_MINUTE", 0)) # Хвилина
\ No newline at end of file
+PROMPT_HOUR = int(os.getenv("PROMPT_HOUR", 21))    # Година щоденного запиту (місцева, якщо користувач не обрав свою)
+PROMPT_MINUTE = int(os.getenv("PROMPT_MINUTE", 0)) # Хвилина
+
+# 3. Профіль SQLite: "wal" (за замовчуванням), "durable" або "legacy"
+DB_PROFILE = os.getenv("DB_PROFILE", "wal")
+
+# Окремі PRAGMA перекривають значення з профілю (порожньо = як у профілі)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS")
+SQLITE_BUSY_TIMEOUT_MS = os.getenv("SQLITE_BUSY_TIMEOUT_MS")
+SQLITE_CACHE_SIZE = os.getenv("SQLITE_CACHE_SIZE")      # від'ємне = КіБ
+SQLITE_MMAP_SIZE = os.getenv("SQLITE_MMAP_SIZE")        # байти
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE")
+
+# 4. Пул з'єднань для файлової бази
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 20))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 40))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+
+# 5. Кеш користувачів у пам'яті процесу (0 = вимкнено)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))       # секунди
+
+# 6. Фонові експорти: куди писати файли і скільки потоків
+EXPORT_DIR = os.getenv("EXPORT_DIR", "./exports")
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))
+
+# 7. Метрики: поріг повільного запиту і скільки однакових запитів за один HTTP-запит вважати N+1
+METRICS_SLOW_QUERY_MS = float(os.getenv("METRICS_SLOW_QUERY_MS", 100))
+METRICS_N_PLUS_ONE = int(os.getenv("METRICS_N_PLUS_ONE", 10))
+
+# 8. HTTP-клієнт бота до API
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", 10))          # секунди
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", 20))
+API_RETRIES = int(os.getenv("API_RETRIES", 3))
+
+# 9. Розсилка щоденних запитань у Telegram (ліміти: ~30 повідомлень/с на бота, 1/с на чат)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+PROMPT_GLOBAL_RATE = float(os.getenv("PROMPT_GLOBAL_RATE", 25))   # повідомлень/с, 0 = без ліміту
+PROMPT_CHAT_RATE = float(os.getenv("PROMPT_CHAT_RATE", 1))        # повідомлень/с на чат
+PROMPT_CONCURRENCY = int(os.getenv("PROMPT_CONCURRENCY", 50))
+PROMPT_RETRIES = int(os.getenv("PROMPT_RETRIES", 3))            # повтори після 429/5xx/збоїв мережі
+
+# 10. Планувальник: "off" (за замовчуванням) — окремий процес `python -m api.scheduler`,
+#     "embedded" — ще й у кожному процесі API. Кожен крок виконує один процес (оренда в БД).
+SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "off")
+PROMPT_SLOT_MINUTES = int(os.getenv("PROMPT_SLOT_MINUTES", 10))  # крок планувальника; має ділити 60
+PROMPT_TICK_LIMIT = int(os.getenv("PROMPT_TICK_LIMIT", 10000))    # максимум запитань за один крок
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 300))                # поновлюється кожну третину
+JOB_RUN_RETENTION_HOURS = float(os.getenv("JOB_RUN_RETENTION_HOURS", 48))   # скільки зберігати завершені запуски в job_runs
+
+# 11. Старт API: створити схему БД (1) чи лише перевірити, що всі таблиці є (0)
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "0") == "1"
+
+# 12. Групові коміти записів (1 = увімкнено): один коміт і один fsync на групу записів
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", 256))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", 5))   # очікування після першого запису групи
+GROUP_COMMIT_DURABILITY = os.getenv("GROUP_COMMIT_DURABILITY", "normal")    # full | normal | off
+
+# 13. Шарди записів: URL файлів SQLite через кому (порожньо = усе в DATABASE_URL).
+#     Користувачі лишаються в DATABASE_URL; після зміни списку — `python -m app.maintenance rebalance-shards`
+DB_SHARDS = [url.strip() for url in os.getenv("DB_SHARDS", "").split(",") if url.strip()]
+
+# 14. Архів: записи з date_only старше ARCHIVE_AFTER_DAYS днів переносяться в стиснуті помісячні сегменти (0 = вимкнено).
+#     Експорт їх включає; /list, /entry/{date}, /search і /tags бачать лише неархівовані записи
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 0))
+ARCHIVE_HOUR = int(os.getenv("ARCHIVE_HOUR", 3))    # година щоденного запуску (UTC)
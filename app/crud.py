@@ -1,9 +1,247 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select
-from datetime import date
-from typing import List, Optional
+from sqlalchemy import Row, and_, bindparam, delete, func, insert, literal, or_, select, text, tuple_, update
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+from collections import Counter
+from itertools import islice
+import heapq
+import re
+import zlib
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
-from app import models, schemas
+from app import config, models, prompt_schedule, schemas
+from app.cache import TTLCache
+from app.pagination import decode_cursor
+
+# ------------------------
+# QUERIES
+# Shared by the functions below and by app.async_crud
+# ------------------------
+
+def parse_tags(tags: Optional[str]) -> List[str]:
+    """
+    Split a free-form tag string ("#sqlite, #Python idea") into normalized,
+    de-duplicated tag names (["sqlite", "python", "idea"]).
+    """
+    names = []
+    for raw in re.split(r"[\s,;]+", tags or ""):
+        name = raw.lstrip("#").lower()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def _with_tag(query, user_id: int, tag: Optional[str]):
+    if not tag:
+        return query
+    # A tag that normalizes to nothing (e.g. "#") matches no entries
+    name = next(iter(parse_tags(tag)), "")
+    tagged = (
+        select(models.EntryTag.entry_id)
+        .join(models.Tag, models.Tag.id == models.EntryTag.tag_id)
+        .where(models.EntryTag.user_id == user_id, models.Tag.name == name)
+    )
+    return query.where(models.Entry.id.in_(tagged))
+
+# Only the columns EntryOut needs, so list endpoints get plain rows instead of ORM objects
+ENTRY_OUT_COLUMNS = tuple(models.Entry.__table__.c[name] for name in schemas.EntryOut.model_fields)
+
+def entry_columns(query):
+    """
+    Turn one of the entry queries below into a select of ENTRY_OUT_COLUMNS,
+    keeping its filters, order and limit.
+    """
+    return query.with_only_columns(*ENTRY_OUT_COLUMNS)
+
+def _with_since(query, user_id: int, since: Optional[int]):
+    if since is None:
+        return query
+    changed = select(models.EntryVersion.entry_id).where(
+        models.EntryVersion.user_id == user_id,
+        models.EntryVersion.version > since
+    )
+    return query.where(models.Entry.id.in_(changed))
+
+def user_change_query(user_id: int):
+    return select(models.UserChange.version, models.UserChange.changed_at).where(
+        models.UserChange.user_id == user_id
+    )
+
+def user_by_external_id_query(external_id: int, source: str = "telegram"):
+    return select(models.User).where(
+        models.User.external_id == external_id,
+        models.User.source == source
+    )
+
+def user_by_id_query(user_id: int):
+    return select(models.User).where(models.User.id == user_id)
+
+def entries_by_date_query(user_id: int, entry_date: date, tag: Optional[str] = None):
+    query = select(models.Entry).where(
+        models.Entry.user_id == user_id,
+        models.Entry.date_only == entry_date
+    )
+    return _with_tag(query, user_id, tag)
+
+def recent_entries_query(user_id: int,
+                         limit: int,
+                         cursor: Optional[str] = None,
+                         tag: Optional[str] = None,
+                         since: Optional[int] = None):
+    query = _with_tag(select(models.Entry).where(models.Entry.user_id == user_id), user_id, tag)
+    query = _with_since(query, user_id, since)
+
+    if cursor:
+        timestamp, entry_id = decode_cursor(cursor)
+        # SQLite sorts NULL timestamps (legacy rows) last in this order
+        if timestamp is None:
+            query = query.where(models.Entry.timestamp.is_(None), models.Entry.id < entry_id)
+        else:
+            query = query.where(or_(
+                tuple_(models.Entry.timestamp, models.Entry.id) < tuple_(datetime.fromisoformat(timestamp), entry_id),
+                models.Entry.timestamp.is_(None)
+            ))
+
+    return (
+        query
+        .order_by(models.Entry.timestamp.desc(), models.Entry.id.desc())
+        .limit(limit)
+    )
+
+def export_query(user_id: int,
+                 start_date: Optional[date] = None,
+                 end_date: Optional[date] = None,
+                 tag: Optional[str] = None,
+                 since: Optional[int] = None):
+    query = _with_tag(select(models.Entry).where(models.Entry.user_id == user_id), user_id, tag)
+    query = _with_since(query, user_id, since)
+
+    if start_date:
+        query = query.where(models.Entry.date_only >= start_date)
+    if end_date:
+        query = query.where(models.Entry.date_only <= end_date)
+
+    return query.order_by(models.Entry.date_only, models.Entry.id)
+
+def export_page_query(user_id: int,
+                      start_date: Optional[date],
+                      end_date: Optional[date],
+                      limit: int,
+                      cursor: Optional[str] = None,
+                      tag: Optional[str] = None,
+                      since: Optional[int] = None):
+    query = export_query(user_id, start_date, end_date, tag, since)
+
+    if cursor:
+        entry_date, entry_id = decode_cursor(cursor)
+        # Entries without a date (legacy rows) come first, see export_key
+        if entry_date is None:
+            query = query.where(or_(
+                and_(models.Entry.date_only.is_(None), models.Entry.id > entry_id),
+                models.Entry.date_only.is_not(None)
+            ))
+        else:
+            query = query.where(
+                tuple_(models.Entry.date_only, models.Entry.id)
+                > tuple_(date.fromisoformat(entry_date), entry_id)
+            )
+
+    return query.limit(limit)
+
+def fts_match_query(user_id: int, q: str) -> Optional[str]:
+    """
+    Build an FTS5 MATCH expression from free text: every word must occur, and a
+    word ending in * matches as a prefix. Anything else in q is treated as a
+    separator, so user input can't inject FTS syntax. Returns None when q has no
+    searchable words.
+    """
+    words = re.findall(r"(\w+)(\*?)", q)
+    if not words:
+        return None
+    terms = [f'"{word}"{star}' for word, star in words]
+    return f'user_id : "{user_id}" AND {{text tags}} : ({" ".join(terms)})'
+
+def search_query(user_id: int, match: str, limit: int, offset: int = 0):
+    fts = models.entries_fts
+    return (
+        select(
+            models.Entry,
+            func.snippet(fts.c.entries_fts, 0, "**", "**", "…", 12).label("snippet"),
+            fts.c.rank,
+        )
+        .join_from(fts, models.Entry, models.Entry.id == fts.c.rowid)
+        .where(fts.c.entries_fts.op("MATCH")(match))
+        .order_by(fts.c.rank)
+        .limit(limit)
+        .offset(offset)
+    )
+
+def tag_counts_query(user_id: int):
+    return (
+        select(models.Tag.name, func.count().label("count"))
+        .select_from(models.EntryTag)
+        .join(models.Tag, models.Tag.id == models.EntryTag.tag_id)
+        .where(models.EntryTag.user_id == user_id)
+        .group_by(models.EntryTag.tag_id)
+        .order_by(func.count().desc(), models.Tag.name)
+    )
+
+def daily_stats_query(user_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    query = select(models.DailyStat.date_only, models.DailyStat.entry_type, models.DailyStat.count).where(
+        models.DailyStat.user_id == user_id
+    )
+    if start_date:
+        query = query.where(models.DailyStat.date_only >= start_date)
+    if end_date:
+        query = query.where(models.DailyStat.date_only <= end_date)
+    return query.order_by(models.DailyStat.date_only)
+
+def entry_values(entry: schemas.EntryIn) -> dict:
+    values = entry.model_dump()
+    if values["date_only"] is None:
+        values["date_only"] = entry.timestamp.date()
+    return values
+
+# ------------------------
+# USER CACHE
+# User lookups run on every entry and every bot message, so they are served
+# from a per-process cache of UserOut snapshots. Writes made through this
+# module invalidate it; writes made by another process show up after
+# USER_CACHE_TTL seconds at most.
+# ------------------------
+
+user_cache = TTLCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+
+def _user_cache_keys(user_id: int, external_id: int, source: str) -> Tuple[tuple, tuple]:
+    return ("id", user_id), ("external_id", external_id, source)
+
+def cache_user(user: Optional[models.User]) -> Optional[schemas.UserOut]:
+    """
+    Store a snapshot of user under both of its lookup keys and return it.
+    Misses (None) are not cached, so a user created later is found at once.
+    """
+    if user is None:
+        return None
+    snapshot = schemas.UserOut.model_validate(user)
+    for key in _user_cache_keys(snapshot.id, snapshot.external_id, snapshot.source):
+        user_cache.set(key, snapshot)
+    return snapshot
+
+def _invalidate_user(keys: Iterable[tuple]) -> None:
+    for key in keys:
+        user_cache.pop(key)
+
+def get_cached_user_by_id(db: Session, user_id: int) -> Optional[schemas.UserOut]:
+    """
+    get_user_by_id through the user cache. Returns a read-only snapshot.
+    """
+    return user_cache.get(("id", user_id)) or cache_user(get_user_by_id(db, user_id))
+
+def get_cached_user_by_external_id(db: Session, external_id: int, source: str = "telegram") -> Optional[schemas.UserOut]:
+    """
+    get_user_by_external_id through the user cache. Returns a read-only snapshot.
+    """
+    return (user_cache.get(("external_id", external_id, source))
+            or cache_user(get_user_by_external_id(db, external_id, source)))
 
 # ------------------------
 # USER CRUD
@@ -13,15 +251,11 @@ def get_user_by_external_id(db: Session, external_id: int, source: str = "telegr
     """
     Fetch a user by their external ID and source (e.g., Telegram user_id + platform).
     """
-    return db.execute(
-        select(models.User).where(
-            models.User.external_id == external_id,
-            models.User.source == source
-        )
-    ).scalar_one_or_none()
+    return db.execute(user_by_external_id_query(external_id, source)).scalar_one_or_none()
 
-def create_user(db: Session, user: schemas.UserCreate) -> models.User:
-    db_user = models.User(**user.model_dump())
+def create_user(db: Session, user: schemas.UserCreate, shard_id: Optional[int] = None) -> models.User:
+    db_user = models.User(**user.model_dump(), shard_id=shard_id)
+    db_user.next_prompt_at = prompt_schedule.next_prompt_at(user.timezone, user.prompt_time, prompt_schedule.utc_now())
     db.add(db_user)
     try:
         db.commit()
@@ -31,22 +265,20 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.User:
         db.rollback()
         raise ValueError("User with this external_id and source already exists")
 
-def get_or_create_user(db: Session, user: schemas.UserCreate) -> models.User:
+def get_or_create_user(db: Session, user: schemas.UserCreate) -> schemas.UserOut:
     """
     Return an existing user, or create one if not found.
     """
-    existing_user = get_user_by_external_id(db, user.external_id, user.source)
+    existing_user = get_cached_user_by_external_id(db, user.external_id, user.source)
     if existing_user:
         return existing_user
-    return create_user(db, user)
+    return cache_user(create_user(db, user))
 
 def get_user_by_id(db: Session, user_id: int) -> Optional[models.User]:
     """
     Fetch a user by internal ID (primary key).
     """
-    return db.execute(
-        select(models.User).where(models.User.id == user_id)
-    ).scalar_one_or_none()
+    return db.execute(user_by_id_query(user_id)).scalar_one_or_none()
 
 def update_user_by_id(db: Session, user_id: int, updates: schemas.UserUpdate) -> Optional[models.User]:
     """
@@ -56,11 +288,18 @@ def update_user_by_id(db: Session, user_id: int, updates: schemas.UserUpdate) ->
     if not user:
         return None
 
+    # source is part of a cache key, so drop the keys the user had before the update
+    cache_keys = _user_cache_keys(user.id, user.external_id, user.source)
     update_data = updates.model_dump(exclude_unset=True)
+    if update_data.get("timezone", "") is None:
+        del update_data["timezone"]  # can't be unset, only changed
     for key, value in update_data.items():
         setattr(user, key, value)
+    if {"timezone", "prompt_time"} & update_data.keys() and user.is_active:
+        user.next_prompt_at = prompt_schedule.next_prompt_at(user.timezone, user.prompt_time, prompt_schedule.utc_now())
 
     db.commit()
+    _invalidate_user(cache_keys)
     db.refresh(user)
     return user
 
@@ -72,10 +311,39 @@ def delete_user_by_id(db: Session, user_id: int) -> bool:
     if not user:
         return False
 
+    cache_keys = _user_cache_keys(user.id, user.external_id, user.source)
     db.delete(user)
     db.commit()
+    _invalidate_user(cache_keys)
     return True
 
+def move_user_shard(db: Session, user_id: int, from_shard: Optional[int], to_shard: Optional[int]) -> bool:
+    """
+    Point a user at another shard, unless their shard_id is no longer
+    from_shard. Returns whether it was changed.
+    """
+    user = get_user_by_id(db, user_id)
+    moved = db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.shard_id.is_not_distinct_from(from_shard))
+        .values(shard_id=to_shard)
+    ).rowcount == 1
+    db.commit()
+    if user:
+        _invalidate_user(_user_cache_keys(user.id, user.external_id, user.source))
+    return moved
+
+def existing_user_ids(db: Session, user_ids: Iterable[int]) -> Set[int]:
+    """
+    Return the subset of user_ids that exist, in a single query.
+    """
+    ids = set(user_ids)
+    if not ids:
+        return set()
+    return set(db.execute(
+        select(models.User.id).where(models.User.id.in_(ids))
+    ).scalars())
+
 def deactivate_user(db: Session, user_id: int) -> bool:
     """
     Mark user as inactive instead of deleting.
@@ -84,7 +352,9 @@ def deactivate_user(db: Session, user_id: int) -> bool:
     if not user:
         return False
     user.is_active = False
+    user.next_prompt_at = None
     db.commit()
+    _invalidate_user(_user_cache_keys(user.id, user.external_id, user.source))
     return True
 
 
@@ -92,52 +362,733 @@ def deactivate_user(db: Session, user_id: int) -> bool:
 # ENTRY CRUD
 # ------------------------
 
+def upsert_entries(*returning):
+    """
+    INSERT ... RETURNING for entry_values() dicts that doesn't store a message
+    twice: an entry whose (user_id, source, message_id) is already stored is
+    not inserted, and RETURNING gives the stored row instead. The extra
+    `created` column tells the two apart.
+    """
+    entry = models.Entry
+    return (
+        sqlite_insert(entry)
+        .on_conflict_do_update(
+            index_elements=[entry.user_id, entry.source, entry.message_id],
+            index_where=entry.message_id.is_not(None),
+            # A no-op update, so the stored row is returned; id is in no trigger's UPDATE OF list
+            set_={entry.id: entry.id}
+        )
+        # Also true for a repeat of the row this connection inserted last,
+        # which only costs an attach_tags that changes nothing
+        .returning(*returning, (entry.id == func.last_insert_rowid()).label("created"))
+    )
+
 def create_entry(db: Session, entry: schemas.EntryIn) -> models.Entry:
     """
-    Create and store a new diary entry in the database.
+    Create and store a new diary entry in the database. Repeating an entry
+    with the same user, source and message_id returns the stored one.
     """
-    db_entry = models.Entry(**entry.model_dump())
-    db.add(db_entry)
+    db_entry, created = db.execute(
+        upsert_entries(models.Entry).values(entry_values(entry)),
+        execution_options={"populate_existing": True}
+    ).one()
+    if created:
+        attach_tags(db, [(db_entry.id, db_entry.user_id, db_entry.tags)])
     db.commit()
-    db.refresh(db_entry)
     return db_entry
 
-def get_entries_by_date(db: Session, user_id: int, entry_date: date) -> List[models.Entry]:
+def attach_tags(db: Session, entries: Iterable[Tuple[int, int, Optional[str]]]) -> None:
+    """
+    Record the parsed tags of (entry_id, user_id, tags) rows in entry_tags,
+    creating missing tags. Safe to repeat for the same entry. Does not commit,
+    so it joins the transaction that wrote the entries.
+    """
+    links = [(entry_id, user_id, name) for entry_id, user_id, tags in entries for name in parse_tags(tags)]
+    if not links:
+        return
+
+    names = {name for _, _, name in links}
+    db.execute(
+        sqlite_insert(models.Tag).on_conflict_do_nothing(index_elements=["name"]),
+        [{"name": name} for name in names]
+    )
+    tag_ids = dict(db.execute(
+        select(models.Tag.name, models.Tag.id).where(models.Tag.name.in_(names))
+    ).all())
+    db.execute(
+        sqlite_insert(models.EntryTag).on_conflict_do_nothing(),
+        [{"entry_id": entry_id, "user_id": user_id, "tag_id": tag_ids[name]} for entry_id, user_id, name in links]
+    )
+
+def backfill_tags(db: Session, chunk_size: int = 1000) -> int:
+    """
+    Parse the tag strings of existing entries into entry_tags, one committed
+    chunk at a time. Returns the number of entries processed.
+    """
+    processed, after_id = 0, 0
+    while True:
+        rows = db.execute(
+            select(models.Entry.id, models.Entry.user_id, models.Entry.tags)
+            .where(models.Entry.id > after_id, models.Entry.tags.is_not(None))
+            .order_by(models.Entry.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return processed
+        attach_tags(db, rows)
+        db.commit()
+        processed += len(rows)
+        after_id = rows[-1].id
+
+def tag_counts(db: Session, user_id: int) -> List[Tuple[str, int]]:
     """
-    Retrieve all entries for a specific user and date.
+    Number of entries per tag for a user, most used first.
+    """
+    return db.execute(tag_counts_query(user_id)).all()
+
+def insert_entry_rows(db: Session, rows: List[dict]) -> List[Row]:
+    """
+    Store entry_values() dicts with at most two multi-row INSERTs and index the
+    tags of the new ones, without committing. Rows with a message_id already
+    stored (see upsert_entries) aren't inserted again. Returns the stored rows
+    (ENTRY_OUT_COLUMNS) in input order.
+    """
+    keyed = [row for row in rows if row["message_id"] is not None]
+    plain = [row for row in rows if row["message_id"] is None]
+    new, by_key = [], {}
+    if keyed:
+        # An upsert's RETURNING order isn't guaranteed, so rows are matched back by key
+        for row in db.execute(upsert_entries(*ENTRY_OUT_COLUMNS), keyed):
+            by_key[(row.user_id, row.source, row.message_id)] = row
+            if row.created:
+                new.append(row)
+    inserted = []
+    if plain:
+        # Without a message_id nothing can conflict
+        inserted = db.execute(
+            insert(models.Entry).returning(*ENTRY_OUT_COLUMNS, sort_by_parameter_order=True),
+            plain
+        ).all()
+        new.extend(inserted)
+    attach_tags(db, [(row.id, row.user_id, row.tags) for row in new])
+
+    inserted = iter(inserted)
+    return [
+        by_key[(row["user_id"], row["source"], row["message_id"])] if row["message_id"] is not None else next(inserted)
+        for row in rows
+    ]
+
+def create_entries_bulk(db: Session, entries: List[schemas.EntryIn], batch_size: int = 500) -> List[int]:
+    """
+    Insert many entries using multi-row INSERTs and one commit per batch.
+    Callers must have checked that the users exist. Returns the ids in input
+    order; an entry whose message is already stored gets the stored entry's id.
+    """
+    ids = []
+    for start in range(0, len(entries), batch_size):
+        batch = [entry_values(entry) for entry in entries[start:start + batch_size]]
+        ids.extend(row.id for row in insert_entry_rows(db, batch))
+        db.commit()
+    return ids
+
+def delete_user_entries(db: Session, user_id: int) -> int:
+    """
+    Delete a user's entries and the rows kept for them (tags, deliveries,
+    change version, archived segments and their stats) without committing.
+    The search index follows by trigger. Returns the number of entries deleted.
+    """
+    entry_ids = select(models.Entry.id).where(models.Entry.user_id == user_id)
+    db.execute(delete(models.PromptDelivery).where(models.PromptDelivery.entry_id.in_(entry_ids)))
+    db.execute(delete(models.EntryTag).where(models.EntryTag.user_id == user_id))
+    deleted = db.execute(delete(models.Entry).where(models.Entry.user_id == user_id)).rowcount
+    db.execute(delete(models.UserChange).where(models.UserChange.user_id == user_id))
+    # Left over from archived entries once the triggers have uncounted the rest
+    db.execute(delete(models.DailyStat).where(models.DailyStat.user_id == user_id))
+    db.execute(delete(models.EntryArchive).where(models.EntryArchive.user_id == user_id))
+    return deleted
+
+def dedupe_entries(db: Session) -> int:
+    """
+    Create the ux_entries_message index if this database predates it, first
+    deleting the later copies of entries stored twice for the same message.
+    Returns the number of entries deleted.
+    """
+    duplicates = (
+        "SELECT id FROM entries e WHERE message_id IS NOT NULL AND EXISTS ("
+        "SELECT 1 FROM entries k WHERE k.user_id = e.user_id AND k.source = e.source "
+        "AND k.message_id = e.message_id AND k.id < e.id)"
+    )
+    db.execute(text(f"DELETE FROM entry_tags WHERE entry_id IN ({duplicates})"))
+    deleted = db.execute(text(f"DELETE FROM entries WHERE id IN ({duplicates})")).rowcount
+    index = next(index for index in models.Entry.__table__.indexes if index.name == "ux_entries_message")
+    index.create(db.connection(), checkfirst=True)
+    db.commit()
+    return deleted
+
+def schedule_unscheduled_users(db: Session, now: datetime, limit: int = 1000) -> int:
+    """
+    Set next_prompt_at for up to limit active users that have none (users
+    created before per-user scheduling existed). Returns how many were set.
+    """
+    users = db.execute(
+        select(models.User.id, models.User.timezone, models.User.prompt_time)
+        .where(models.User.next_prompt_at.is_(None), models.User.is_active.is_(True))
+        .order_by(models.User.id)
+        .limit(limit)
+    ).all()
+    if users:
+        db.execute(update(models.User), [
+            {"id": user_id, "next_prompt_at": prompt_schedule.next_prompt_at(tz_name, prompt_time, now)}
+            for user_id, tz_name, prompt_time in users
+        ])
+        db.commit()
+    return len(users)
+
+def due_prompt_users(db: Session, now: datetime, limit: int = 1000) -> List[Row]:
+    """
+    (id, timezone, prompt_time, next_prompt_at, shard_id) of active users whose
+    prompt slot has started, oldest slot first. A range read on ix_users_next_prompt_at.
     """
     return db.execute(
-        select(models.Entry).where(
-            models.Entry.user_id == user_id,
-            models.Entry.date_only == entry_date
-        )
-    ).scalars().all()
+        select(models.User.id, models.User.timezone, models.User.prompt_time, models.User.next_prompt_at,
+               models.User.shard_id)
+        .where(models.User.next_prompt_at <= now, models.User.is_active.is_(True))
+        .order_by(models.User.next_prompt_at, models.User.id)
+        .limit(limit)
+    ).all()
 
-def list_recent_entries(db: Session, user_id: int, limit: int = 5) -> List[models.Entry]:
+def create_scheduled_prompts(db: Session, due: Sequence[Row], prompts: Sequence[str], offset: int = 0) -> Set[date]:
     """
-    Get the most recent entries for a user, limited by count.
+    Give each due user (rows of due_prompt_users) a prompted entry for their
+    local date, unless they already have one, and move them to their next
+    slot, in one transaction. Returns the prompt dates written.
+
+    Both statements are guarded (NOT EXISTS and a compare-and-set on
+    next_prompt_at), so overlapping ticks never prompt a user twice.
+    """
+    entries, moves, dates = [], [], set()
+    for user in due:
+        prompt_date = prompt_schedule.prompt_date(user.timezone, user.prompt_time, user.next_prompt_at)
+        dates.add(prompt_date)
+        entries.append({
+            "user_id": user.id,
+            "text": prompts[(user.id + offset) % len(prompts)],
+            "timestamp": user.next_prompt_at,
+            "date_only": prompt_date,
+        })
+        moves.append({
+            "user_id": user.id,
+            "due_at": user.next_prompt_at,
+            "next_at": prompt_schedule.next_prompt_at(user.timezone, user.prompt_time, user.next_prompt_at),
+        })
+    if not due:
+        return dates
+
+    already_prompted = select(models.Entry.id).where(
+        models.Entry.user_id == bindparam("user_id"),
+        models.Entry.date_only == bindparam("date_only", type_=models.Entry.date_only.type),
+        models.Entry.source == "prompted"
+    ).exists()
+    rows = select(
+        bindparam("user_id"),
+        bindparam("text"),
+        literal(models.EntryType.reflection, models.Entry.entry_type.type),
+        literal("prompted"),
+        bindparam("timestamp", type_=models.Entry.timestamp.type),
+        bindparam("date_only", type_=models.Entry.date_only.type),
+    ).where(~already_prompted)
+    # Core statements on the tables: executemany with custom WHERE clauses,
+    # not ORM bulk operations by primary key
+    entries_table, users_table = models.Entry.__table__, models.User.__table__
+    db.execute(
+        insert(entries_table).from_select(["user_id", "text", "entry_type", "source", "timestamp", "date_only"], rows),
+        entries
+    )
+    db.execute(
+        update(users_table)
+        .where(users_table.c.id == bindparam("user_id"), users_table.c.next_prompt_at == bindparam("due_at"))
+        .values(next_prompt_at=bindparam("next_at")),
+        moves
+    )
+    db.commit()
+    return dates
+
+def pending_prompt_deliveries(
+    db: Session,
+    prompt_date: date,
+    after_entry_id: int = 0,
+    limit: int = 1000
+) -> List[Tuple[int, int, str]]:
+    """
+    (entry_id, chat_id, text) of prompted entries for prompt_date that still
+    have to be sent: never attempted, or given up on transient errors.
+    Telegram users only, in entry id order after after_entry_id.
     """
+    delivery = models.PromptDelivery
     return db.execute(
-        select(models.Entry)
-        .where(models.Entry.user_id == user_id)
-        .order_by(models.Entry.timestamp.desc())
+        select(models.Entry.id, models.User.external_id, models.Entry.text)
+        .join(models.User, models.User.id == models.Entry.user_id)
+        .outerjoin(delivery, delivery.entry_id == models.Entry.id)
+        .where(
+            models.Entry.date_only == prompt_date,
+            models.Entry.source == "prompted",
+            models.Entry.id > after_entry_id,
+            models.User.source == "telegram",
+            models.User.is_active.is_(True),
+            (delivery.entry_id.is_(None)) | (delivery.status == models.DeliveryStatus.retry),
+        )
+        .order_by(models.Entry.id)
         .limit(limit)
-    ).scalars().all()
+    ).all()
+
+def record_prompt_deliveries(db: Session, results: Sequence[dict]) -> None:
+    """
+    Upsert delivery outcomes ({entry_id, status, attempts, telegram_message_id,
+    error}) in one statement and commit. Attempts add up across runs.
+    """
+    if not results:
+        return
+    now = datetime.now(timezone.utc)
+    stmt = sqlite_insert(models.PromptDelivery).values([{**result, "updated_at": now} for result in results])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["entry_id"],
+        set_={
+            "status": stmt.excluded.status,
+            "attempts": models.PromptDelivery.attempts + stmt.excluded.attempts,
+            "telegram_message_id": stmt.excluded.telegram_message_id,
+            "error": stmt.excluded.error,
+            "updated_at": stmt.excluded.updated_at,
+        }
+    ))
+    db.commit()
+
+def get_entries_by_date(db: Session, user_id: int, entry_date: date, tag: Optional[str] = None) -> List[models.Entry]:
+    """
+    Retrieve all entries for a specific user and date, optionally only those with a tag.
+    """
+    return db.execute(entries_by_date_query(user_id, entry_date, tag)).scalars().all()
+
+def list_recent_entries(
+    db: Session,
+    user_id: int,
+    limit: int = 5,
+    cursor: Optional[str] = None,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
+) -> List[models.Entry]:
+    """
+    Get the most recent entries for a user, limited by count.
+    Pass the cursor of the previous page to continue further back in time;
+    every page is an index range seek, so deep pages cost the same as the first.
+    With since, only entries written after that change version are returned.
+    """
+    return db.execute(recent_entries_query(user_id, limit, cursor, tag, since)).scalars().all()
 
 def export_entries(
     db: Session,
     user_id: int,
     start_date: Optional[date] = None,
-    end_date: Optional[date] = None
+    end_date: Optional[date] = None,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
+) -> List[models.Entry]:
+    """
+    Export all entries for a user between start_date and end_date (inclusive),
+    archived ones included (as EntryOut).
+    With since, only entries written after that change version are returned.
+    """
+    entries = db.execute(export_query(user_id, start_date, end_date, tag, since)).scalars().all()
+    return list(heapq.merge(entries, archived_entries(db, user_id, start_date, end_date, tag, since), key=export_key))
+
+def export_entry_rows(
+    db: Session,
+    user_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
+) -> List[Row]:
+    """
+    Same as export_entries, as rows of ENTRY_OUT_COLUMNS instead of ORM objects.
+    """
+    rows = db.execute(entry_columns(export_query(user_id, start_date, end_date, tag, since))).all()
+    return list(heapq.merge(rows, archived_entries(db, user_id, start_date, end_date, tag, since), key=export_key))
+
+def export_entries_page(
+    db: Session,
+    user_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
 ) -> List[models.Entry]:
     """
-    Export all entries for a user between start_date and end_date (inclusive).
+    One page of export_entries, continuing after the (date_only, id) in cursor.
+    """
+    query = export_page_query(user_id, start_date, end_date, limit, cursor, tag, since)
+    entries = db.execute(query).scalars().all()
+    segments = db.execute(archive_query(user_id, start_date, end_date, cursor)).scalars()
+    archived = filter_archived(segments, start_date, end_date, tag, since, cursor)
+    return list(islice(heapq.merge(entries, archived, key=export_key), limit))
+
+def iter_export_entries(
+    db: Session,
+    user_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    chunk_size: int = 500,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
+) -> Iterator[Row]:
+    """
+    Stream the same rows as export_entry_rows, fetching them chunk_size at a time
+    (and archived entries one segment at a time) so memory use doesn't grow
+    with the size of the archive.
+    """
+    query = entry_columns(export_query(user_id, start_date, end_date, tag, since)).execution_options(yield_per=chunk_size)
+    result = db.execute(query)
+    segments = db.execute(archive_query(user_id, start_date, end_date).execution_options(yield_per=1)).scalars()
+    try:
+        yield from heapq.merge(result, filter_archived(segments, start_date, end_date, tag, since), key=export_key)
+    finally:
+        result.close()
+        segments.close()
+
+def change_marker(db: Session, user_id: int) -> Tuple[int, Optional[datetime]]:
+    """
+    (version, changed_at) of a user's entries: one primary-key read that
+    changes whenever any of their entries is written. (0, None) if never.
+    """
+    return db.execute(user_change_query(user_id)).one_or_none() or (0, None)
+
+def search_entries(
+    db: Session,
+    user_id: int,
+    q: str,
+    limit: int = 20,
+    offset: int = 0
+) -> List[Tuple[models.Entry, str, float]]:
+    """
+    Full-text search over one user's entries, best matches first.
+    Returns (entry, highlighted snippet, rank) tuples.
+    """
+    match = fts_match_query(user_id, q)
+    if match is None:
+        return []
+    return db.execute(search_query(user_id, match, limit, offset)).all()
+
+def rebuild_search_index(db: Session) -> None:
+    """
+    Create the full-text index if this database predates it, and repopulate it
+    from the entries table.
+    """
+    for statement in models.SEARCH_INDEX_DDL:
+        db.execute(text(statement))
+    db.execute(text("INSERT INTO entries_fts(entries_fts) VALUES ('rebuild')"))
+    db.commit()
+
+
+# ------------------------
+# DAILY STATISTICS
+# ------------------------
+
+def get_daily_stats(
+    db: Session,
+    user_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> List[Tuple[date, models.EntryType, int]]:
+    """
+    (date, entry type, count) rows from daily_stats, oldest first.
+    """
+    return db.execute(daily_stats_query(user_id, start_date, end_date)).all()
+
+def rebuild_daily_stats(db: Session) -> None:
+    """
+    Create the daily_stats triggers if this database predates them, and
+    recount the table from entries and archived segments.
+    """
+    for statement in models.DAILY_STATS_DDL:
+        db.execute(text(statement))
+    db.execute(text("DELETE FROM daily_stats"))
+    db.execute(text(
+        "INSERT INTO daily_stats(user_id, date_only, entry_type, count) "
+        "SELECT user_id, date_only, entry_type, count(*) FROM entries "
+        "WHERE date_only IS NOT NULL GROUP BY user_id, date_only, entry_type"
+    ))
+    segments = db.execute(select(models.EntryArchive.user_id, models.EntryArchive.month)).all()
+    # Archived entries still count; one segment is decoded at a time
+    for user_id, month in segments:
+        data = db.scalar(select(models.EntryArchive.data).where(models.EntryArchive.user_id == user_id,
+                                                                models.EntryArchive.month == month))
+        _count_archived(db, user_id, decode_segment(data))
+    db.commit()
+
+
+# ------------------------
+# ARCHIVED ENTRIES
+# Entries dated before the archive cutoff move out of entries into one
+# compressed segment per user and month (models.EntryArchive), so the hot
+# table and its indexes only hold recent entries. Exports merge the segments
+# back in, and daily_stats keeps counting them; /list, /entry/{date},
+# search, tags and since= see entries that are not archived only.
+# ------------------------
+
+def archive_cutoff(today: date, after_days: int) -> date:
+    """
+    Entries dated before this are archived: the first day of the month of
+    today - after_days, so segments are written for whole months.
     """
-    query = select(models.Entry).where(models.Entry.user_id == user_id)
+    return (today - timedelta(days=after_days)).replace(day=1)
+
+def encode_segment(entries: Iterable) -> bytes:
+    lines = [schemas.EntryOut.model_validate(entry, from_attributes=True).model_dump_json() for entry in entries]
+    return zlib.compress("\n".join(lines).encode("utf-8"))
+
+def decode_segment(data: bytes) -> List[schemas.EntryOut]:
+    return [schemas.EntryOut.model_validate_json(line) for line in zlib.decompress(data).decode("utf-8").splitlines()]
 
+def export_key(entry) -> tuple:
+    # export_query's ORDER BY date_only, id; SQLite sorts entries without a date first
+    return (entry.date_only is not None, entry.date_only or date.min, entry.id)
+
+def archive_query(user_id: int,
+                  start_date: Optional[date] = None,
+                  end_date: Optional[date] = None,
+                  cursor: Optional[str] = None):
+    """
+    The segments that can hold a user's entries in an export range, oldest first.
+    """
+    entry_date = decode_cursor(cursor)[0] if cursor else None
+    if entry_date is not None:
+        after = date.fromisoformat(entry_date)
+        start_date = max(start_date, after) if start_date else after
+    query = select(models.EntryArchive.data).where(models.EntryArchive.user_id == user_id)
     if start_date:
-        query = query.where(models.Entry.date_only >= start_date)
+        query = query.where(models.EntryArchive.month >= start_date.replace(day=1))
     if end_date:
-        query = query.where(models.Entry.date_only <= end_date)
+        query = query.where(models.EntryArchive.month <= end_date)
+    return query.order_by(models.EntryArchive.month)
+
+def filter_archived(segments: Iterable[bytes],
+                    start_date: Optional[date] = None,
+                    end_date: Optional[date] = None,
+                    tag: Optional[str] = None,
+                    since: Optional[int] = None,
+                    cursor: Optional[str] = None) -> Iterator[schemas.EntryOut]:
+    """
+    The entries of archive_query's segments that export_query (or
+    export_page_query, with cursor) would return, in export order.
+    """
+    if since is not None:
+        # Archived entries have no change version left, so a sync never returns them
+        return
+    name = next(iter(parse_tags(tag)), "") if tag else None
+    after = None
+    if cursor:
+        entry_date, entry_id = decode_cursor(cursor)
+        after = (entry_date is not None, date.fromisoformat(entry_date) if entry_date else date.min, entry_id)
+    for data in segments:
+        for entry in decode_segment(data):
+            if start_date and entry.date_only < start_date or end_date and entry.date_only > end_date:
+                continue
+            if name is not None and name not in parse_tags(entry.tags):
+                continue
+            if after and export_key(entry) <= after:
+                continue
+            yield entry
+
+def archived_entries(
+    db: Session,
+    user_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    tag: Optional[str] = None,
+    since: Optional[int] = None
+) -> List[schemas.EntryOut]:
+    """
+    A user's archived entries matching the export filters, in export order.
+    """
+    segments = db.execute(archive_query(user_id, start_date, end_date)).scalars()
+    return list(filter_archived(segments, start_date, end_date, tag, since))
+
+def _count_archived(db: Session, user_id: int, entries: Iterable) -> None:
+    counts = Counter((entry.date_only, entry.entry_type) for entry in entries)
+    if not counts:
+        return
+    stmt = sqlite_insert(models.DailyStat)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", "date_only", "entry_type"],
+            set_={"count": models.DailyStat.count + stmt.excluded.count}
+        ),
+        [{"user_id": user_id, "date_only": day, "entry_type": entry_type, "count": count}
+         for (day, entry_type), count in counts.items()]
+    )
 
-    return db.execute(query.order_by(models.Entry.date_only)).scalars().all()
+def archive_segment(db: Session, user_id: int, month: date, entry_ids: Sequence[int]) -> int:
+    """
+    Move entries (of user_id, dated in month) into the month's segment and
+    delete them with their tags and deliveries, without committing. They
+    stay counted in daily_stats. Returns the number moved.
+    """
+    rows = db.execute(
+        select(*ENTRY_OUT_COLUMNS).where(models.Entry.id.in_(entry_ids)).order_by(models.Entry.date_only, models.Entry.id)
+    ).all()
+    if not rows:
+        return 0
+    moved = [schemas.EntryOut.model_validate(row, from_attributes=True) for row in rows]
+
+    segment = db.get(models.EntryArchive, (user_id, month))
+    if segment is None:
+        segment = models.EntryArchive(user_id=user_id, month=month)
+        db.add(segment)
+        entries = moved
+    else:
+        # Entries dated back after the month was archived
+        entries = sorted(decode_segment(segment.data) + moved, key=export_key)
+    segment.entries = len(entries)
+    segment.data = encode_segment(entries)
+    segment.updated_at = datetime.now(timezone.utc)
+
+    ids = [entry.id for entry in moved]
+    db.execute(delete(models.PromptDelivery).where(models.PromptDelivery.entry_id.in_(ids)))
+    db.execute(delete(models.EntryTag).where(models.EntryTag.entry_id.in_(ids)))
+    db.execute(delete(models.Entry).where(models.Entry.id.in_(ids)))
+    # The delete trigger uncounted them
+    _count_archived(db, user_id, moved)
+    return len(moved)
+
+def archive_entries(db: Session, before: date) -> int:
+    """
+    Archive every entry dated before `before`, committing one segment (user
+    and month) at a time, so the write lock is held per segment and a rerun
+    continues where an interrupted one stopped. Returns the number of
+    entries archived.
+    """
+    entry = models.Entry
+    schema = db.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'entries'"))
+    if "AUTOINCREMENT" not in (schema or "").upper():
+        # Without it SQLite reuses the ids of deleted top rows, which archived entries still carry
+        raise RuntimeError("entries predates AUTOINCREMENT ids; archiving needs a database created with it")
+    old = entry.date_only < before
+    archived = 0
+    for user_id in db.scalars(select(entry.user_id).where(old).distinct()).all():
+        while True:
+            first = db.scalar(select(func.min(entry.date_only)).where(entry.user_id == user_id, old))
+            if first is None:
+                break
+            month = first.replace(day=1)
+            next_month = (month + timedelta(days=32)).replace(day=1)
+            entry_ids = db.scalars(
+                select(entry.id).where(entry.user_id == user_id, old,
+                                       entry.date_only >= month, entry.date_only < next_month)
+            ).all()
+            archived += archive_segment(db, user_id, month, entry_ids)
+            db.commit()
+    if archived and db.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")).first():
+        # Planner statistics from before would describe a much bigger table
+        db.execute(text("ANALYZE entries"))
+        db.commit()
+    return archived
+
+# ------------------------
+# EXPORT JOBS
+# ------------------------
+
+def create_export_job(db: Session, job: schemas.ExportJobIn) -> models.ExportJob:
+    """
+    Record a queued export job. The file is written later by app.export_jobs.
+    """
+    db_job = models.ExportJob(**job.model_dump())
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_export_job(db: Session, job_id: int) -> Optional[models.ExportJob]:
+    return db.get(models.ExportJob, job_id)
+
+# ------------------------
+# SCHEDULED JOB RUNS
+# ------------------------
+
+def claim_job_run(db: Session, job_id: str, run_key: str, owner: str, lease_seconds: float) -> bool:
+    """
+    Take the lease on a job run in one statement: insert it, or take over a
+    run that failed or whose lease expired. Returns False if the run is done
+    or another owner holds a live lease.
+    """
+    now = datetime.now(timezone.utc)
+    run = models.JobRun
+    stmt = sqlite_insert(run).values(
+        job_id=job_id, run_key=run_key, status=models.JobRunStatus.running, owner=owner,
+        lease_until=now + timedelta(seconds=lease_seconds), attempts=1, started_at=now,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["job_id", "run_key"],
+        set_={
+            "status": stmt.excluded.status,
+            "owner": stmt.excluded.owner,
+            "lease_until": stmt.excluded.lease_until,
+            "attempts": run.attempts + 1,
+            "error": None,
+            "started_at": stmt.excluded.started_at,
+            "finished_at": None,
+        },
+        where=(run.status == models.JobRunStatus.failed)
+              | ((run.status == models.JobRunStatus.running) & (run.lease_until < now)),
+    ).returning(run.owner)
+    claimed = db.execute(stmt).scalar_one_or_none() == owner
+    db.commit()
+    return claimed
+
+def renew_job_run(db: Session, job_id: str, run_key: str, owner: str, lease_seconds: float) -> bool:
+    """
+    Extend a lease still held by owner. False means it was lost to another process.
+    """
+    result = db.execute(
+        update(models.JobRun)
+        .where(models.JobRun.job_id == job_id, models.JobRun.run_key == run_key,
+               models.JobRun.owner == owner, models.JobRun.status == models.JobRunStatus.running)
+        .values(lease_until=datetime.now(timezone.utc) + timedelta(seconds=lease_seconds))
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def finish_job_run(db: Session, job_id: str, run_key: str, owner: str, error: Optional[str] = None,
+                   retention_hours: float = config.JOB_RUN_RETENTION_HOURS) -> None:
+    """
+    Record how owner's run ended and, in the same transaction, delete runs
+    that finished more than retention_hours ago. Their slots are long past,
+    so no tick asks for them again.
+    """
+    now = datetime.now(timezone.utc)
+    db.execute(
+        update(models.JobRun)
+        .where(models.JobRun.job_id == job_id, models.JobRun.run_key == run_key, models.JobRun.owner == owner)
+        .values(status=models.JobRunStatus.failed if error else models.JobRunStatus.done,
+                error=error, lease_until=now, finished_at=now)
+    )
+    db.execute(
+        delete(models.JobRun)
+        .where(models.JobRun.status != models.JobRunStatus.running,
+               models.JobRun.finished_at < now - timedelta(hours=retention_hours))
+    )
+    db.commit()
+
+def get_job_run(db: Session, job_id: str, run_key: str) -> Optional[models.JobRun]:
+    return db.get(models.JobRun, (job_id, run_key))
+
+def job_run_active(db: Session, job_id: str) -> bool:
+    """
+    Whether any run of job_id holds a live lease.
+    """
+    return db.execute(
+        select(models.JobRun.run_key)
+        .where(models.JobRun.job_id == job_id, models.JobRun.status == models.JobRunStatus.running,
+               models.JobRun.lease_until > datetime.now(timezone.utc))
+        .limit(1)
+    ).first() is not None
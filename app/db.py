@@ -1,13 +1,167 @@
-from sqlalchemy import create_engine
+from functools import partial
+from time import perf_counter
+from typing import Iterable, List, Optional
+from sqlalchemy import create_engine, event, inspect, literal, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+from app import config, metrics
 from app.config import DATABASE_URL
 
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite"}
+
+# PRAGMAs applied to every new SQLite connection, per profile
+SQLITE_PROFILES = {
+    # SQLite's own defaults: rollback journal, fsync on every commit
+    "legacy": {},
+    # Readers never block the writer; fsync only at checkpoints.
+    # A crash can lose the last commits but never corrupts the database.
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+    # WAL concurrency with an fsync on every commit
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+}
+
+def sqlite_pragmas(profile: str = config.DB_PROFILE) -> dict:
+    """
+    PRAGMAs for a profile, with any SQLITE_* environment overrides applied.
+    """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE {profile!r}, expected one of {sorted(SQLITE_PROFILES)}")
+
+    pragmas = dict(SQLITE_PROFILES[profile])
+    overrides = {
+        "journal_mode": config.SQLITE_JOURNAL_MODE,
+        "synchronous": config.SQLITE_SYNCHRONOUS,
+        "busy_timeout": config.SQLITE_BUSY_TIMEOUT_MS,
+        "cache_size": config.SQLITE_CACHE_SIZE,
+        "mmap_size": config.SQLITE_MMAP_SIZE,
+        "temp_store": config.SQLITE_TEMP_STORE,
+    }
+    pragmas.update({name: value for name, value in overrides.items() if value})
+    return pragmas
+
+def _set_pragmas(dbapi_connection, connection_record, pragmas: dict):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics.record_query(statement, perf_counter() - conn.info["query_started"].pop())
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+def instrument_engine(engine) -> None:
+    """
+    Time every statement run on engine (a sync Engine) into app.metrics.
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+def _engine_options(url, profile: str):
+    """
+    Pool arguments and on-connect PRAGMAs for a URL.
+    """
+    if url.get_backend_name() != "sqlite":
+        return {}, {}
+
+    options = {"connect_args": {"check_same_thread": False}}
+    pragmas = sqlite_pragmas(profile)
+    if url.database in (None, "", ":memory:") or url.query.get("mode") == "memory":
+        # Every connection to :memory: is a separate, empty database, so share one.
+        # WAL does not apply to in-memory databases.
+        options["poolclass"] = StaticPool
+        pragmas.pop("journal_mode", None)
+    else:
+        options.update(
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+        )
+    return options, pragmas
+
+def make_engine(url, profile: str = config.DB_PROFILE, **kwargs):
+    """
+    Create a sync engine with the pool and PRAGMAs of the given profile.
+    """
+    url = make_url(url)
+    options, pragmas = _engine_options(url, profile)
+    options.update(kwargs)
+    engine = create_engine(url, **options)
+    if pragmas:
+        event.listen(engine, "connect", partial(_set_pragmas, pragmas=pragmas))
+    instrument_engine(engine)
+    return engine
+
+def shared_memory_url(url, name: str):
+    """
+    Name an in-memory SQLite URL (sqlite://) as a shared-cache database, so
+    that the engines made from it, each with its own connection, see the
+    same tables. Other URLs are returned as they are.
+    """
+    if not url:
+        return url
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite" or url.database not in (None, "", ":memory:"):
+        return url
+    return url.set(database=f"file:{name}", query={"mode": "memory", "cache": "shared", "uri": "true"})
+
+def async_url(url: str):
+    """
+    Swap a sync database URL for its asyncio driver (sqlite -> sqlite+aiosqlite).
+    """
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+def make_async_engine(url, profile: str = config.DB_PROFILE, **kwargs):
+    """
+    Async counterpart of make_engine.
+    """
+    url = async_url(url)
+    options, pragmas = _engine_options(url, profile)
+    options.update(kwargs)
+    engine = create_async_engine(url, **options)
+    if pragmas:
+        event.listen(engine.sync_engine, "connect", partial(_set_pragmas, pragmas=pragmas))
+    instrument_engine(engine.sync_engine)
+    return engine
+
+# The sync and async engines below must reach the same database, in memory too
+_DATABASE_URL = shared_memory_url(DATABASE_URL, "diary")
+
 # Create the SQLAlchemy engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = make_engine(_DATABASE_URL)
 
 # Create a session factory bound to the engine
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session factory for routes that run on the event loop.
+# Objects stay usable after commit because there is no implicit IO to reload them.
+async_engine = make_async_engine(_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Base class for model declarations
 Base = declarative_base()
 
@@ -21,3 +175,79 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def missing_tables(bind, tables: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Tables declared by the imported models (or just the named ones) that the
+    database doesn't have.
+    """
+    return sorted(set(tables or Base.metadata.tables) - set(inspect(bind).get_table_names()))
+
+def missing_columns(bind, tables: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Declared columns, as table.column, that existing tables (all of them or
+    just the named ones) don't have. create_all never adds columns to a
+    table that is already there.
+    """
+    inspector = inspect(bind)
+    existing = set(inspector.get_table_names())
+    missing = []
+    for name in sorted(set(tables or Base.metadata.tables) & existing):
+        have = {column["name"] for column in inspector.get_columns(name)}
+        missing += [f"{name}.{column.name}" for column in Base.metadata.tables[name].columns if column.name not in have]
+    return missing
+
+def add_missing_columns(bind, tables: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    ALTER TABLE ... ADD COLUMN each of missing_columns, with its declared
+    scalar default filled into existing rows, then create the indexes on
+    them. Returns the columns added.
+    """
+    missing = missing_columns(bind, tables)
+    with bind.begin() as conn:
+        for name in missing:
+            table_name, column_name = name.split(".")
+            column = Base.metadata.tables[table_name].columns[column_name]
+            ddl = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column.type.compile(dialect=conn.dialect)}"
+            if column.default is not None and column.default.is_scalar:
+                value = literal(column.default.arg, column.type).compile(dialect=conn.dialect,
+                                                                        compile_kwargs={"literal_binds": True})
+                ddl += f" DEFAULT {value}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            conn.execute(text(ddl))
+        for table_name in {name.split(".")[0] for name in missing}:
+            for index in Base.metadata.tables[table_name].indexes:
+                index.create(conn, checkfirst=True)
+    return missing
+
+def prepare_database(bind=None, tables: Optional[Iterable[str]] = None) -> None:
+    """
+    Create the schema (or the named tables) if DB_CREATE_SCHEMA is set,
+    otherwise refuse to start against a database that is missing tables.
+    Either way, refuse to start when existing tables lack declared columns.
+    The models must be imported.
+    """
+    bind = bind or engine
+    if config.DB_CREATE_SCHEMA:
+        Base.metadata.create_all(bind=bind, tables=[Base.metadata.tables[name] for name in tables] if tables else None)
+    else:
+        missing = missing_tables(bind, tables)
+        if missing:
+            raise RuntimeError(
+                f"Database is missing tables: {', '.join(missing)}. "
+                "Start once with DB_CREATE_SCHEMA=1 or run `python -m app.maintenance create-schema`."
+            )
+    missing = missing_columns(bind, tables)
+    if missing:
+        raise RuntimeError(
+            f"Database is missing columns: {', '.join(missing)}. "
+            "Run `python -m app.maintenance add-columns`."
+        )
+
+async def get_async_db():
+    """
+    Async counterpart of get_db, yielding an AsyncSession.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
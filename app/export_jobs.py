@@ -0,0 +1,150 @@
+"""
+Background export jobs.
+
+POST /exports records an ExportJob and hands its id to a small thread pool.
+The worker streams the user's entries into a file under EXPORT_DIR and only
+records the path once the file is complete, so a finished export is served
+as a static file for every later download.
+"""
+import csv
+import os
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import groupby
+from threading import Lock
+from typing import Callable, Iterable
+
+from sqlalchemy import Row, select
+from sqlalchemy.orm import Session
+
+from app import config, crud, models, schemas
+from app.exporter import iter_entries_markdown
+
+EXTENSIONS = {
+    models.ExportFormat.jsonl: "jsonl",
+    models.ExportFormat.csv: "csv",
+    models.ExportFormat.markdown_zip: "zip",
+}
+
+MEDIA_TYPES = {
+    models.ExportFormat.jsonl: "application/x-ndjson",
+    models.ExportFormat.csv: "text/csv; charset=utf-8",
+    models.ExportFormat.markdown_zip: "application/zip",
+}
+
+CSV_FIELDS = list(schemas.EntryOut.model_fields)
+
+# ------------------------
+# WRITERS
+# Each takes rows in export order (crud.iter_export_entries) and a file path,
+# and returns the number of entries written.
+# ------------------------
+
+def write_jsonl(rows: Iterable[Row], path: str) -> int:
+    count = 0
+    with open(path, "wb") as f:
+        for row in rows:
+            f.write(schemas.EntryOut.model_validate(row, from_attributes=True).model_dump_json().encode("utf-8"))
+            f.write(b"\n")
+            count += 1
+    return count
+
+def write_csv(rows: Iterable[Row], path: str) -> int:
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for row in rows:
+            entry = schemas.EntryOut.model_validate(row, from_attributes=True)
+            writer.writerow(entry.model_dump(mode="json").values())
+            count += 1
+    return count
+
+def _month(row: Row) -> str:
+    return row.date_only.strftime("%Y-%m") if row.date_only else "undated"
+
+def write_markdown_zip(rows: Iterable[Row], path: str) -> int:
+    count = 0
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        # Only one month of entries is held in memory at a time
+        for month, group in groupby(rows, key=_month):
+            group = list(group)
+            with archive.open(f"{month}.md", "w") as member:
+                for chunk in iter_entries_markdown(group):
+                    member.write(chunk.encode("utf-8"))
+            count += len(group)
+    return count
+
+WRITERS = {
+    models.ExportFormat.jsonl: write_jsonl,
+    models.ExportFormat.csv: write_csv,
+    models.ExportFormat.markdown_zip: write_markdown_zip,
+}
+
+# ------------------------
+# RUNNING JOBS
+# ------------------------
+
+def export_path(job: models.ExportJob) -> str:
+    return os.path.join(config.EXPORT_DIR, str(job.user_id), f"{job.id}.{EXTENSIONS[job.format]}")
+
+def run_export_job(job_id: int, session_factory: Callable[[], Session]) -> models.ExportStatus:
+    """
+    Write the file for one job and record the outcome on the job row.
+    The file is written under a temporary name and renamed when complete, so
+    a crash never leaves a truncated file behind a "done" job.
+    """
+    db = session_factory()
+    try:
+        job = crud.get_export_job(db, job_id)
+        job.status = models.ExportStatus.running
+        db.commit()
+
+        path = export_path(job)
+        partial = path + ".part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            rows = crud.iter_export_entries(db, job.user_id, job.start_date, job.end_date, tag=job.tag)
+            entries = WRITERS[job.format](rows, partial)
+            os.replace(partial, path)
+        except Exception as e:
+            db.rollback()
+            if os.path.exists(partial):
+                os.remove(partial)
+            job.status = models.ExportStatus.failed
+            job.error = str(e)
+        else:
+            job.status = models.ExportStatus.done
+            job.path = path
+            job.size = os.path.getsize(path)
+            job.entries = entries
+
+        job.finished_at = datetime.now(timezone.utc)
+        db.commit()
+        return job.status
+    finally:
+        db.close()
+
+_executor = None
+_executor_lock = Lock()
+
+def submit_export_job(job_id: int, session_factory: Callable[[], Session]) -> Future:
+    """
+    Run a job on the shared export thread pool (EXPORT_WORKERS threads).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.EXPORT_WORKERS, thread_name_prefix="export")
+    return _executor.submit(run_export_job, job_id, session_factory)
+
+def unfinished_job_ids(db: Session) -> list:
+    """
+    Jobs that were queued or running when the process stopped.
+    """
+    return db.execute(
+        select(models.ExportJob.id)
+        .where(models.ExportJob.status.in_([models.ExportStatus.queued, models.ExportStatus.running]))
+        .order_by(models.ExportJob.id)
+    ).scalars().all()
@@ -1,27 +1,39 @@
-from typing import List
+from typing import Iterable, Iterator, List
 from app.schemas import EntryOut
-from collections import defaultdict
+from itertools import groupby
+from operator import attrgetter
+
+MARKDOWN_HEADER = "# 📓 Your Personal Knowledge & Reflection Diary"
+
+def _entry_lines(entry: EntryOut) -> List[str]:
+    lines = [
+        f"**Type**: {entry.entry_type.value}",
+        f"**Time**: {entry.timestamp.strftime('%H:%M:%S')}",
+    ]
+    if entry.tags:
+        lines.append(f"**Tags**: {entry.tags}")
+    lines.append("")
+    lines.append(entry.text.strip())
+    lines.append("\n---\n")
+    return lines
+
+def iter_entries_markdown(entries: Iterable[EntryOut]) -> Iterator[str]:
+    """
+    Yield the Markdown export one date group at a time.
+    Entries must already be ordered by date, so only the current day is held in memory.
+    """
+    yield "\n".join([MARKDOWN_HEADER, ""])
+
+    for entry_date, group in groupby(entries, key=attrgetter("date_only")):
+        lines = [f"## 📅 {entry_date}"]
+        for entry in group:
+            lines.extend(_entry_lines(entry))
+        yield "\n" + "\n".join(lines)
 
 def entries_to_markdown(entries: List[EntryOut]) -> str:
     """
     Convert a list of EntryOut items into Markdown format,
     grouped by date with entry type, time, and optional tags.
     """
-    grouped = defaultdict(list)
-    for entry in entries:
-        grouped[entry.date_only].append(entry)
-
-    markdown_lines = ["# 📓 Your Personal Knowledge & Reflection Diary", ""]
-
-    for entry_date in sorted(grouped.keys()):
-        markdown_lines.append(f"## 📅 {entry_date}")
-        for entry in grouped[entry_date]:
-            markdown_lines.append(f"**Type**: {entry.entry_type.value}")
-            markdown_lines.append(f"**Time**: {entry.timestamp.strftime('%H:%M:%S')}")
-            if entry.tags:
-                markdown_lines.append(f"**Tags**: {entry.tags}")
-            markdown_lines.append("")
-            markdown_lines.append(entry.text.strip())
-            markdown_lines.append("\n---\n")
-
-    return "\n".join(markdown_lines)
+    ordered = sorted(entries, key=attrgetter("date_only"))
+    return "".join(iter_entries_markdown(ordered))
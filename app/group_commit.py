@@ -0,0 +1,223 @@
+"""
+Group commit for entry writes.
+
+With GROUP_COMMIT=1, POST /entry hands its entry to one writer thread per
+process instead of committing it itself. The writer waits at most
+GROUP_COMMIT_MAX_DELAY_MS after the first entry of a group (or until
+GROUP_COMMIT_MAX_ROWS are queued) and writes the whole group with
+crud.insert_entry_rows and one commit, i.e. one fsync for the group instead of
+one per entry. Each caller waits on a future that resolves, with its row's
+id, once the group is committed, so a response still means the entry is
+stored.
+
+How durable "stored" is depends on GROUP_COMMIT_DURABILITY, applied to the
+writer's own connection:
+
+    full    fsync on every group commit (PRAGMA synchronous=FULL)
+    normal  the DB_PROFILE setting; in WAL mode a power loss may drop the
+            last commits, a process crash never does
+    off     no fsync at all (PRAGMA synchronous=OFF); the OS decides when
+            data reaches the disk
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app import config, crud, schemas, sharding
+from app.db import engine
+
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS = {"full": "FULL", "normal": None, "off": "OFF"}
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self,
+                 bind: Engine,
+                 max_rows: int = config.GROUP_COMMIT_MAX_ROWS,
+                 max_delay_ms: float = config.GROUP_COMMIT_MAX_DELAY_MS,
+                 durability: str = config.GROUP_COMMIT_DURABILITY):
+        if durability not in SYNCHRONOUS:
+            raise ValueError(f"Unknown GROUP_COMMIT_DURABILITY {durability!r}, expected one of {sorted(SYNCHRONOUS)}")
+        self.bind = bind
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.durability = durability
+        self.groups = 0
+        self.rows = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # ------------------------
+    # CALLERS
+    # ------------------------
+
+    def submit(self, entry: schemas.EntryIn) -> Future:
+        """
+        Queue an entry; the future resolves to its EntryOut once committed.
+        """
+        future: Future = Future()
+        # Queued before starting, so a writer that just failed either fails
+        # this entry with the rest or sees it and starts a new writer
+        self._queue.put((crud.entry_values(entry), future))
+        self._start()
+        return future
+
+    def create_entry(self, entry: schemas.EntryIn) -> schemas.EntryOut:
+        return self.submit(entry).result()
+
+    async def create_entry_async(self, entry: schemas.EntryIn) -> schemas.EntryOut:
+        return await asyncio.wrap_future(self.submit(entry))
+
+    def close(self) -> None:
+        """
+        Write everything queued so far and stop the writer thread.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    # ------------------------
+    # WRITER
+    # ------------------------
+
+    def _start(self) -> None:
+        # Started on first use, so importing or configuring the writer costs nothing
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                    self._thread.start()
+
+    def _collect(self, first) -> Tuple[List[tuple], bool]:
+        group, deadline = [first], time.monotonic() + self.max_delay
+        while len(group) < self.max_rows:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return group, True
+            group.append(item)
+        return group, False
+
+    def _run(self) -> None:
+        group: List[tuple] = []
+        try:
+            synchronous = SYNCHRONOUS[self.durability] if self.bind.dialect.name == "sqlite" else None
+            with self.bind.connect() as conn:
+                try:
+                    if synchronous:
+                        conn.exec_driver_sql(f"PRAGMA synchronous={synchronous}")
+                        conn.commit()
+                    stopping = False
+                    while not stopping:
+                        first = self._queue.get()
+                        if first is _STOP:
+                            break
+                        group = [first]  # failed with the rest if collecting fails
+                        group, stopping = self._collect(first)
+                        # Callers that went away (cancelled requests) are not written;
+                        # the rest can no longer be cancelled
+                        group = [item for item in group if item[1].set_running_or_notify_cancel()]
+                        if group:
+                            self._write(conn, group)
+                        group = []
+                finally:
+                    if synchronous:
+                        # Don't hand the changed PRAGMA back to the pool, failed or not
+                        conn.invalidate()
+        except Exception as e:
+            # E.g. no connection: fail the group and everything queued behind
+            # it rather than leave the callers waiting
+            logger.exception("Group commit writer failed")
+            self._fail(group, e)
+        finally:
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+            # Entries queued after the failure get a fresh writer
+            if not self._queue.empty():
+                self._start()
+
+    def _fail(self, group: List[tuple], error: Exception) -> None:
+        for _, future in group:
+            if not future.done():
+                future.set_exception(error)
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(error)
+
+    def _write(self, conn, group: List[tuple]) -> None:
+        with Session(bind=conn) as db:
+            try:
+                stored = crud.insert_entry_rows(db, [values for values, _ in group])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                if len(group) == 1:
+                    group[0][1].set_exception(e)
+                    return
+                # One bad row shouldn't fail the others: retry them one by one
+                logger.warning("Group commit of %d entries failed, writing them one by one", len(group), exc_info=True)
+                for item in group:
+                    self._write(conn, [item])
+                return
+        self.groups += 1
+        self.rows += len(group)
+        for (_, future), row in zip(group, stored):
+            future.set_result(schemas.EntryOut.model_validate(row, from_attributes=True))
+
+
+# ------------------------
+# PROCESS WRITER
+# ------------------------
+
+# One writer per database file: None is the directory database, ints are DB_SHARDS
+_writers: Dict[Optional[int], GroupCommitWriter] = {}
+_writer_lock = threading.Lock()
+
+def get_shard_writer(shard_id: Optional[int]) -> Optional[GroupCommitWriter]:
+    """
+    The process's writer for a shard when GROUP_COMMIT is on, else None.
+    """
+    if not config.GROUP_COMMIT:
+        return None
+    writer = _writers.get(shard_id)
+    if writer is None:
+        with _writer_lock:
+            writer = _writers.get(shard_id)
+            if writer is None:
+                bind = engine if shard_id is None else sharding.shards.engine(shard_id)
+                writer = _writers[shard_id] = GroupCommitWriter(bind)
+    return writer
+
+def get_entry_writer() -> Optional[GroupCommitWriter]:
+    """
+    FastAPI dependency: the directory database's writer when GROUP_COMMIT is on, else None.
+    """
+    return get_shard_writer(None)
+
+def close_entry_writer() -> None:
+    with _writer_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
@@ -0,0 +1,73 @@
+"""
+Scheduled jobs that run once across all processes.
+
+Every API worker (or a standalone `python -m api.scheduler`) may fire the
+same job; run_exclusive lets the first one take a lease on the run's row in
+job_runs and the rest skip it. The owner renews the lease from a heartbeat
+thread while the job runs. If the process dies, the lease expires and the
+next tick in any process takes the run over, so jobs must be safe to resume
+(create_due_prompts and the prompt delivery both are).
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from typing import Callable, Optional
+
+from app import config, crud
+from app.db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Unique per process start, so a restarted process with a reused pid is a new owner
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _heartbeat(stop: threading.Event, job_id: str, run_key: str, owner: str, session_factory, lease_seconds: float):
+    while not stop.wait(lease_seconds / 3):
+        try:
+            with session_factory() as db:
+                if not crud.renew_job_run(db, job_id, run_key, owner, lease_seconds):
+                    logger.warning("Lost the lease on %s/%s; another process may be running it", job_id, run_key)
+                    return
+        except Exception:
+            # A busy database shouldn't kill the heartbeat; the next renewal may succeed
+            logger.exception("Could not renew the lease on %s/%s", job_id, run_key)
+
+def run_exclusive(job_id: str,
+                  run_key: str,
+                  job: Callable[[], object],
+                  session_factory=SessionLocal,
+                  lease_seconds: float = config.JOB_LEASE_SECONDS,
+                  owner: Optional[str] = None) -> bool:
+    """
+    Run job for run_key unless it is done or another process holds its lease.
+    Returns whether this call ran it. A job that raises is recorded as failed
+    (and retried by the next tick) and the exception propagates.
+    """
+    owner = owner or OWNER
+    with session_factory() as db:
+        if not crud.claim_job_run(db, job_id, run_key, owner, lease_seconds):
+            return False
+
+    logger.info("Running %s/%s as %s", job_id, run_key, owner)
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(stop, job_id, run_key, owner, session_factory, lease_seconds),
+        name=f"lease-{job_id}", daemon=True,
+    )
+    heartbeat.start()
+    error = "interrupted"
+    try:
+        job()
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        stop.set()
+        heartbeat.join()
+        with session_factory() as db:
+            crud.finish_job_run(db, job_id, run_key, owner, error)
+    return True
@@ -1,38 +1,80 @@
 from app.db import SessionLocal
-from app import crud, models
-from datetime import datetime
+from app import config, crud, prompt_schedule, sharding
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple, Optional, Sequence, Set, Tuple
 import random
 
-def generate_daily_prompts():
+PROMPTS_PATH = Path(__file__).resolve().parent.parent / "prompts" / "reflection_questions.txt"
+
+@lru_cache(maxsize=None)
+def load_prompts(path: Path = PROMPTS_PATH) -> Tuple[str, ...]:
     """
-    Generates daily reflection entries in the database for each active user.
+    Read the reflection questions once per process.
     """
-    db = SessionLocal()
-    try:
-        users = crud.get_all_users(db)  # тепер через crud, а не .query()
-
-        if not users:
-            return
+    with open(path, "r", encoding="utf-8") as f:
+        return tuple(line.strip() for line in f if line.strip())
 
-        with open("prompts/reflection_questions.txt", "r", encoding="utf-8") as f:
-            prompts = [line.strip() for line in f if line.strip()]
+def archive_old_entries(today: Optional[date] = None,
+                        session_factory=SessionLocal,
+                        after_days: int = config.ARCHIVE_AFTER_DAYS) -> int:
+    """
+    Move entries dated more than after_days before today (UTC), rounded down
+    to whole months, into their users' archive segments, in the directory
+    database and on every shard. after_days 0 turns archiving off. Returns
+    the number of entries archived.
+    """
+    if after_days <= 0:
+        return 0
+    before = crud.archive_cutoff(today or datetime.now(timezone.utc).date(), after_days)
+    archived = 0
+    for factory in [session_factory, *map(sharding.shards.sessionmaker, sharding.shards.shard_ids())]:
+        with factory() as db:
+            archived += crud.archive_entries(db, before)
+    return archived
 
-        for user in users:
-            question = random.choice(prompts)
 
-            entry = models.Entry(
-                user_id=user.id,
-                message_id=0,
-                username=user.username,
-                text=question,
-                entry_type=models.EntryType.reflection,
-                source="prompted",
-                timestamp=datetime.utcnow(),
-                date_only=datetime.utcnow().date()
-            )
-            db.add(entry)
+class PromptTick(NamedTuple):
+    users: int       # users prompted (or skipped as already prompted) and rescheduled
+    dates: Set[date] # local prompt dates written, for delivery
 
-        db.commit()
+def create_due_prompts(now: Optional[datetime] = None,
+                       session_factory=SessionLocal,
+                       prompts: Optional[Sequence[str]] = None,
+                       limit: int = config.PROMPT_TICK_LIMIT,
+                       chunk_size: int = 1000) -> PromptTick:
+    """
+    One scheduler tick: prompt the users whose slot has started (now is naive
+    UTC) and move them to their next slot, at most limit users per call.
+    Anyone left over is still due, so the next tick continues with them; a
+    missed tick is caught up the same way.
+    """
+    prompts = prompts if prompts is not None else load_prompts()
+    now = now or prompt_schedule.utc_now()
+    done, dates = 0, set()
+    if not prompts:
+        return PromptTick(done, dates)
 
+    offset = random.randrange(len(prompts))
+    db = session_factory()
+    try:
+        crud.schedule_unscheduled_users(db, now, limit)
+        while done < limit:
+            due = crud.due_prompt_users(db, now, min(chunk_size, limit - done))
+            if not due:
+                break
+            # Prompts are written to each user's shard; their next slot, in the
+            # directory, through the shard's ATTACH
+            by_shard = defaultdict(list)
+            for user in due:
+                by_shard[user.shard_id].append(user)
+            for shard_id, users in by_shard.items():
+                with sharding.shards.session(db, shard_id) as shard_db:
+                    dates |= crud.create_scheduled_prompts(shard_db, users, prompts, offset)
+            done += len(due)
     finally:
         db.close()
+
+    return PromptTick(done, dates)
@@ -0,0 +1,128 @@
+"""
+Maintenance commands for an existing database.
+
+    python -m app.maintenance create-schema
+    python -m app.maintenance add-columns
+    python -m app.maintenance rebuild-search
+    python -m app.maintenance backfill-tags
+    python -m app.maintenance run-exports
+    python -m app.maintenance rebuild-stats
+    python -m app.maintenance dedupe-entries
+    python -m app.maintenance rebalance-shards
+    python -m app.maintenance archive-entries
+"""
+import argparse
+
+from app.db import Base, SessionLocal, add_missing_columns, engine
+from app import config, crud, export_jobs, logic, sharding
+
+
+def create_schema():
+    from app import models  # registers the tables on Base.metadata
+    Base.metadata.create_all(bind=engine)
+    for shard_id in sharding.shards.shard_ids():
+        Base.metadata.create_all(bind=sharding.shards.engine(shard_id),
+                                 tables=[Base.metadata.tables[name] for name in sharding.shard_tables()])
+    print("✅ Database schema created.")
+
+
+def add_columns():
+    # Tables from before a column was declared, e.g. users from before the
+    # prompt schedule (timezone, prompt_time, next_prompt_at) or sharding (shard_id)
+    from app import models  # registers the tables on Base.metadata
+    added = add_missing_columns(engine)
+    for shard_id in sharding.shards.shard_ids():
+        added += add_missing_columns(sharding.shards.engine(shard_id), sharding.shard_tables())
+    print(f"✅ {len(added)} columns added{': ' + ', '.join(added) if added else ''}.")
+
+
+def _entry_databases():
+    # Entries and everything derived from them are in the directory database
+    # for unsharded users and on each shard for the rest
+    return [SessionLocal, *map(sharding.shards.sessionmaker, sharding.shards.shard_ids())]
+
+
+def rebuild_search():
+    for factory in _entry_databases():
+        with factory() as db:
+            crud.rebuild_search_index(db)
+    print("✅ Search index rebuilt.")
+
+
+def backfill_tags():
+    processed = 0
+    for factory in _entry_databases():
+        with factory() as db:
+            processed += crud.backfill_tags(db)
+    print(f"✅ Tags indexed for {processed} entries.")
+
+
+def rebuild_stats():
+    for factory in _entry_databases():
+        with factory() as db:
+            crud.rebuild_daily_stats(db)
+    print("✅ Daily statistics rebuilt.")
+
+
+def dedupe_entries():
+    deleted = 0
+    for factory in _entry_databases():
+        with factory() as db:
+            deleted += crud.dedupe_entries(db)
+    print(f"✅ {deleted} duplicate entries deleted, message index in place.")
+
+
+def rebalance_shards():
+    print(f"Moving users to their shards; waits {config.USER_CACHE_TTL:.0f} s for API caches to follow.")
+    moved = sharding.rebalance()
+    print(f"✅ {moved} users moved.")
+
+
+def archive_entries():
+    if config.ARCHIVE_AFTER_DAYS <= 0:
+        print("ARCHIVE_AFTER_DAYS is not set; nothing archived.")
+        return
+    archived = logic.archive_old_entries()
+    print(f"✅ {archived} entries older than {config.ARCHIVE_AFTER_DAYS} days archived.")
+
+
+def run_exports():
+    # Export jobs live in an in-process thread pool, so jobs queued or running
+    # when the API stopped are finished here
+    db = SessionLocal()
+    try:
+        job_ids = export_jobs.unfinished_job_ids(db)
+        # Each job reads its user's shard (which reaches the job row through ATTACH)
+        shard_ids = {job_id: sharding.shards.user_shard(db, crud.get_export_job(db, job_id).user_id) for job_id in job_ids}
+    finally:
+        db.close()
+    for job_id in job_ids:
+        shard_id = shard_ids[job_id]
+        session_factory = SessionLocal if sharding.shards.is_directory(shard_id) else sharding.shards.sessionmaker(shard_id)
+        status = export_jobs.run_export_job(job_id, session_factory)
+        print(f"Export {job_id}: {status.value}")
+    print(f"✅ {len(job_ids)} export jobs processed.")
+
+
+COMMANDS = {
+    "create-schema": create_schema,
+    "add-columns": add_columns,
+    "rebuild-search": rebuild_search,
+    "backfill-tags": backfill_tags,
+    "run-exports": run_exports,
+    "rebuild-stats": rebuild_stats,
+    "dedupe-entries": dedupe_entries,
+    "rebalance-shards": rebalance_shards,
+    "archive-entries": archive_entries,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diary database maintenance")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    COMMANDS[args.command]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+Requests are timed by api.main.MetricsMiddleware per route template and
+status. SQL statements are timed by engine hooks (app.db.instrument_engine)
+and attributed to the request running them through a context variable, which
+also catches N+1 patterns and slow statements. Jobs are timed with job_timer.
+
+Everything is plain counters and fixed-bucket histograms behind one lock, so
+the cost per observation is a bisect and a few additions.
+"""
+import logging
+from bisect import bisect_left
+from collections import Counter as StatementCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+_lock = Lock()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> per-bucket counts (not cumulative) + [+Inf], then sum
+        self._values: Dict[Tuple[str, ...], list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def count(self, *labels: str) -> int:
+        state = self._values.get(labels)
+        return sum(state[:-1]) if state else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    A value read from a callback at scrape time.
+    """
+    def __init__(self, name: str, help: str, read: Callable[[], float], kind: str = "gauge"):
+        self.name, self.help, self.read, self.kind = name, help, read, kind
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {_number(self.read())}"]
+
+
+REGISTRY: list = []
+
+def render() -> str:
+    with _lock:
+        lines = [line for metric in REGISTRY for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+# ------------------------
+# METRICS
+# ------------------------
+
+http_requests = Histogram(
+    "http_request_duration_seconds", "Time to send the full response, by route template and status",
+    ["method", "route", "status"],
+)
+http_request_queries = Histogram(
+    "http_request_db_queries", "SQL statements executed per request", ["route"], QUERY_COUNT_BUCKETS,
+)
+http_request_db_time = Histogram(
+    "http_request_db_seconds", "Time spent in SQL per request", ["route"],
+)
+db_queries = Histogram("db_query_duration_seconds", "Time of each SQL statement")
+db_slow_queries = Counter("db_slow_queries_total", "Statements slower than METRICS_SLOW_QUERY_MS", ["route"])
+db_n_plus_one = Counter(
+    "db_n_plus_one_total", "Requests that ran one statement METRICS_N_PLUS_ONE times or more", ["route"],
+)
+job_runs = Histogram("job_duration_seconds", "Scheduled job run time", ["job", "status"], JOB_BUCKETS)
+prompt_deliveries = Counter("prompt_deliveries_total", "Prompt messages sent to Telegram by outcome", ["status"])
+
+# ------------------------
+# PER-REQUEST SQL ACCOUNTING
+# ------------------------
+
+@dataclass
+class RequestStats:
+    scope: dict
+    queries: int = 0
+    db_seconds: float = 0.0
+    statements: StatementCounter = field(default_factory=StatementCounter)
+
+    @property
+    def route(self) -> str:
+        # Set by the router once the request is matched. The template, not the
+        # path, keeps label cardinality bounded.
+        route = self.scope.get("route")
+        return getattr(route, "path", "<unmatched>")
+
+_request: ContextVar[Optional[RequestStats]] = ContextVar("metrics_request", default=None)
+
+def start_request(scope: dict) -> Tuple[RequestStats, object]:
+    stats = RequestStats(scope)
+    return stats, _request.set(stats)
+
+def finish_request(token, stats: RequestStats, status: int, seconds: float) -> None:
+    _request.reset(token)
+    method, route = stats.scope["method"], stats.route
+    http_requests.observe(seconds, method, route, str(status))
+    http_request_queries.observe(stats.queries, route)
+    http_request_db_time.observe(stats.db_seconds, route)
+
+    if stats.statements:
+        statement, count = stats.statements.most_common(1)[0]
+        if count >= config.METRICS_N_PLUS_ONE:
+            db_n_plus_one.inc(route)
+            logger.warning("Possible N+1 on %s %s: %d x %s", method, route, count, statement[:200])
+
+def record_query(statement: str, seconds: float) -> None:
+    """
+    Called by the engine hooks after every statement.
+    """
+    db_queries.observe(seconds)
+    stats = _request.get()
+    route = stats.route if stats else "<background>"
+    if stats:
+        stats.queries += 1
+        stats.db_seconds += seconds
+        stats.statements[statement] += 1
+    if seconds * 1000 >= config.METRICS_SLOW_QUERY_MS:
+        db_slow_queries.inc(route)
+        logger.warning("Slow query on %s (%.1f ms): %s", route, seconds * 1000, statement[:200])
+
+# ------------------------
+# JOBS
+# ------------------------
+
+@contextmanager
+def job_timer(job: str) -> Iterator[None]:
+    started = perf_counter()
+    status = "error"
+    try:
+        yield
+        status = "ok"
+    finally:
+        job_runs.observe(perf_counter() - started, job, status)
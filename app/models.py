@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Enum, Date, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, Enum, Date, Time, ForeignKey, Index, LargeBinary, DDL, event, table, column
+from sqlalchemy import text as sql_text
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from app.db import Base
@@ -9,6 +10,27 @@ class EntryType(enum.Enum):
     idea = "idea"
     reflection = "reflection"
 
+class ExportFormat(enum.Enum):
+    jsonl = "jsonl"
+    csv = "csv"
+    markdown_zip = "markdown_zip"  # one Markdown file per month
+
+class ExportStatus(enum.Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+class DeliveryStatus(enum.Enum):
+    sent = "sent"
+    failed = "failed"  # permanent, e.g. the user blocked the bot
+    retry = "retry"    # gave up on transient errors; the next run tries again
+
+class JobRunStatus(enum.Enum):
+    running = "running"
+    done = "done"
+    failed = "failed"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -19,11 +41,16 @@ class User(Base):
     language = Column(String, default="uk")  # локалізація
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    timezone = Column(String, nullable=False, default="UTC")  # IANA name, e.g. "Europe/Kyiv"
+    prompt_time = Column(Time, nullable=True)  # local time of the daily prompt; None = PROMPT_HOUR:PROMPT_MINUTE
+    next_prompt_at = Column(DateTime, nullable=True)  # UTC slot of the next prompt; None = not scheduled
+    shard_id = Column(Integer, nullable=True)  # DB_SHARDS index holding the user's entries; None = this database
 
     entries = relationship("Entry", back_populates="user")
 
     __table_args__ = (
         Index("ix_unique_external_source", "external_id", "source", unique=True),
+        Index("ix_users_next_prompt_at", "next_prompt_at"),
     )
 
 class Entry(Base):
@@ -41,3 +68,260 @@ class Entry(Base):
     date_only = Column(Date, default=lambda: datetime.now(timezone.utc).date())
 
     user = relationship("User", back_populates="entries")
+
+    __table_args__ = (
+        # /entry/{date} and /export: equality on user, equality or range on date
+        Index("ix_entries_user_date", "user_id", "date_only"),
+        # /list: newest entries first for one user
+        Index("ix_entries_user_timestamp", "user_id", "timestamp"),
+        # prompt delivery: all prompts of one day, in id order
+        Index("ix_entries_prompted_date", "date_only", "id", sqlite_where=sql_text("source = 'prompted'")),
+        # idempotent writes: one entry per (user, source, message) when the message is known
+        Index("ux_entries_message", "user_id", "source", "message_id", unique=True,
+              sqlite_where=sql_text("message_id IS NOT NULL")),
+        # Ids are never reused, even after the highest ones are deleted, so an
+        # id in an archived segment (EntryArchive) can't be handed out again
+        {"sqlite_autoincrement": True},
+    )
+
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)  # normalized: lowercase, no "#"
+
+class EntryTag(Base):
+    """
+    One row per (entry, tag), parsed from Entry.tags.
+    The primary key starts with user_id so per-user tag counts and tag filters
+    are range reads on the key itself.
+    """
+    __tablename__ = "entry_tags"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id"), primary_key=True)
+    entry_id = Column(Integer, ForeignKey("entries.id"), primary_key=True)
+
+    __table_args__ = (
+        Index("ix_entry_tags_entry", "entry_id"),
+        {"sqlite_with_rowid": False},
+    )
+
+class ExportJob(Base):
+    __tablename__ = "export_jobs"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    format = Column(Enum(ExportFormat), nullable=False)
+    status = Column(Enum(ExportStatus), nullable=False, default=ExportStatus.queued)
+    start_date = Column(Date, nullable=True)
+    end_date = Column(Date, nullable=True)
+    tag = Column(String, nullable=True)
+    path = Column(String, nullable=True)   # set once the file is complete
+    size = Column(Integer, nullable=True)  # bytes
+    entries = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    finished_at = Column(DateTime, nullable=True)
+
+class PromptDelivery(Base):
+    """
+    Outcome of sending one prompted entry to Telegram. Entries without a row
+    have not been attempted yet.
+    """
+    __tablename__ = "prompt_deliveries"
+
+    entry_id = Column(Integer, ForeignKey("entries.id"), primary_key=True)
+    status = Column(Enum(DeliveryStatus), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    telegram_message_id = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class JobRun(Base):
+    """
+    One run of a scheduled job, e.g. ("daily_prompts", "2025-06-30"). Only the
+    owner of an unexpired lease runs it; a run that failed, or whose owner
+    stopped renewing the lease, is taken over by the next process to try.
+    """
+    __tablename__ = "job_runs"
+
+    job_id = Column(String, primary_key=True)
+    run_key = Column(String, primary_key=True)
+    status = Column(Enum(JobRunStatus), nullable=False)
+    owner = Column(String, nullable=False)  # host:pid:nonce of the process running it
+    lease_until = Column(DateTime, nullable=False)
+    attempts = Column(Integer, nullable=False, default=1)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+class EntryArchive(Base):
+    """
+    One user's entries of one month, moved out of entries once older than
+    ARCHIVE_AFTER_DAYS: zlib-compressed JSONL of EntryOut, in export order.
+    Exports merge them back in (crud.archived_entries).
+    """
+    __tablename__ = "entry_archives"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    month = Column(Date, primary_key=True)  # first day of the month
+    entries = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+# ------------------------
+# CHANGE TRACKING
+# ------------------------
+# Every write to a user's entries bumps that user's version in user_changes
+# and stamps the entry with it in entry_versions. The version is the
+# validator behind ETags, and entries newer than a version a client has seen
+# are what a `since` request returns. Entries written before these tables
+# existed count as version 0.
+
+class UserChange(Base):
+    __tablename__ = "user_changes"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False)
+    changed_at = Column(DateTime, nullable=False)  # UTC, second precision
+
+class EntryVersion(Base):
+    __tablename__ = "entry_versions"
+
+    entry_id = Column(Integer, ForeignKey("entries.id"), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_entry_versions_user_version", "user_id", "version"),
+    )
+
+_BUMP_VERSION = """
+    INSERT INTO user_changes(user_id, version, changed_at) VALUES ({row}.user_id, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1, changed_at = excluded.changed_at;
+"""
+_STAMP_ENTRY = """
+    INSERT OR REPLACE INTO entry_versions(entry_id, user_id, version)
+    SELECT new.id, new.user_id, version FROM user_changes WHERE user_id = new.user_id;
+"""
+
+CHANGE_TRACKING_DDL = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS entries_changes_insert AFTER INSERT ON entries BEGIN
+        {_BUMP_VERSION.format(row="new")}
+        {_STAMP_ENTRY}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS entries_changes_update
+    AFTER UPDATE OF text, entry_type, tags, source, date_only, timestamp, updated_at, message_id ON entries BEGIN
+        {_BUMP_VERSION.format(row="new")}
+        {_STAMP_ENTRY}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS entries_changes_delete AFTER DELETE ON entries BEGIN
+        {_BUMP_VERSION.format(row="old")}
+        DELETE FROM entry_versions WHERE entry_id = old.id;
+    END
+    """,
+]
+
+# entry_versions references entries, so it is created after it
+for _statement in CHANGE_TRACKING_DDL:
+    event.listen(EntryVersion.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+
+# ------------------------
+# DAILY STATISTICS
+# ------------------------
+# Entry counts per (user, day, type), kept current by triggers in the same
+# transaction as the write, so /stats never aggregates over entries.
+# Entries without a date_only are not counted.
+
+class DailyStat(Base):
+    __tablename__ = "daily_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date_only = Column(Date, primary_key=True)
+    entry_type = Column(Enum(EntryType), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        {"sqlite_with_rowid": False},
+    )
+
+_COUNT_ENTRY = """
+    INSERT INTO daily_stats(user_id, date_only, entry_type, count)
+    SELECT new.user_id, new.date_only, new.entry_type, 1 WHERE new.date_only IS NOT NULL
+    ON CONFLICT(user_id, date_only, entry_type) DO UPDATE SET count = count + 1;
+"""
+_UNCOUNT_ENTRY = """
+    UPDATE daily_stats SET count = count - 1
+    WHERE user_id = old.user_id AND date_only = old.date_only AND entry_type = old.entry_type;
+    DELETE FROM daily_stats
+    WHERE user_id = old.user_id AND date_only = old.date_only AND entry_type = old.entry_type AND count <= 0;
+"""
+
+DAILY_STATS_DDL = [
+    f"CREATE TRIGGER IF NOT EXISTS entries_stats_insert AFTER INSERT ON entries BEGIN {_COUNT_ENTRY} END",
+    f"CREATE TRIGGER IF NOT EXISTS entries_stats_delete AFTER DELETE ON entries BEGIN {_UNCOUNT_ENTRY} END",
+    f"""
+    CREATE TRIGGER IF NOT EXISTS entries_stats_update AFTER UPDATE OF user_id, date_only, entry_type ON entries BEGIN
+        {_UNCOUNT_ENTRY}
+        {_COUNT_ENTRY}
+    END
+    """,
+]
+
+# The triggers are created with daily_stats, which therefore has to come after entries
+DailyStat.__table__.add_is_dependent_on(Entry.__table__)
+for _statement in DAILY_STATS_DDL:
+    event.listen(DailyStat.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+
+# ------------------------
+# FULL-TEXT SEARCH (SQLite FTS5)
+# ------------------------
+# entries_fts indexes entries.text and entries.tags without storing a second
+# copy of them (external content). Triggers keep it in sync with every write,
+# whichever code path makes it. user_id is indexed as well, so a search is
+# narrowed to one user inside FTS instead of after the match.
+
+entries_fts = table("entries_fts", column("rowid", Integer), column("entries_fts"), column("rank"))
+
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+        text, tags, user_id,
+        content='entries', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    # Rank by text first, tags second; user_id is only there for filtering
+    "INSERT INTO entries_fts(entries_fts, rank) VALUES ('rank', 'bm25(1.0, 0.5, 0.0)')",
+    """
+    CREATE TRIGGER IF NOT EXISTS entries_fts_insert AFTER INSERT ON entries BEGIN
+        INSERT INTO entries_fts(rowid, text, tags, user_id) VALUES (new.id, new.text, new.tags, new.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS entries_fts_delete AFTER DELETE ON entries BEGIN
+        INSERT INTO entries_fts(entries_fts, rowid, text, tags, user_id)
+        VALUES ('delete', old.id, old.text, old.tags, old.user_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS entries_fts_update AFTER UPDATE OF text, tags, user_id ON entries BEGIN
+        INSERT INTO entries_fts(entries_fts, rowid, text, tags, user_id)
+        VALUES ('delete', old.id, old.text, old.tags, old.user_id);
+        INSERT INTO entries_fts(rowid, text, tags, user_id) VALUES (new.id, new.text, new.tags, new.user_id);
+    END
+    """,
+]
+
+for _statement in SEARCH_INDEX_DDL:
+    event.listen(Entry.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+event.listen(Entry.__table__, "before_drop", DDL("DROP TABLE IF EXISTS entries_fts").execute_if(dialect="sqlite"))
@@ -0,0 +1,37 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from typing import Callable, List, Optional, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+
+def encode_cursor(key: Optional[Union[date, datetime]], entry_id: int) -> str:
+    """
+    Pack the sort key of the last row on a page into an opaque, URL-safe token.
+    A NULL key (legacy rows) is kept as null.
+    """
+    raw = json.dumps([key.isoformat() if key is not None else None, entry_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], int]:
+    """
+    Unpack a token made by encode_cursor into (iso key or None, entry id).
+    Raises ValueError for anything that isn't a valid cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, entry_id = json.loads(raw)
+        return (str(key) if key is not None else None), int(entry_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def split_page(rows: List[T], limit: int, key: Callable[[T], Optional[Union[date, datetime]]]) -> Tuple[List[T], Optional[str]]:
+    """
+    Given up to limit + 1 rows, return the page and the cursor for the next one
+    (None when this is the last page).
+    """
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(key(page[-1]), page[-1].id)
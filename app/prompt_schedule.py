@@ -0,0 +1,76 @@
+"""
+When each user's daily prompt is due.
+
+Users choose a local prompt time (PROMPT_HOUR:PROMPT_MINUTE by default) in
+their own timezone. Due times are rounded up to PROMPT_SLOT_MINUTES slots in
+UTC, so everyone whose prompt falls in the same slot is handled by the same
+scheduler tick, and nobody is prompted before the time they chose.
+
+Times stored in users.next_prompt_at are naive UTC, like the rest of the
+database.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app import config
+
+
+@lru_cache(maxsize=None)
+def zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        zone(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def default_prompt_time() -> time:
+    return time(config.PROMPT_HOUR, config.PROMPT_MINUTE)
+
+def slot_start(moment: datetime, slot_minutes: int = config.PROMPT_SLOT_MINUTES) -> datetime:
+    """
+    The start of the slot moment falls in.
+    """
+    minutes = moment.hour * 60 + moment.minute
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start + timedelta(minutes=minutes - minutes % slot_minutes)
+
+def slot_ceil(moment: datetime, slot_minutes: int = config.PROMPT_SLOT_MINUTES) -> datetime:
+    start = slot_start(moment, slot_minutes)
+    return start if start == moment else start + timedelta(minutes=slot_minutes)
+
+def next_prompt_at(tz_name: str,
+                   prompt_time: Optional[time],
+                   after: datetime,
+                   slot_minutes: int = config.PROMPT_SLOT_MINUTES) -> datetime:
+    """
+    The first slot (naive UTC) later than after (naive UTC) in which the
+    user's local prompt time falls.
+    """
+    tz = zone(tz_name)
+    prompt_time = prompt_time or default_prompt_time()
+    local_day = after.replace(tzinfo=timezone.utc).astimezone(tz).date()
+    for day in (local_day - timedelta(days=1), local_day, local_day + timedelta(days=1)):
+        local = datetime.combine(day, prompt_time, tzinfo=tz)
+        due = slot_ceil(local.astimezone(timezone.utc).replace(tzinfo=None), slot_minutes)
+        if due > after:
+            return due
+    # Only reachable across a DST gap right at the prompt time
+    return next_prompt_at(tz_name, prompt_time, after + timedelta(days=1), slot_minutes)
+
+def prompt_date(tz_name: str, prompt_time: Optional[time], due_at: datetime) -> date:
+    """
+    The user's local date of the prompt sent in the slot starting at due_at.
+    Rounding up can carry a prompt just before midnight into the next day;
+    it still belongs to the day it was chosen for.
+    """
+    local = due_at.replace(tzinfo=timezone.utc).astimezone(zone(tz_name))
+    prompt_time = prompt_time or default_prompt_time()
+    return local.date() - timedelta(days=1) if local.time() < prompt_time else local.date()
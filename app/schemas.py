@@ -1,18 +1,28 @@
-from pydantic import BaseModel, Field
-from typing import Optional
-from datetime import datetime, date, timezone
-from app.models import EntryType
+from pydantic import AfterValidator, BaseModel, Field, TypeAdapter
+from typing import Annotated, Dict, List, Optional
+from datetime import datetime, date, time, timezone
+from app.models import EntryType, ExportFormat, ExportStatus
+from app.prompt_schedule import is_valid_timezone
 
 
 # ------------------------
 # USER SCHEMAS
 # ------------------------
 
+def _check_timezone(name: str) -> str:
+    if not is_valid_timezone(name):
+        raise ValueError(f"Unknown timezone {name!r}")
+    return name
+
+TimezoneName = Annotated[str, AfterValidator(_check_timezone)]
+
 class UserBase(BaseModel):
     external_id: int
     source: str = "telegram"
     username: Optional[str] = None
     language: str = "uk"
+    timezone: TimezoneName = "UTC"
+    prompt_time: Optional[time] = None  # local; None = the server default
 
 class UserCreate(UserBase):
     pass
@@ -21,6 +31,9 @@ class UserOut(UserBase):
     id: int
     is_active: bool
     created_at: datetime
+    next_prompt_at: Optional[datetime] = None
+    # Where the user's entries are (app.sharding); internal, so not serialized
+    shard_id: Optional[int] = Field(default=None, exclude=True)
 
     model_config = {
         "from_attributes": True
@@ -29,6 +42,8 @@ class UserOut(UserBase):
 class UserUpdate(BaseModel):
     username: Optional[str] = None
     source: Optional[str] = None
+    timezone: Optional[TimezoneName] = None
+    prompt_time: Optional[time] = None
 
 # ------------------------
 # ENTRY SCHEMAS
@@ -55,6 +70,75 @@ class EntryOut(EntryBase):
         "from_attributes": True
     }
 
+# Validates and serializes a whole list in one call (used by the fast list responses)
+EntryOutList = TypeAdapter(List[EntryOut])
+
+class EntryPage(BaseModel):
+    items: List[EntryOut]
+    next_cursor: Optional[str] = None
+
+class TagCount(BaseModel):
+    tag: str
+    count: int
+
+class SearchHit(EntryOut):
+    snippet: str
+    rank: float
+
+class SearchPage(BaseModel):
+    items: List[SearchHit]
+    next_offset: Optional[int] = None
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkResult(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkItemResult]
+
+
+class DayStats(BaseModel):
+    date_only: date
+    total: int
+    by_type: Dict[EntryType, int]
+
+class StatsOut(BaseModel):
+    total: int
+    by_type: Dict[EntryType, int]
+    active_days: int
+    current_streak: int  # consecutive days with entries, ending today or yesterday
+    longest_streak: int
+    days: List[DayStats]
+
+class HeatmapOut(BaseModel):
+    year: int
+    max: int
+    days: Dict[date, int]  # only days with entries
+
+
+class ExportJobIn(BaseModel):
+    user_id: int
+    format: ExportFormat
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    tag: Optional[str] = None
+
+class ExportJobOut(ExportJobIn):
+    id: int
+    status: ExportStatus
+    size: Optional[int] = None
+    entries: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    model_config = {
+        "from_attributes": True
+    }
 
 class ExportModel(BaseModel):
     start_date: date
@@ -62,4 +146,6 @@ class ExportModel(BaseModel):
 
 class UserUpdate(BaseModel):
     username: Optional[str] = None
-    source: Optional[str] = None
\ No newline at end of file
+    source: Optional[str] = None
+    timezone: Optional[TimezoneName] = None
+    prompt_time: Optional[time] = None
\ No newline at end of file
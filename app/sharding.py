@@ -0,0 +1,336 @@
+"""
+Per-user sharding of the diary store across SQLite files.
+
+SQLite lets one connection write to a database file at a time, so with a
+single file every entry write of every worker queues on the same lock. With
+DB_SHARDS set to a comma-separated list of database URLs, each user's entries
+and everything kept for them (tags, change versions, daily stats, the search
+index, prompt deliveries) live in one of those files, and writes for users on
+different shards commit in parallel.
+
+DATABASE_URL stays the directory: users, job leases and export jobs live
+there, and users.shard_id says which shard holds a user's entries. None
+means the directory database itself, which is where every user's entries
+were before sharding and where they stay when DB_SHARDS is empty. Each shard
+connection ATTACHes the directory, so the queries that join entries with
+users (prompt delivery) or update export jobs run unchanged on a shard.
+
+New users are placed by a jump consistent hash of their external id, so
+growing from N to N + 1 shards moves about 1/(N + 1) of them. After changing
+DB_SHARDS:
+
+    python -m app.maintenance create-schema
+    python -m app.maintenance rebalance-shards
+"""
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+from fastapi import Depends
+from sqlalchemy import event, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import async_crud, config, crud, models
+from app.config import DATABASE_URL
+from app.db import Base, SessionLocal, async_engine, engine, get_async_db, get_db, make_async_engine, make_engine, prepare_database
+
+logger = logging.getLogger(__name__)
+
+# Tables that stay in the directory database; every other table is per shard
+DIRECTORY_TABLES = ("users", "job_runs", "export_jobs")
+
+
+def shard_tables() -> List[str]:
+    return [name for name in Base.metadata.tables if name not in DIRECTORY_TABLES]
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach): key -> [0, buckets). Adding a
+    bucket only moves keys into the new one.
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+def _attach_directory(dbapi_connection, connection_record, path: str):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("ATTACH DATABASE ? AS directory", (path,))
+    cursor.close()
+
+
+class ShardRouter:
+    def __init__(self,
+                 urls: Sequence[str] = config.DB_SHARDS,
+                 directory_url: Optional[str] = DATABASE_URL,
+                 directory_engine=None,
+                 directory_async_engine=None,
+                 profile: str = config.DB_PROFILE):
+        self.urls = [make_url(url) for url in urls]
+        self.profile = profile
+        self.directory_url = make_url(directory_url) if directory_url else None
+        self.directory_engine = directory_engine
+        self.directory_async_engine = directory_async_engine
+        if self.urls and self.directory_url.database in (None, "", ":memory:"):
+            raise ValueError("DB_SHARDS needs DATABASE_URL to be a database file")
+        self._sessions: Dict[int, sessionmaker] = {}
+        self._async_sessions: Dict[int, async_sessionmaker] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def sharded(self) -> bool:
+        return bool(self.urls)
+
+    def placement(self, external_id: int) -> Optional[int]:
+        """
+        The shard a new user with external_id goes to (None without DB_SHARDS).
+        """
+        return jump_hash(external_id, len(self.urls)) if self.urls else None
+
+    def is_directory(self, shard_id: Optional[int]) -> bool:
+        """
+        Whether shard_id's entries are in the directory database.
+        """
+        return shard_id is None or self._url(shard_id) == self.directory_url
+
+    def _url(self, shard_id: int):
+        if not 0 <= shard_id < len(self.urls):
+            raise ValueError(f"Shard {shard_id} is not in DB_SHARDS ({len(self.urls)} shards)")
+        return self.urls[shard_id]
+
+    # ------------------------
+    # ENGINES AND SESSIONS
+    # Created on first use, so a process only connects to the shards it touches
+    # ------------------------
+
+    def engine(self, shard_id: int):
+        return self.sessionmaker(shard_id).kw["bind"]
+
+    def sessionmaker(self, shard_id: int) -> sessionmaker:
+        factory = self._sessions.get(shard_id)
+        if factory is None:
+            with self._lock:
+                factory = self._sessions.get(shard_id)
+                if factory is None:
+                    url = self._url(shard_id)
+                    if url == self.directory_url:
+                        bind = self.directory_engine or engine
+                    else:
+                        bind = make_engine(url, self.profile)
+                        event.listen(bind, "connect", self._attach)
+                    factory = self._sessions[shard_id] = sessionmaker(autocommit=False, autoflush=False, bind=bind)
+        return factory
+
+    def async_sessionmaker(self, shard_id: int) -> async_sessionmaker:
+        factory = self._async_sessions.get(shard_id)
+        if factory is None:
+            with self._lock:
+                factory = self._async_sessions.get(shard_id)
+                if factory is None:
+                    url = self._url(shard_id)
+                    if url == self.directory_url:
+                        bind = self.directory_async_engine or async_engine
+                    else:
+                        bind = make_async_engine(url, self.profile)
+                        event.listen(bind.sync_engine, "connect", self._attach)
+                    factory = self._async_sessions[shard_id] = async_sessionmaker(
+                        bind, autoflush=False, expire_on_commit=False
+                    )
+        return factory
+
+    def _attach(self, dbapi_connection, connection_record):
+        _attach_directory(dbapi_connection, connection_record, self.directory_url.database)
+
+    def shard_ids(self) -> List[int]:
+        """
+        Shards that are not the directory database.
+        """
+        return [shard_id for shard_id in range(len(self.urls)) if not self.is_directory(shard_id)]
+
+    @contextmanager
+    def session(self, db: Session, shard_id: Optional[int]) -> Iterator[Session]:
+        """
+        A session on shard_id, or db itself when that is the directory.
+        """
+        if self.is_directory(shard_id):
+            yield db
+            return
+        with self.sessionmaker(shard_id)() as shard_db:
+            yield shard_db
+
+    @asynccontextmanager
+    async def async_session(self, db: AsyncSession, shard_id: Optional[int]):
+        if self.is_directory(shard_id):
+            yield db
+            return
+        async with self.async_sessionmaker(shard_id)() as shard_db:
+            yield shard_db
+
+    def user_shard(self, db: Session, user_id: int) -> Optional[int]:
+        """
+        Shard of user_id's entries, from the user cache. None for the
+        directory and for unknown users.
+        """
+        if not self.sharded:
+            return None
+        user = crud.get_cached_user_by_id(db, user_id)
+        return user.shard_id if user else None
+
+    async def user_shard_async(self, db: AsyncSession, user_id: int) -> Optional[int]:
+        if not self.sharded:
+            return None
+        user = await async_crud.get_cached_user_by_id(db, user_id)
+        return user.shard_id if user else None
+
+    # ------------------------
+    # SCHEMA
+    # ------------------------
+
+    def prepare(self) -> None:
+        """
+        prepare_database for the per-shard tables of every shard.
+        """
+        for shard_id in self.shard_ids():
+            prepare_database(self.engine(shard_id), shard_tables())
+
+    def dispose(self) -> None:
+        for shard_id, factory in self._sessions.items():
+            if not self.is_directory(shard_id):
+                factory.kw["bind"].dispose()
+
+
+shards = ShardRouter()
+
+# ------------------------
+# FASTAPI DEPENDENCIES
+# ------------------------
+
+def get_user_db(user_id: int, db: Session = Depends(get_db)):
+    """
+    A session on the shard of the request's user_id (the request's own
+    session when that is the directory).
+    """
+    with shards.session(db, shards.user_shard(db, user_id)) as shard_db:
+        yield shard_db
+
+async def get_user_async_db(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    async with shards.async_session(db, await shards.user_shard_async(db, user_id)) as shard_db:
+        yield shard_db
+
+# ------------------------
+# REBALANCING
+# ------------------------
+
+def _copy_entries(source: Session, target: Session, user_id: int, after_id: int, chunk_size: int) -> int:
+    """
+    Copy a user's entries with id > after_id, and their deliveries, from
+    source to target without committing. Entries get new ids in target;
+    archived ones are copied into entries, where the next archive run finds
+    them. Returns the last source id copied.
+    """
+    archived = [entry for entry in crud.archived_entries(source, user_id) if entry.id > after_id]
+    if archived:
+        crud.insert_entry_rows(target, [entry.model_dump(exclude={"id"}) for entry in archived])
+    last_archived = max((entry.id for entry in archived), default=after_id)
+
+    entries, deliveries = models.Entry.__table__, models.PromptDelivery.__table__
+    while True:
+        rows = source.execute(
+            select(entries)
+            .where(models.Entry.user_id == user_id, models.Entry.id > after_id)
+            .order_by(models.Entry.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            return max(after_id, last_archived)
+        stored = crud.insert_entry_rows(target, [{k: v for k, v in row._mapping.items() if k != "id"} for row in rows])
+        new_ids = {row.id: new.id for row, new in zip(rows, stored)}
+
+        sent = source.execute(select(deliveries).where(deliveries.c.entry_id.in_(new_ids))).mappings().all()
+        if sent:
+            target.execute(
+                sqlite_insert(deliveries).on_conflict_do_nothing(),
+                [{**delivery, "entry_id": new_ids[delivery["entry_id"]]} for delivery in sent]
+            )
+        after_id = rows[-1].id
+
+def _continue_versions(source: Session, target: Session, user_id: int) -> None:
+    # Clients sync with since=<version>; the target's version starts above the
+    # source's, and every moved entry carries it, so their next sync re-reads them
+    seen = source.execute(crud.user_change_query(user_id)).one_or_none()
+    if not seen:
+        return
+    target.execute(
+        update(models.UserChange).where(models.UserChange.user_id == user_id)
+        .values(version=models.UserChange.version + seen.version)
+    )
+    target.execute(
+        update(models.EntryVersion).where(models.EntryVersion.user_id == user_id)
+        .values(version=select(models.UserChange.version).where(models.UserChange.user_id == user_id).scalar_subquery())
+    )
+
+def rebalance(router: Optional[ShardRouter] = None,
+              session_factory: Callable[[], Session] = SessionLocal,
+              settle_seconds: float = config.USER_CACHE_TTL,
+              chunk_size: int = 1000) -> int:
+    """
+    Move every user whose entries are not on their placement shard there.
+
+    Each user's entries are copied to the new shard in one transaction, then
+    the directory is pointed at it. Other processes may still write to the
+    old shard until their cached user expires, so after settle_seconds (the
+    user cache TTL) entries written there meanwhile are copied as well, and
+    the old copies deleted. Moved entries get new ids and a new change
+    version. Returns the number of users moved.
+    """
+    router = router or shards
+
+    def factory(shard_id):
+        if router.is_directory(shard_id):
+            return session_factory
+        return router.sessionmaker(shard_id)
+
+    moved = []
+    with session_factory() as directory:
+        users = directory.execute(
+            select(models.User.id, models.User.external_id, models.User.shard_id).order_by(models.User.id)
+        ).all()
+        for user in users:
+            target_id = router.placement(user.external_id)
+            if target_id == user.shard_id:
+                continue
+            if router.is_directory(user.shard_id) and router.is_directory(target_id):
+                # Same database under another name: nothing to copy
+                crud.move_user_shard(directory, user.id, user.shard_id, target_id)
+                continue
+            with factory(user.shard_id)() as source, factory(target_id)() as target:
+                last_id = _copy_entries(source, target, user.id, 0, chunk_size)
+                _continue_versions(source, target, user.id)
+                target.commit()
+            if crud.move_user_shard(directory, user.id, user.shard_id, target_id):
+                moved.append((user.id, user.shard_id, target_id, last_id))
+                logger.info("User %d: shard %s -> %s", user.id, user.shard_id, target_id)
+            else:
+                # Moved by someone else meanwhile: drop this copy
+                with factory(target_id)() as target:
+                    crud.delete_user_entries(target, user.id)
+                    target.commit()
+
+    if moved:
+        time.sleep(settle_seconds)
+    for user_id, source_id, target_id, last_id in moved:
+        with factory(source_id)() as source, factory(target_id)() as target:
+            if _copy_entries(source, target, user_id, last_id, chunk_size) != last_id:
+                _continue_versions(source, target, user_id)
+            target.commit()
+            crud.delete_user_entries(source, user_id)
+            source.commit()
+    return len(moved)
@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Iterable, List, Tuple
+from app import models, schemas
+
+# Summaries built from daily_stats rows, (date, entry type, count) oldest first
+
+def streaks(days: List[date], today: date) -> Tuple[int, int]:
+    """
+    (current, longest) runs of consecutive days in an ascending list of dates.
+    The current streak survives until the end of the day after the last entry.
+    """
+    current = longest = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous and day - previous == timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    if previous is None or today - previous > timedelta(days=1):
+        current = 0
+    return current, longest
+
+def summarize(rows: Iterable[Tuple[date, models.EntryType, int]], today: date) -> schemas.StatsOut:
+    days = []
+    by_type: Dict[models.EntryType, int] = {}
+    for day, group in groupby(rows, key=itemgetter(0)):
+        counts = {entry_type: count for _, entry_type, count in group}
+        for entry_type, count in counts.items():
+            by_type[entry_type] = by_type.get(entry_type, 0) + count
+        days.append(schemas.DayStats(date_only=day, total=sum(counts.values()), by_type=counts))
+
+    current, longest = streaks([day.date_only for day in days], today)
+    return schemas.StatsOut(
+        total=sum(by_type.values()),
+        by_type=by_type,
+        active_days=len(days),
+        current_streak=current,
+        longest_streak=longest,
+        days=days,
+    )
+
+def heatmap(rows: Iterable[Tuple[date, models.EntryType, int]], year: int) -> schemas.HeatmapOut:
+    totals: Dict[date, int] = {}
+    for day, _, count in rows:
+        totals[day] = totals.get(day, 0) + count
+    return schemas.HeatmapOut(year=year, max=max(totals.values(), default=0), days=totals)
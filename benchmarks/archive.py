@@ -0,0 +1,97 @@
+"""
+Hot-table size and read latency before and after archiving old entries.
+
+Fills a database with benchmarks.datagen (two years of entries), times the
+reads that touch recent data (/list, /entry/{date}) and a full export, then
+archives everything older than --days into monthly segments and times them
+again. Sizes are the pages of the hot tables and their indexes (entries,
+entry_tags, the search index, entry_versions) against entry_archives.
+
+    python -m benchmarks.archive --users 200 --entries 500 --days 90
+"""
+import argparse
+import gc
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from app.db import make_engine
+from app import crud
+from benchmarks.datagen import END_DATE, generate
+
+HOT_TABLES = ("entries", "entry_tags", "entry_versions", "entries_fts_data", "entries_fts_idx", "entries_fts_docsize")
+
+
+def table_bytes(db, names):
+    """
+    Bytes in the b-trees of names and their indexes.
+    """
+    placeholders = ", ".join(f":n{n}" for n in range(len(names)))
+    params = {f"n{n}": name for n, name in enumerate(names)}
+    return db.execute(text(
+        f"SELECT coalesce(sum(pgsize), 0) FROM dbstat WHERE name IN ({placeholders}) "
+        f"OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ({placeholders}))"
+    ), params).scalar()
+
+def median_ms(fn, repeat):
+    # As in benchmarks.suite, the collector is paused while timing
+    fn()
+    gc.collect()
+    gc.disable()
+    try:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+    return statistics.median(samples) * 1000
+
+def measure(db, users, repeat):
+    user_ids = range(1, users + 1)
+    return {
+        "list": median_ms(lambda: [crud.list_recent_entries(db, user_id, limit=20) for user_id in user_ids], repeat),
+        "by_date": median_ms(lambda: [crud.get_entries_by_date(db, user_id, END_DATE) for user_id in user_ids], repeat),
+        "export": median_ms(lambda: crud.export_entry_rows(db, 1), repeat),
+        "hot_kib": table_bytes(db, HOT_TABLES) / 1024,
+        "archive_kib": table_bytes(db, ["entry_archives"]) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--entries", type=int, default=500, help="entries per user")
+    parser.add_argument("--days", type=int, default=90, help="archive entries older than this")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'archive.db')}")
+        generate(engine, users=args.users, entries=args.entries)
+        sessions = sessionmaker(bind=engine)
+        with sessions() as db:
+            before = measure(db, args.users, args.repeat)
+        with sessions() as db:
+            started = time.perf_counter()
+            archived = crud.archive_entries(db, crud.archive_cutoff(END_DATE, args.days))
+            took = time.perf_counter() - started
+        with sessions() as db:
+            after = measure(db, args.users, args.repeat)
+        engine.dispose()
+
+    print(f"Archived {archived} of {args.users * args.entries} entries in {took:.1f} s")
+    print(f"{'':<14}{'before':>10}{'after':>10}")
+    for key, label in [("list", "/list ms"), ("by_date", "by date ms"), ("export", "export ms"),
+                       ("hot_kib", "hot KiB"), ("archive_kib", "archive KiB")]:
+        print(f"{label:<14}{before[key]:>10.1f}{after[key]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
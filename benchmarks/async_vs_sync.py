@@ -0,0 +1,106 @@
+"""
+Throughput of GET /list served by a sync route on the threadpool versus the
+async route on the event loop, both running in-process through ASGI.
+
+    python -m benchmarks.async_vs_sync --requests 2000 --concurrency 100
+
+The async route is not the faster one for this read: with that command on
+one CPU (Python 3.11, SQLite 3.40, SQLAlchemy 2.1, aiosqlite 0.22), three
+runs gave 277-353 req/s sync and 199-228 req/s async; aiosqlite hands
+every statement to its connection's thread. What it buys is that requests
+queue for a connection instead of needing a pool as large as the
+concurrency.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.db import Base, async_url, get_async_db, get_db
+from app import crud, models, schemas
+from api.routes import router
+
+
+def build_app(path, pool_size):
+    url = f"sqlite:///{path}"
+    # Every in-flight sync request holds a connection until its response is
+    # sent, and get_db's cleanup needs a worker thread; with a pool smaller
+    # than the concurrency the threadpool deadlocks, so size both pools alike.
+    engine = create_engine(url, connect_args={"check_same_thread": False}, pool_size=pool_size)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"external_id": 1}])
+        conn.execute(insert(models.Entry), [
+            {"user_id": 1, "text": f"Entry {i}", "entry_type": models.EntryType.note} for i in range(1000)
+        ])
+
+    sync_sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_engine = create_async_engine(async_url(url), pool_size=pool_size)
+    async_sessions = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    def override_get_db():
+        db = sync_sessions()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with async_sessions() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(router)
+
+    @app.get("/sync/list", response_model=list[schemas.EntryOut])
+    def sync_list(user_id: int, limit: int = 5, db: Session = Depends(get_db)):
+        return crud.list_recent_entries(db, user_id, limit)
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    return app
+
+
+async def run(app, path, requests, concurrency):
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get(path, params={"user_id": 1, "limit": 5})
+                response.raise_for_status()
+
+        await one()  # warm up connections
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = build_app(os.path.join(tmp, "bench.db"), args.concurrency)
+        results = {
+            "sync (threadpool)": asyncio.run(run(app, "/sync/list", args.requests, args.concurrency)),
+            "async (event loop)": asyncio.run(run(app, "/list", args.requests, args.concurrency)),
+        }
+
+    print(f"{'route':<22}{'seconds':>10}{'req/s':>10}")
+    for name, elapsed in results.items():
+        print(f"{name:<22}{elapsed:>10.3f}{args.requests / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
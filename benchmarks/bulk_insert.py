@@ -0,0 +1,78 @@
+"""
+Compare per-entry inserts (crud.create_entry) with crud.create_entries_bulk
+on a fresh SQLite file.
+
+    python -m benchmarks.bulk_insert --entries 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app import crud, models, schemas
+
+
+def _fresh_session(path):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return engine, sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def _entries(user_id, count):
+    return [
+        schemas.EntryIn(user_id=user_id, text=f"Imported message {i}", entry_type=models.EntryType.note)
+        for i in range(count)
+    ]
+
+
+def bench_per_entry(path, count):
+    engine, db = _fresh_session(path)
+    user = crud.create_user(db, schemas.UserCreate(external_id=1))
+    entries = _entries(user.id, count)
+    started = time.perf_counter()
+    for entry in entries:
+        # Mirrors POST /entry: a user lookup plus add/commit/refresh per entry
+        crud.get_user_by_id(db, entry.user_id)
+        crud.create_entry(db, entry)
+    elapsed = time.perf_counter() - started
+    db.close()
+    engine.dispose()
+    return elapsed
+
+
+def bench_bulk(path, count, batch_size):
+    engine, db = _fresh_session(path)
+    user = crud.create_user(db, schemas.UserCreate(external_id=1))
+    entries = _entries(user.id, count)
+    started = time.perf_counter()
+    crud.existing_user_ids(db, {entry.user_id for entry in entries})
+    crud.create_entries_bulk(db, entries, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    db.close()
+    engine.dispose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        per_entry = bench_per_entry(os.path.join(tmp, "per_entry.db"), args.entries)
+        bulk = bench_bulk(os.path.join(tmp, "bulk.db"), args.entries, args.batch_size)
+
+    print(f"{'mode':<12}{'seconds':>10}{'entries/s':>14}")
+    for name, elapsed in (("per-entry", per_entry), ("bulk", bulk)):
+        print(f"{name:<12}{elapsed:>10.3f}{args.entries / elapsed:>14.0f}")
+    print(f"speedup: {per_entry / bulk:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
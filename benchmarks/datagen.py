@@ -0,0 +1,113 @@
+"""
+Deterministic synthetic diary data for benchmarks.
+
+The same seed always produces the same users, texts, tags and dates, so runs
+on different commits measure the same workload. Text lengths are long-tailed
+(most entries are a sentence or two, a few are long reflections), tag use is
+skewed towards a few favourites, and dates are spread over two years with
+several entries on active days.
+
+    python -m benchmarks.datagen bench.db --users 200 --entries 500
+"""
+import argparse
+import os
+import random
+from datetime import date, datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from app.db import Base, make_engine
+from app import crud, models
+
+# Fixed so that generated dates don't depend on when the benchmark runs
+END_DATE = date(2025, 6, 30)
+SPAN_DAYS = 730
+
+WORDS = (
+    "today felt calm after coffee walked read wrote coded learned sqlite python idea "
+    "project meeting family friend book music tired grateful focus plan reflect notes "
+    "garden weather morning evening run gym dinner travel work bug fix release design "
+    "question answer habit goal progress slow quick quiet busy happy anxious hopeful"
+).split()
+
+TAGS = ["work", "idea", "health", "family", "reading", "python", "sqlite", "travel",
+        "music", "garden", "goals", "gratitude", "sleep", "food", "finance"]
+
+ENTRY_TYPES = list(models.EntryType)
+
+
+def _text(rng: random.Random) -> str:
+    # Long-tailed: median ~12 words, occasionally a few hundred
+    length = max(1, min(400, int(rng.lognormvariate(2.5, 0.9))))
+    return " ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+def _tags(rng: random.Random) -> str:
+    count = rng.choices([0, 1, 2, 3], weights=[30, 40, 20, 10])[0]
+    # Zipf-like: the first tags are used far more often than the last
+    chosen = rng.choices(TAGS, weights=[1 / (rank + 1) for rank in range(len(TAGS))], k=count)
+    return ", ".join(f"#{tag}" for tag in dict.fromkeys(chosen)) or None
+
+def iter_entries(rng: random.Random, user_id: int, count: int):
+    # Each user writes on a subset of days, several entries on some of them
+    active_days = sorted(rng.sample(range(SPAN_DAYS), k=min(SPAN_DAYS, max(1, count * 2 // 3))))
+    for _ in range(count):
+        day = END_DATE - timedelta(days=rng.choice(active_days))
+        timestamp = datetime(day.year, day.month, day.day, rng.randrange(6, 24), rng.randrange(60), rng.randrange(60))
+        yield {
+            "user_id": user_id,
+            "text": _text(rng),
+            "entry_type": rng.choices(ENTRY_TYPES, weights=[60, 25, 15])[0],
+            "tags": _tags(rng),
+            "source": rng.choice(["telegram", "telegram", "manual"]),
+            "timestamp": timestamp,
+            "date_only": day,
+        }
+
+def generate(engine, users: int = 50, entries: int = 400, seed: int = 0, batch_size: int = 5000) -> None:
+    """
+    Fill an empty database with users * entries entries (plus tags, stats and
+    search index, which the triggers and backfill_tags maintain).
+    """
+    rng = random.Random(seed)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": user_id, "external_id": 100000 + user_id, "username": f"user{user_id}"}
+            for user_id in range(1, users + 1)
+        ])
+        batch = []
+        for user_id in range(1, users + 1):
+            for row in iter_entries(rng, user_id, entries):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    conn.execute(insert(models.Entry), batch)
+                    batch = []
+        if batch:
+            conn.execute(insert(models.Entry), batch)
+
+    with Session(engine) as db:
+        crud.backfill_tags(db, chunk_size=batch_size)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="SQLite file to create")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--entries", type=int, default=400, help="entries per user")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+    engine = make_engine(f"sqlite:///{args.path}")
+    generate(engine, args.users, args.entries, args.seed)
+    engine.dispose()
+    print(f"✅ {args.users} users, {args.users * args.entries} entries in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
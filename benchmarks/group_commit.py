@@ -0,0 +1,94 @@
+"""
+Sustained entry writes per second with and without group commit.
+
+Writer threads create entries as fast as they can for a fixed time, either
+each with its own commit (crud.create_entry, like POST /entry by default) or
+through one GroupCommitWriter (like POST /entry with GROUP_COMMIT=1), once
+per durability mode. Latency is per entry, from submit to committed.
+
+    python -m benchmarks.group_commit --seconds 5 --writers 32
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app.db import Base, make_engine
+from app.group_commit import SYNCHRONOUS, GroupCommitWriter
+from app import crud, models, schemas
+
+
+def run(path, mode, seconds, writers, max_rows, max_delay_ms):
+    engine = make_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with sessions() as db:
+        user_id = crud.create_user(db, schemas.UserCreate(external_id=1)).id
+    writer = None if mode == "per-entry" else GroupCommitWriter(engine, max_rows, max_delay_ms, durability=mode)
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def work():
+        own, failed = [], 0
+        with sessions() as db:
+            while time.perf_counter() < deadline:
+                entry = schemas.EntryIn(user_id=user_id, text="Benchmark entry #bench", entry_type=models.EntryType.note)
+                start = time.perf_counter()
+                try:
+                    if writer is None:
+                        crud.create_entry(db, entry)
+                    else:
+                        writer.create_entry(entry)
+                except OperationalError:
+                    db.rollback()
+                    failed += 1
+                    continue
+                own.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=work) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    groups = None
+    if writer is not None:
+        writer.close()
+        groups = writer.groups
+    engine.dispose()
+    return latencies, errors[0], groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--max-rows", type=int, default=256)
+    parser.add_argument("--max-delay-ms", type=float, default=5)
+    parser.add_argument("--mode", action="append", choices=["per-entry", *SYNCHRONOUS],
+                        help="mode to run (repeatable, default: all)")
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'entries/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'rows/group':>12}{'locked':>8}")
+    for mode in args.mode or ["per-entry", *SYNCHRONOUS]:
+        with tempfile.TemporaryDirectory() as tmp:
+            latencies, locked, groups = run(os.path.join(tmp, "bench.db"), mode, args.seconds,
+                                            args.writers, args.max_rows, args.max_delay_ms)
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+        per_group = f"{len(latencies) / groups:.1f}" if groups else "1"
+        print(f"{mode:<12}{len(latencies) / args.seconds:>10.0f}{quantiles[49] * 1000:>9.1f}"
+              f"{quantiles[98] * 1000:>9.1f}{per_group:>12}{locked:>8}")
+
+
+if __name__ == "__main__":
+    main()
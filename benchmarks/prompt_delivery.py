@@ -0,0 +1,83 @@
+"""
+Throughput of the prompt delivery pipeline (api.send_prompt) against an
+in-process fake Bot API, and whether a day's prompts fit the evening window.
+
+With the default --rate 0 the pipeline runs unthrottled, which measures how
+fast it can read, send and record; the projected time at the configured
+PROMPT_GLOBAL_RATE is then users / rate, as long as the pipeline is faster
+than that. Pass --rate to run paced for real.
+
+    python -m benchmarks.prompt_delivery --users 100000 --window-minutes 120
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import httpx
+from fastapi import FastAPI, Request
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import sessionmaker
+from api.send_prompt import deliver_daily_prompts
+from app import config, logic, models, prompt_schedule
+from app.db import make_engine
+from benchmarks.datagen import generate
+
+
+def fake_bot_api() -> FastAPI:
+    api = FastAPI()
+    api.state.messages = 0
+
+    @api.post("/bot{token}/sendMessage")
+    async def send_message(token: str, request: Request):
+        body = await request.json()
+        api.state.messages += 1
+        return {"ok": True, "result": {"message_id": api.state.messages, "chat": {"id": body["chat_id"]}}}
+
+    return api
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=0, help="global messages/s to run at, 0 = unthrottled")
+    parser.add_argument("--concurrency", type=int, default=config.PROMPT_CONCURRENCY)
+    parser.add_argument("--window-minutes", type=float, default=120, help="time allowed for the evening send")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(f"sqlite:///{os.path.join(tmp, 'prompts.db')}")
+        generate(engine, users=args.users, entries=0)
+        sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        # Every user's slot is now, so one tick writes the whole day's prompts
+        now = prompt_schedule.utc_now()
+        with sessions() as db:
+            db.execute(update(models.User).values(next_prompt_at=now))
+            db.commit()
+        logic.create_due_prompts(now, session_factory=sessions, prompts=["How was your day?"], limit=args.users)
+
+        api = fake_bot_api()
+        report = deliver_daily_prompts(
+            token="bench", base_url="http://telegram", session_factory=sessions, transport=httpx.ASGITransport(app=api),
+            global_rate=args.rate, chat_rate=config.PROMPT_CHAT_RATE, concurrency=args.concurrency,
+        )
+        with sessions() as db:
+            recorded = db.scalar(select(func.count()).select_from(models.PromptDelivery))
+        engine.dispose()
+
+    print(f"delivered: {report}")
+    print(f"recorded:  {recorded} delivery rows, fake API saw {api.state.messages} messages")
+
+    rate = args.rate or config.PROMPT_GLOBAL_RATE
+    projected = report.seconds if args.rate else max(report.seconds, args.users / rate if rate else 0)
+    print(f"projected: {projected / 60:.1f} min for {args.users} users at {rate:g} msg/s "
+          f"(window {args.window_minutes:g} min)")
+    if projected > args.window_minutes * 60:
+        print("❌ does not fit the window; raise PROMPT_GLOBAL_RATE (Telegram allows ~30/s) or send earlier")
+        sys.exit(1)
+    print("✅ fits the window")
+
+
+if __name__ == "__main__":
+    main()
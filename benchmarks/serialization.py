@@ -0,0 +1,79 @@
+"""
+Cost of turning 1k entries into a JSON response body, old path versus fast path.
+
+- orm: load ORM objects, model_validate each one, validate the list again
+  against response_model and encode it with jsonable_encoder + json.dumps
+  (what the routes did before).
+- rows: load rows of crud.ENTRY_OUT_COLUMNS, validate them once with
+  schemas.EntryOutList and dump straight to bytes.
+
+Times include the query, reported in milliseconds per 1k entries.
+
+    python -m benchmarks.serialization --entries 5000 --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.db import Base
+from app import crud, models, schemas
+
+
+def orm_path(db, user_id):
+    entries = db.execute(crud.export_query(user_id)).scalars().all()
+    validated = [schemas.EntryOut.model_validate(e, from_attributes=True) for e in entries]
+    # FastAPI validates the returned value against response_model once more
+    checked = schemas.EntryOutList.validate_python(validated)
+    body = json.dumps(jsonable_encoder(checked)).encode("utf-8")
+    db.expunge_all()
+    return body
+
+def rows_path(db, user_id):
+    rows = db.execute(crud.entry_columns(crud.export_query(user_id))).all()
+    return schemas.EntryOutList.dump_json(schemas.EntryOutList.validate_python(rows, from_attributes=True))
+
+def measure(fn, db, user_id, repeat):
+    fn(db, user_id)  # warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(db, user_id)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"external_id": 1}])
+        conn.execute(insert(models.Entry), [
+            {"user_id": 1, "text": f"Entry {i} " + "lorem ipsum " * 10, "tags": "#bench",
+             "entry_type": models.EntryType.note}
+            for i in range(args.entries)
+        ])
+
+    db = sessionmaker(bind=engine)()
+    assert json.loads(orm_path(db, 1)) == json.loads(rows_path(db, 1))
+
+    per_1k = 1000 / args.entries
+    for name, fn in [("orm", orm_path), ("rows", rows_path)]:
+        seconds = measure(fn, db, 1, args.repeat)
+        print(f"{name:>5}: {seconds * per_1k * 1000:8.2f} ms per 1k entries")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Entry writes per second on one SQLite file versus spread over shards.
+
+Writer processes each write entries for their own user, one commit per
+entry (like POST /entry from separate API workers), for a fixed time. With
+--shards 1 every commit queues on the one file's write lock; with more,
+users are placed on shards by app.sharding and commits on different files
+run in parallel. The durable profile (an fsync per commit) is where the
+single lock hurts most; the gain needs as many free cores as shards.
+
+    python -m benchmarks.sharding --seconds 5 --writers 8 --shards 1 --shards 4
+"""
+import argparse
+import os
+import multiprocessing
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app.db import Base, SQLITE_PROFILES, make_engine
+from app.sharding import ShardRouter, shard_tables
+from app import crud, models, schemas
+
+
+def run(tmp, shard_count, seconds, writers, profile):
+    directory_url = f"sqlite:///{os.path.join(tmp, 'directory.db')}"
+    directory = make_engine(directory_url, profile=profile)
+    Base.metadata.create_all(bind=directory)
+    router = ShardRouter([f"sqlite:///{os.path.join(tmp, f'shard{n}.db')}" for n in range(shard_count)],
+                         directory_url=directory_url, directory_engine=directory, profile=profile)
+    for shard_id in router.shard_ids():
+        Base.metadata.create_all(bind=router.engine(shard_id),
+                                 tables=[Base.metadata.tables[name] for name in shard_tables()])
+
+    with sessionmaker(bind=directory)() as db:
+        users = [crud.create_user(db, schemas.UserCreate(external_id=n), shard_id=router.placement(n))
+                 for n in range(writers)]
+        users = [(user.id, user.shard_id) for user in users]
+
+    router.dispose()
+    directory.dispose()
+
+    # One process per writer, like API workers: threads in one process would
+    # be bound by the GIL long before the write lock
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    deadline = time.time() + seconds
+    processes = [context.Process(target=work, args=(router, *user, deadline, results)) for user in users]
+    for process in processes:
+        process.start()
+    counts = {"writes": 0, "locked": 0}
+    for _ in processes:
+        done, locked = results.get()
+        counts["writes"] += done
+        counts["locked"] += locked
+    for process in processes:
+        process.join()
+    return counts
+
+
+def work(router, user_id, shard_id, deadline, results):
+    done = locked = 0
+    with router.sessionmaker(shard_id)() as db:
+        while time.time() < deadline:
+            try:
+                crud.create_entry(db, schemas.EntryIn(user_id=user_id, text="Benchmark entry",
+                                                      entry_type=models.EntryType.note))
+                done += 1
+            except OperationalError:
+                db.rollback()
+                locked += 1
+    results.put((done, locked))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=8, help="writer processes")
+    parser.add_argument("--profile", default="durable", choices=sorted(SQLITE_PROFILES))
+    parser.add_argument("--shards", type=int, action="append", help="shard count to run (repeatable, default: 1 and 4)")
+    args = parser.parse_args()
+
+    print(f"{'shards':<8}{'writes/s':>10}{'locked':>8}")
+    for shard_count in args.shards or [1, 4]:
+        with tempfile.TemporaryDirectory() as tmp:
+            counts = run(tmp, shard_count, args.seconds, args.writers, args.profile)
+        print(f"{shard_count:<8}{counts['writes'] / args.seconds:>10.0f}{counts['locked']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Concurrent write/read throughput of each SQLite engine profile.
+
+Writer threads insert entries one commit at a time (like POST /entry) while
+reader threads run list_recent_entries (like GET /list), for a fixed time.
+
+    python -m benchmarks.sqlite_profiles --seconds 5 --writers 4 --readers 8
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app.db import Base, SQLITE_PROFILES, make_engine
+from app import crud, models, schemas
+
+
+def run_profile(path, profile, seconds, writers, readers):
+    engine = make_engine(f"sqlite:///{path}", profile=profile)
+    Base.metadata.create_all(bind=engine)
+    sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with sessions() as db:
+        user_id = crud.create_user(db, schemas.UserCreate(external_id=1)).id
+
+    counts = {"writes": 0, "reads": 0, "locked": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def work(write):
+        done = locked = 0
+        with sessions() as db:
+            while time.perf_counter() < deadline:
+                try:
+                    if write:
+                        crud.create_entry(db, schemas.EntryIn(
+                            user_id=user_id, text="Benchmark entry", entry_type=models.EntryType.note
+                        ))
+                    else:
+                        crud.list_recent_entries(db, user_id, 5)
+                        db.rollback()  # end the read transaction like a request would
+                    done += 1
+                except OperationalError:
+                    db.rollback()
+                    locked += 1
+        with lock:
+            counts["writes" if write else "reads"] += done
+            counts["locked"] += locked
+
+    threads = [threading.Thread(target=work, args=(True,)) for _ in range(writers)]
+    threads += [threading.Thread(target=work, args=(False,)) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--profile", action="append", choices=sorted(SQLITE_PROFILES),
+                        help="profile to run (repeatable, default: all)")
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'writes/s':>10}{'reads/s':>10}{'locked':>8}")
+    for profile in args.profile or list(SQLITE_PROFILES):
+        with tempfile.TemporaryDirectory() as tmp:
+            counts = run_profile(os.path.join(tmp, "bench.db"), profile,
+                                 args.seconds, args.writers, args.readers)
+        print(f"{profile:<10}{counts['writes'] / args.seconds:>10.0f}"
+              f"{counts['reads'] / args.seconds:>10.0f}{counts['locked']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Cold-start import time of the API, measured with `python -X importtime`.
+
+Each run imports the module in a fresh interpreter, so nothing is cached in
+sys.modules; the report is the median cumulative import time over --runs and
+the modules that cost the most on their own. With --budget-ms the exit
+status is 1 when the median is over budget, which is what
+tests/test_startup.py checks on every test run.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --module api.main --runs 7 --budget-ms 2000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Measured without a database or a scheduler, like a worker before its lifespan runs
+ENV = {"DATABASE_URL": "sqlite://", "SCHEDULER_MODE": "off", "PYTHONDONTWRITEBYTECODE": "1"}
+
+
+def import_profile(module: str = "api.main") -> Dict[str, Tuple[int, int]]:
+    """
+    module -> (self µs, cumulative µs) for one import of module in a fresh interpreter.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env={**os.environ, **ENV}, capture_output=True, text=True, check=True,
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+def import_time_ms(module: str = "api.main", runs: int = 5) -> Tuple[float, List[Dict[str, Tuple[int, int]]]]:
+    """
+    Median cumulative import time of module in milliseconds, and the profiles.
+    """
+    profiles = [import_profile(module) for _ in range(runs)]
+    return statistics.median(p[module][1] for p in profiles) / 1000, profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="api.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="list this many modules by self time")
+    parser.add_argument("--budget-ms", type=float, help="fail if the median is over this")
+    args = parser.parse_args()
+
+    median_ms, profiles = import_time_ms(args.module, args.runs)
+    self_ms = {name: statistics.median(p[name][0] for p in profiles if name in p) / 1000 for name in profiles[0]}
+    print(f"{'module':<50}{'self ms':>10}")
+    for name, ms in sorted(self_ms.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<50}{ms:>10.1f}")
+    print(f"\nimport {args.module}: {median_ms:.0f} ms (median of {args.runs})")
+
+    if args.budget_ms and median_ms > args.budget_ms:
+        print(f"❌ over the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Latency suite for the hot paths: crud functions, the Markdown exporter and
+the routes through the ASGI app in-process, on data from benchmarks.datagen.
+
+Every case runs --repeat times after a warm-up call and is reported as
+p50/p95/p99 in milliseconds. With --baseline, cases whose p50 is more than
+--tolerance (and --min-delta-ms) slower than the stored baseline are listed
+and the exit status is 1, so a regression fails the run.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from app.db import get_async_db, get_db, make_async_engine, make_engine
+from app import crud, models, schemas
+from app.exporter import entries_to_markdown
+from api.routes import router
+from benchmarks.datagen import generate
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": round(cuts[49] * 1000, 4),
+        "p95_ms": round(cuts[94] * 1000, 4),
+        "p99_ms": round(cuts[98] * 1000, 4),
+        "n": len(samples),
+    }
+
+# Like timeit, the collector is paused while a case runs, so a collection
+# triggered by earlier cases doesn't land in this one's tail latencies.
+
+def time_sync(fn, repeat):
+    fn()
+    gc.collect()
+    gc.disable()
+    try:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+    return percentiles(samples)
+
+async def time_async(fn, repeat):
+    await fn()
+    gc.collect()
+    gc.disable()
+    try:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - started)
+    finally:
+        gc.enable()
+    return percentiles(samples)
+
+
+def pick_target(sessions):
+    # User 1 and their busiest day; the last user takes the writes
+    with sessions() as db:
+        busiest = db.execute(
+            select(models.DailyStat.date_only)
+            .where(models.DailyStat.user_id == 1)
+            .group_by(models.DailyStat.date_only)
+            .order_by(func.sum(models.DailyStat.count).desc(), models.DailyStat.date_only)
+            .limit(1)
+        ).scalar_one()
+        writer = db.execute(select(func.max(models.User.id))).scalar_one()
+    return {"user_id": 1, "external_id": 100001, "day": busiest, "writer_id": writer,
+            "tag": "work", "q": "coffee"}
+
+def crud_cases(sessions, t):
+    def in_session(fn):
+        def run():
+            with sessions() as db:
+                return fn(db)
+        return run
+
+    new_entry = schemas.EntryIn(user_id=t["writer_id"], text="Benchmark entry", entry_type=models.EntryType.note,
+                                tags="#bench")
+    with sessions() as db:
+        export = schemas.EntryOutList.validate_python(crud.export_entry_rows(db, t["user_id"]), from_attributes=True)
+
+    return {
+        "crud.get_user_by_id": in_session(lambda db: crud.get_user_by_id(db, t["user_id"])),
+        "crud.get_user_by_external_id": in_session(lambda db: crud.get_user_by_external_id(db, t["external_id"])),
+        "crud.get_cached_user_by_id": in_session(lambda db: crud.get_cached_user_by_id(db, t["user_id"])),
+        "crud.get_entries_by_date": in_session(lambda db: crud.get_entries_by_date(db, t["user_id"], t["day"])),
+        "crud.list_recent_entries": in_session(lambda db: crud.list_recent_entries(db, t["user_id"], 20)),
+        "crud.list_recent_entries[tag]": in_session(lambda db: crud.list_recent_entries(db, t["user_id"], 20, tag=t["tag"])),
+        "crud.export_entries": in_session(lambda db: crud.export_entries(db, t["user_id"])),
+        "crud.export_entry_rows": in_session(lambda db: crud.export_entry_rows(db, t["user_id"])),
+        "crud.iter_export_entries": in_session(lambda db: sum(1 for _ in crud.iter_export_entries(db, t["user_id"]))),
+        "crud.export_entries_page": in_session(lambda db: crud.export_entries_page(db, t["user_id"], limit=100)),
+        "crud.search_entries": in_session(lambda db: crud.search_entries(db, t["user_id"], t["q"])),
+        "crud.tag_counts": in_session(lambda db: crud.tag_counts(db, t["user_id"])),
+        "crud.get_daily_stats": in_session(lambda db: crud.get_daily_stats(db, t["user_id"])),
+        "crud.change_marker": in_session(lambda db: crud.change_marker(db, t["user_id"])),
+        "crud.create_entry": in_session(lambda db: crud.create_entry(db, new_entry)),
+        "exporter.entries_to_markdown": lambda: entries_to_markdown(export),
+    }
+
+def route_cases(client, t):
+    user_id, day = t["user_id"], t["day"].isoformat()
+
+    def get(url, **params):
+        async def run():
+            response = await client.get(url, params=params)
+            response.raise_for_status()
+        return run
+
+    async def post_entry():
+        response = await client.post("/entry", json={"user_id": t["writer_id"], "text": "Benchmark entry",
+                                                     "entry_type": "note", "tags": "#bench"})
+        response.raise_for_status()
+
+    return {
+        "GET /users/{id}": get(f"/users/{user_id}"),
+        "GET /users/by_external_id/{id}": get(f"/users/by_external_id/{t['external_id']}"),
+        "GET /entry/{date}": get(f"/entry/{day}", user_id=user_id),
+        "GET /list": get("/list", user_id=user_id, limit=20),
+        "GET /export": get("/export", user_id=user_id),
+        "GET /export?stream": get("/export", user_id=user_id, stream="true"),
+        "GET /export/page": get("/export/page", user_id=user_id, limit=100),
+        "GET /search": get("/search", user_id=user_id, q=t["q"]),
+        "GET /tags": get("/tags", user_id=user_id),
+        "GET /stats": get("/stats", user_id=user_id),
+        "GET /stats/heatmap": get("/stats/heatmap", user_id=user_id, year=2025),
+        "POST /entry": post_entry,
+    }
+
+def build_app(sessions, async_sessions):
+    def override_get_db():
+        db = sessions()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with async_sessions() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    return app
+
+async def run_routes(app, t, repeat):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        return {name: await time_async(fn, repeat) for name, fn in route_cases(client, t).items()}
+
+def run(users, entries, seed, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = make_engine(url)
+        generate(engine, users, entries, seed)
+        sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        async_engine = make_async_engine(url)
+        async_sessions = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        crud.user_cache.clear()
+
+        t = pick_target(sessions)
+        results = {name: time_sync(fn, repeat) for name, fn in crud_cases(sessions, t).items()}
+        results.update(asyncio.run(run_routes(build_app(sessions, async_sessions), t, repeat)))
+
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """
+    Print a table against the baseline and return the names of regressed cases.
+    Sub-millisecond cases jitter by large ratios, so a regression must also be
+    at least min_delta_ms slower in absolute terms.
+    """
+    regressions = []
+    print(f"{'case':<34}{'p50':>9}{'p95':>9}{'p99':>9}{'base p50':>10}{'change':>9}")
+    for name, stats in results.items():
+        base = baseline.get(name)
+        change = ""
+        if base:
+            ratio = stats["p50_ms"] / base["p50_ms"] - 1 if base["p50_ms"] else 0.0
+            change = f"{ratio:+.0%}"
+            if ratio > tolerance and stats["p50_ms"] - base["p50_ms"] > min_delta_ms:
+                regressions.append(name)
+                change += " !"
+        base_p50 = f"{base['p50_ms']:.3f}" if base else "-"
+        print(f"{name:<34}{stats['p50_ms']:>9.3f}{stats['p95_ms']:>9.3f}{stats['p99_ms']:>9.3f}{base_p50:>10}{change:>9}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--entries", type=int, default=400, help="entries per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE, help=f"compare with a results file (default {BASELINE})")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown, 0.25 = 25%%")
+    parser.add_argument("--min-delta-ms", type=float, default=0.2, help="ignore p50 changes smaller than this")
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE, help="write results as the new baseline")
+    args = parser.parse_args()
+
+    results = run(args.users, args.entries, args.seed, args.repeat)
+    report = {
+        "meta": {
+            "users": args.users,
+            "entries_per_user": args.entries,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "date": date.today().isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored["meta"]["users"] != args.users or stored["meta"]["entries_per_user"] != args.entries:
+            print("⚠️ baseline was recorded with a different data size", file=sys.stderr)
+        baseline = stored["results"]
+
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    if regressions:
+        print(f"\n❌ {len(regressions)} case(s) slower than baseline by more than {args.tolerance:.0%}: "
+              + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
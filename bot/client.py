@@ -0,0 +1,220 @@
+"""
+Async HTTP client the bot uses to talk to the diary API.
+
+One DiaryClient is shared by all handlers. It keeps a bounded pool of
+keep-alive connections, retries transient failures with jittered
+exponential backoff, caches external_id -> user lookups, and coalesces
+concurrent identical GETs, so a burst of updates from one chat costs one
+lookup and reuses open connections.
+
+    async with DiaryClient() as api:
+        user = await api.get_or_create_user(telegram_id, username="john_doe")
+        await api.create_entry(user["id"], "Learned about SQLite transactions.", entry_type="idea")
+"""
+import asyncio
+import random
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import httpx
+
+from app import config
+from app.cache import TTLCache
+
+# Worth retrying: the request may succeed if sent again a little later
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class DiaryAPIError(Exception):
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class DiaryClient:
+    def __init__(self,
+                 base_url: str = config.API_URL,
+                 *,
+                 timeout: float = config.API_TIMEOUT,
+                 max_connections: int = config.API_MAX_CONNECTIONS,
+                 retries: int = config.API_RETRIES,
+                 backoff: float = 0.2,
+                 max_backoff: float = 5.0,
+                 user_cache_size: int = 10000,
+                 user_cache_ttl: float = 300.0,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.users = TTLCache(user_cache_size, user_cache_ttl)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    async def __aenter__(self) -> "DiaryClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    # ------------------------
+    # TRANSPORT
+    # ------------------------
+
+    def _delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        # Full jitter, so clients that failed together don't retry together
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _request(self, method: str, url: str, *, idempotent: bool, **kwargs) -> httpx.Response:
+        """
+        Send a request, retrying transient failures up to self.retries times.
+        Non-idempotent requests are only retried when the connection could not
+        be opened, since then the API cannot have received them.
+        """
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = await self._http.request(method, url, **kwargs)
+            except httpx.ConnectError:
+                if last:
+                    raise
+                response = None
+            except httpx.TransportError:
+                if last or not idempotent:
+                    raise
+                response = None
+            else:
+                if response.status_code not in RETRY_STATUSES or last or not idempotent:
+                    return response
+            await asyncio.sleep(self._delay(attempt, response))
+
+    async def _single_flight(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run call once for all concurrent callers with the same key.
+        The call runs as its own task, so a caller that is cancelled only
+        stops waiting; the others still get its result.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+
+            def done(task: asyncio.Task) -> None:
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+                if not task.cancelled():
+                    task.exception()  # callers re-raise it; don't warn if they all left
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _json(response: httpx.Response) -> Any:
+        if response.is_error:
+            try:
+                detail = response.json().get("detail")
+            except ValueError:
+                detail = response.text
+            raise DiaryAPIError(response.status_code, detail)
+        return response.json()
+
+    async def _get(self, url: str, params: Optional[dict] = None) -> Any:
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        key = ("GET", url, tuple(sorted(params.items())))
+
+        async def call():
+            return self._json(await self._request("GET", url, idempotent=True, params=params))
+        return await self._single_flight(key, call)
+
+    async def _post(self, url: str, payload: dict) -> Any:
+        return self._json(await self._request("POST", url, idempotent=False, json=payload))
+
+    # ------------------------
+    # USERS
+    # ------------------------
+
+    async def get_user(self, external_id: int) -> Optional[dict]:
+        """
+        The API user for a Telegram id, or None. Found users are cached.
+        """
+        cached = self.users.get(external_id)
+        if cached is not None:
+            return cached
+        try:
+            user = await self._get(f"/users/by_external_id/{external_id}")
+        except DiaryAPIError as e:
+            if e.status_code == 404:
+                return None
+            raise
+        self.users.set(external_id, user)
+        return user
+
+    async def get_or_create_user(self, external_id: int, username: Optional[str] = None, language: str = "uk") -> dict:
+        user = await self.get_user(external_id)
+        if user is not None:
+            return user
+
+        async def create():
+            try:
+                return await self._post("/users", {"external_id": external_id, "username": username, "language": language})
+            except DiaryAPIError as e:
+                # Created by another bot process in the meantime
+                if e.status_code != 400:
+                    raise
+                return await self._get(f"/users/by_external_id/{external_id}")
+
+        user = await self._single_flight(("create_user", external_id), create)
+        self.users.set(external_id, user)
+        return user
+
+    def forget_user(self, external_id: int) -> None:
+        self.users.pop(external_id)
+
+    # ------------------------
+    # ENTRIES
+    # ------------------------
+
+    async def create_entry(self,
+                           user_id: int,
+                           text: str,
+                           entry_type: str = "note",
+                           tags: Optional[str] = None,
+                           message_id: Optional[int] = None,
+                           source: str = "telegram") -> dict:
+        return await self._post("/entry", {
+            "user_id": user_id, "text": text, "entry_type": entry_type,
+            "tags": tags, "message_id": message_id, "source": source,
+        })
+
+    async def list_recent_entries(self, user_id: int, limit: int = 5, tag: Optional[str] = None) -> List[dict]:
+        return await self._get("/list", {"user_id": user_id, "limit": limit, "tag": tag})
+
+    async def get_entries_by_date(self, user_id: int, entry_date: date, tag: Optional[str] = None) -> List[dict]:
+        return await self._get(f"/entry/{entry_date.isoformat()}", {"user_id": user_id, "tag": tag})
+
+    async def search_entries(self, user_id: int, q: str, limit: int = 20) -> dict:
+        return await self._get("/search", {"user_id": user_id, "q": q, "limit": limit})
+
+    async def export_markdown(self,
+                              user_id: int,
+                              start_date: Optional[date] = None,
+                              end_date: Optional[date] = None) -> Optional[str]:
+        """
+        The Markdown export, or None if there are no entries in the range.
+        """
+        result = await self._get("/export", {
+            "user_id": user_id,
+            "start_date": start_date.isoformat() if start_date else None,
+            "end_date": end_date.isoformat() if end_date else None,
+        })
+        return result.get("markdown")
@@ -2,12 +2,18 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import json
 import pytest
+import time
+from datetime import date
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from app.db import get_db, Base
-from app import models
+from sqlalchemy.pool import NullPool
+from app.db import get_async_db, get_db, instrument_engine, Base
+from app import config, crud, models
+from app.group_commit import GroupCommitWriter, get_entry_writer
 from api.main import app
 
 # ------------------------
@@ -19,6 +25,13 @@ SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# TestClient may run each request on a different event loop, so don't pool async connections
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
 # ------------------------
 # Override dependency
 # ------------------------
@@ -27,6 +40,7 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 def client():
     # Create all tables using the real Base from app.db
     Base.metadata.create_all(bind=engine)
+    crud.user_cache.clear()
 
     def override_get_db():
         db = TestingSessionLocal()
@@ -35,7 +49,12 @@ def client():
         finally:
             db.close()
 
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
 
     yield TestClient(app)
 
@@ -60,6 +79,60 @@ def test_create_entry(client):
     assert result["text"] == "API test entry"
     assert result["entry_type"] == "note"
 
+def test_create_entry_for_existing_user(client):
+    user = client.post("/users", json={"external_id": 313131, "username": "async"}).json()
+    data = {"user_id": user["id"], "text": "Async entry", "entry_type": "idea", "date_only": "2025-06-01"}
+    response = client.post("/entry", json=data)
+    assert response.status_code == 200
+    created = response.json()
+    assert created["id"] is not None
+
+    listed = client.get(f"/entry/2025-06-01?user_id={user['id']}").json()
+    assert [e["id"] for e in listed] == [created["id"]]
+
+def test_create_entry_group_commit(client):
+    user = client.get("/users/by_external_id/313131").json()
+    writer = GroupCommitWriter(engine, max_delay_ms=1)
+    app.dependency_overrides[get_entry_writer] = lambda: writer
+    try:
+        response = client.post("/entry", json={"user_id": user["id"], "text": "Grouped entry",
+                                               "entry_type": "note", "date_only": "2025-06-02"})
+    finally:
+        del app.dependency_overrides[get_entry_writer]
+        writer.close()
+    assert response.status_code == 200
+    assert writer.rows == 1
+    listed = client.get(f"/entry/2025-06-02?user_id={user['id']}").json()
+    assert [e["id"] for e in listed] == [response.json()["id"]]
+
+def test_retried_entry_returns_stored_one(client):
+    user = client.get("/users/by_external_id/313131").json()
+    data = {"user_id": user["id"], "text": "Sent once", "entry_type": "note", "source": "telegram",
+            "message_id": 4242, "date_only": "2025-06-03"}
+    first = client.post("/entry", json=data).json()
+    retried = client.post("/entry", json={**data, "text": "Sent twice"}).json()
+    assert retried == first
+    listed = client.get(f"/entry/2025-06-03?user_id={user['id']}").json()
+    assert [e["text"] for e in listed] == ["Sent once"]
+
+def test_search_entries(client):
+    user = client.get("/users/by_external_id/313131").json()
+    response = client.get(f"/search?user_id={user['id']}&q=async")
+    assert response.status_code == 200
+    result = response.json()
+    assert [hit["text"] for hit in result["items"]] == ["Async entry"]
+    assert result["items"][0]["snippet"] == "**Async** entry"
+    assert result["next_offset"] is None
+
+def test_tag_filter_and_counts(client):
+    user = client.get("/users/by_external_id/313131").json()
+    client.post("/entry", json={"user_id": user["id"], "text": "Tagged", "entry_type": "note", "tags": "#Garden #ideas"})
+
+    listed = client.get(f"/list?user_id={user['id']}&tag=garden").json()
+    assert [e["text"] for e in listed] == ["Tagged"]
+    counts = client.get(f"/tags?user_id={user['id']}").json()
+    assert counts == [{"tag": "garden", "count": 1}, {"tag": "ideas", "count": 1}]
+
 def test_get_entries_by_date(client):
     response = client.get("/entry/2025-05-14?user_id=1")
     assert response.status_code == 200
@@ -74,6 +147,17 @@ def test_list_recent_entries(client):
     assert isinstance(result, list)
     assert len(result) <= 2
 
+def test_list_rejects_invalid_cursor(client):
+    response = client.get("/list?user_id=1&cursor=garbage")
+    assert response.status_code == 400
+
+def test_export_entries_page(client):
+    response = client.get("/export/page?user_id=1&limit=10")
+    assert response.status_code == 200
+    result = response.json()
+    assert isinstance(result["items"], list)
+    assert "next_cursor" in result
+
 def test_export_entries(client):
     response = client.get("/export?user_id=1&start_date=2025-05-01&end_date=2025-05-20")
     assert response.status_code == 200
@@ -81,9 +165,178 @@ def test_export_entries(client):
     assert "markdown" in result
     assert "# 📓" in result["markdown"]
 
+def test_export_entries_stream(client):
+    response = client.get("/export?user_id=1&start_date=2025-05-01&end_date=2025-05-20&stream=true")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/markdown")
+    assert response.text.startswith("# 📓")
+
+
+def test_create_entries_bulk_json(client):
+    user = client.post("/users", json={"external_id": 424242, "username": "bulk"}).json()
+    data = [
+        {"user_id": user["id"], "text": "Bulk one", "entry_type": "note"},
+        {"user_id": user["id"], "text": "Bulk two", "entry_type": "bogus"},
+        {"user_id": 987654, "text": "Nobody", "entry_type": "idea"},
+        {"user_id": user["id"], "text": "Bulk three", "entry_type": "idea", "date_only": "2025-05-15"},
+    ]
+    response = client.post("/entries/bulk", json=data)
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2
+    assert result["failed"] == 2
+    assert [r["index"] for r in result["results"]] == [0, 1, 2, 3]
+    assert result["results"][0]["id"] is not None
+    assert "entry_type" in result["results"][1]["error"]
+    assert result["results"][2]["error"] == "User not found"
+
+    listed = client.get(f"/list?user_id={user['id']}&limit=10").json()
+    assert {e["text"] for e in listed} == {"Bulk one", "Bulk three"}
+
+def test_create_entries_bulk_ndjson(client):
+    user = client.get("/users/by_external_id/424242").json()
+    lines = [json.dumps({"user_id": user["id"], "text": f"Line {i}", "entry_type": "note"}) for i in range(3)]
+    body = "\n".join(lines[:2]) + "\n\n{not json\n" + lines[2]
+    response = client.post("/entries/bulk", content=body, headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 3
+    assert result["failed"] == 1
+    assert result["results"][2]["error"]
+
+def test_create_entries_bulk_rejects_non_array(client):
+    response = client.post("/entries/bulk", json={"user_id": 1})
+    assert response.status_code == 400
+
 
 # -------- USER TESTS --------
 
+def test_conditional_list_and_since(client):
+    user = client.post("/users", json={"external_id": 616161, "username": "sync"}).json()
+    client.post("/entry", json={"user_id": user["id"], "text": "Before sync", "entry_type": "note"})
+
+    first = client.get(f"/list?user_id={user['id']}")
+    etag, version = first.headers["ETag"], first.headers["X-Sync-Version"]
+    assert "Last-Modified" in first.headers
+    cached = client.get(f"/list?user_id={user['id']}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    # Same data, different query: a different representation
+    assert client.get(f"/list?user_id={user['id']}&limit=2").headers["ETag"] != etag
+    # Same query on another route or date: also different
+    assert client.get(f"/export?user_id={user['id']}").headers["ETag"] != etag
+    assert (client.get(f"/entry/2025-01-01?user_id={user['id']}").headers["ETag"]
+            != client.get(f"/entry/2025-01-02?user_id={user['id']}").headers["ETag"])
+
+    client.post("/entry", json={"user_id": user["id"], "text": "After sync", "entry_type": "note"})
+    assert client.get(f"/list?user_id={user['id']}", headers={"If-None-Match": etag}).status_code == 200
+    changed = client.get(f"/export/page?user_id={user['id']}&since={version}").json()
+    assert [e["text"] for e in changed["items"]] == ["After sync"]
+    export = client.get(f"/export?user_id={user['id']}&since={version}")
+    assert "After sync" in export.json()["markdown"] and "Before sync" not in export.json()["markdown"]
+    assert client.get(f"/export?user_id={user['id']}&since={version}",
+                      headers={"If-None-Match": export.headers["ETag"]}).status_code == 304
+
+def test_stats_and_heatmap(client):
+    user = client.post("/users", json={"external_id": 717171, "username": "stats"}).json()
+    for day, entry_type in [("2024-12-31", "note"), ("2025-01-01", "idea"), ("2025-01-01", "note")]:
+        client.post("/entry", json={"user_id": user["id"], "text": "x", "entry_type": entry_type, "date_only": day})
+
+    result = client.get(f"/stats?user_id={user['id']}").json()
+    assert result["total"] == 3
+    assert result["by_type"] == {"note": 2, "idea": 1}
+    assert result["longest_streak"] == 2
+    assert result["days"][1] == {"date_only": "2025-01-01", "total": 2, "by_type": {"idea": 1, "note": 1}}
+
+    heatmap = client.get(f"/stats/heatmap?user_id={user['id']}&year=2025").json()
+    assert heatmap == {"year": 2025, "max": 2, "days": {"2025-01-01": 2}}
+
+def test_exports_include_archived_entries(client):
+    user = client.post("/users", json={"external_id": 727272, "username": "archive"}).json()
+    for day in ["2023-03-01", "2023-04-01", "2025-04-01"]:
+        client.post("/entry", json={"user_id": user["id"], "text": f"Written {day}", "entry_type": "note",
+                                    "date_only": day})
+    with TestingSessionLocal() as db:
+        assert crud.archive_entries(db, before=date(2024, 1, 1)) == 2
+
+    assert [e["text"] for e in client.get(f"/list?user_id={user['id']}").json()] == ["Written 2025-04-01"]
+    texts, cursor = [], None
+    while True:
+        page = client.get(f"/export/page?user_id={user['id']}&limit=1" + (f"&cursor={cursor}" if cursor else "")).json()
+        texts += [e["text"] for e in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert texts == ["Written 2023-03-01", "Written 2023-04-01", "Written 2025-04-01"]
+    markdown = client.get(f"/export?user_id={user['id']}").json()["markdown"]
+    assert markdown.index("Written 2023-03-01") < markdown.index("Written 2025-04-01")
+    assert client.get(f"/stats?user_id={user['id']}&start_date=2023-01-01").json()["total"] == 3
+
+def test_metrics_by_route_template(client):
+    user = client.get("/users/by_external_id/313131").json()
+    for _ in range(3):
+        client.get(f"/entry/2025-06-01?user_id={user['id']}")
+    client.get("/no/such/path")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    count = next(line for line in lines if line.startswith(
+        'http_request_duration_seconds_count{method="GET",route="/entry/{entry_date}",status="200"}'))
+    assert int(count.split()[-1]) >= 3
+    # Each of those requests ran SQL, attributed to the same template
+    assert any(line.startswith('http_request_db_queries_count{route="/entry/{entry_date}"}') for line in lines)
+    assert any('route="<unmatched>",status="404"' in line for line in lines)
+    assert any(line.startswith("user_cache_hits_total ") for line in lines)
+
+def test_export_job_download(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "EXPORT_DIR", str(tmp_path))
+    user = client.get("/users/by_external_id/313131").json()
+    response = client.post("/exports", json={"user_id": user["id"], "format": "jsonl"})
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] in ("queued", "running", "done")
+
+    deadline = time.monotonic() + 10
+    while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(0.05)
+        job = client.get(f"/exports/{job['id']}").json()
+    assert job["status"] == "done"
+
+    full = client.get(f"/exports/{job['id']}/download")
+    assert full.status_code == 200
+    assert len(full.content.splitlines()) == job["entries"]
+    partial = client.get(f"/exports/{job['id']}/download", headers={"Range": "bytes=0-9"})
+    assert partial.status_code == 206
+    assert partial.content == full.content[:10]
+
+def test_export_job_unknown_user(client):
+    response = client.post("/exports", json={"user_id": 999999, "format": "csv"})
+    assert response.status_code == 400
+    assert client.get("/exports/999999/download").status_code == 404
+
+def test_deleted_user_not_served_from_cache(client):
+    user = client.post("/users", json={"external_id": 515151, "username": "cached"}).json()
+    assert client.get(f"/users/{user['id']}").status_code == 200
+    assert client.get("/users/by_external_id/515151").status_code == 200
+
+    assert client.delete(f"/users/{user['id']}").status_code == 200
+    assert client.get(f"/users/{user['id']}").status_code == 404
+    assert client.get("/users/by_external_id/515151").status_code == 404
+    response = client.post("/entry", json={"user_id": user["id"], "text": "Too late", "entry_type": "note"})
+    assert response.status_code == 400
+
+def test_delete_user_with_entries(client):
+    user = client.post("/users", json={"external_id": 737373, "username": "leaving"}).json()
+    client.post("/entry", json={"user_id": user["id"], "text": "Bye #tag", "entry_type": "note", "tags": "#tag"})
+    assert client.delete(f"/users/{user['id']}").status_code == 200
+    assert client.get(f"/users/{user['id']}").status_code == 404
+    with TestingSessionLocal() as db:
+        assert crud.export_entries(db, user_id=user["id"]) == []
+        assert crud.tag_counts(db, user["id"]) == []
+    assert client.delete(f"/users/{user['id']}").status_code == 404
+
 def test_create_user(client):
     data = {
         "telegram_id": 999999,
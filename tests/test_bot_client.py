@@ -0,0 +1,140 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import httpx
+import pytest
+from collections import Counter
+from fastapi import FastAPI, HTTPException, Response
+from bot.client import DiaryAPIError, DiaryClient
+
+# ------------------------
+# Local stand-in for the diary API
+# ------------------------
+
+def make_api(failures: int = 0):
+    api = FastAPI()
+    api.state.calls = Counter()
+    api.state.users = {}
+    api.state.failures = failures
+
+    @api.get("/users/by_external_id/{external_id}")
+    async def by_external_id(external_id: int):
+        api.state.calls["lookup"] += 1
+        await asyncio.sleep(0.01)  # long enough for concurrent callers to overlap
+        if external_id not in api.state.users:
+            raise HTTPException(404, "User not found")
+        return api.state.users[external_id]
+
+    @api.post("/users")
+    async def create_user(user: dict):
+        api.state.calls["create"] += 1
+        await asyncio.sleep(0.01)
+        created = {"id": len(api.state.users) + 1, **user}
+        api.state.users[user["external_id"]] = created
+        return created
+
+    @api.get("/list")
+    async def list_entries(user_id: int, limit: int = 5):
+        api.state.calls["list"] += 1
+        if api.state.calls["list"] <= api.state.failures:
+            return Response(status_code=503, headers={"Retry-After": "0"})
+        return [{"id": 1, "user_id": user_id, "text": "hi"}]
+
+    @api.post("/entry")
+    async def create_entry(entry: dict):
+        api.state.calls["entry"] += 1
+        if api.state.calls["entry"] <= api.state.failures:
+            return Response(status_code=503)
+        return {"id": 10, **entry}
+
+    return api
+
+def make_client(api, **kwargs):
+    return DiaryClient("http://api", transport=httpx.ASGITransport(app=api), backoff=0, **kwargs)
+
+# ------------------------
+# Tests
+# ------------------------
+
+def test_concurrent_lookups_are_coalesced_and_cached():
+    api = make_api()
+    api.state.users[7] = {"id": 1, "external_id": 7}
+
+    async def scenario():
+        async with make_client(api) as client:
+            users = await asyncio.gather(*(client.get_user(7) for _ in range(50)))
+            assert all(user["id"] == 1 for user in users)
+            await client.get_user(7)
+    asyncio.run(scenario())
+    assert api.state.calls["lookup"] == 1
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    api = make_api()
+    api.state.users[7] = {"id": 1, "external_id": 7}
+
+    async def scenario():
+        async with make_client(api) as client:
+            first = asyncio.create_task(client.get_user(7))
+            await asyncio.sleep(0)
+            others = asyncio.gather(*(client.get_user(7) for _ in range(5)))
+            await asyncio.sleep(0)
+            first.cancel()
+            users = await others
+            assert all(user["id"] == 1 for user in users)
+            with pytest.raises(asyncio.CancelledError):
+                await first
+    asyncio.run(scenario())
+    assert api.state.calls["lookup"] == 1
+
+def test_missing_user_not_cached():
+    api = make_api()
+
+    async def scenario():
+        async with make_client(api) as client:
+            assert await client.get_user(8) is None
+            api.state.users[8] = {"id": 2, "external_id": 8}
+            assert (await client.get_user(8))["id"] == 2
+    asyncio.run(scenario())
+    assert api.state.calls["lookup"] == 2
+
+def test_get_or_create_user_creates_once():
+    api = make_api()
+
+    async def scenario():
+        async with make_client(api) as client:
+            users = await asyncio.gather(*(client.get_or_create_user(9, username="new") for _ in range(10)))
+            assert {user["id"] for user in users} == {1}
+    asyncio.run(scenario())
+    assert api.state.calls["create"] == 1
+
+def test_idempotent_requests_retried():
+    api = make_api(failures=2)
+
+    async def scenario():
+        async with make_client(api, retries=3) as client:
+            return await client.list_recent_entries(1)
+    assert asyncio.run(scenario())[0]["text"] == "hi"
+    assert api.state.calls["list"] == 3
+
+def test_retries_give_up_with_error():
+    api = make_api(failures=5)
+
+    async def scenario():
+        async with make_client(api, retries=2) as client:
+            await client.list_recent_entries(1)
+    with pytest.raises(DiaryAPIError) as e:
+        asyncio.run(scenario())
+    assert e.value.status_code == 503
+    assert api.state.calls["list"] == 3
+
+def test_posts_not_retried_after_reaching_the_api():
+    api = make_api(failures=1)
+
+    async def scenario():
+        async with make_client(api, retries=3) as client:
+            await client.create_entry(1, "hello")
+    with pytest.raises(DiaryAPIError):
+        asyncio.run(scenario())
+    assert api.state.calls["entry"] == 1
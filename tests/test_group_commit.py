@@ -0,0 +1,115 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from sqlalchemy import func, insert, select
+from app import models, schemas
+from app.db import Base, make_engine
+from app.group_commit import GroupCommitWriter
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'group.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"id": 1, "external_id": 501, "username": "user1", "source": "telegram"}])
+    yield engine
+    engine.dispose()
+
+def entry(n, **kw):
+    values = dict(user_id=1, text=f"entry {n}", entry_type="reflection", tags="group,commit",
+                  timestamp=datetime(2024, 5, 1, 12, 0, n % 60, tzinfo=timezone.utc))
+    values.update(kw)
+    return schemas.EntryIn(**values)
+
+def test_concurrent_entries_share_commits(engine):
+    writer = GroupCommitWriter(engine, max_rows=64, max_delay_ms=20)
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        stored = list(pool.map(lambda n: writer.create_entry(entry(n)), range(200)))
+    writer.close()
+
+    assert writer.rows == 200
+    assert writer.groups < 200
+    assert len({e.id for e in stored}) == 200
+    assert all(e.text == f"entry {n}" and e.date_only == date(2024, 5, 1) for n, e in enumerate(stored))
+    with engine.connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(models.Entry)) == 200
+        assert conn.scalar(select(func.count()).select_from(models.EntryTag)) == 400
+
+def test_bad_entry_fails_alone(engine):
+    writer = GroupCommitWriter(engine, max_delay_ms=50)
+    good = [writer.submit(entry(n)) for n in range(3)]
+    bad = writer.submit(schemas.EntryIn.model_construct(**{**entry(3).model_dump(), "text": None}))
+    good.append(writer.submit(entry(4)))
+    writer.close()
+
+    with pytest.raises(Exception, match="NOT NULL"):
+        bad.result()
+    assert [f.result().text for f in good] == ["entry 0", "entry 1", "entry 2", "entry 4"]
+
+def test_async_callers_and_close_flushes(engine):
+    writer = GroupCommitWriter(engine, max_rows=1000, max_delay_ms=10_000)
+
+    async def main():
+        pending = [asyncio.ensure_future(writer.create_entry_async(entry(n))) for n in range(10)]
+        await asyncio.sleep(0.05)
+        # Far from the delay or the row limit: only close() writes them
+        assert not any(p.done() for p in pending)
+        await asyncio.to_thread(writer.close)
+        return await asyncio.gather(*pending)
+
+    stored = asyncio.run(main())
+    assert writer.groups == 1
+    assert [e.text for e in stored] == [f"entry {n}" for n in range(10)]
+
+def test_retried_messages_in_one_group(engine):
+    writer = GroupCommitWriter(engine, max_delay_ms=50)
+    futures = [writer.submit(entry(n, source="telegram", message_id=n % 3)) for n in range(6)]
+    writer.close()
+
+    stored = [f.result() for f in futures]
+    assert writer.groups == 1
+    assert [e.id for e in stored[:3]] == [e.id for e in stored[3:]]
+    assert [e.text for e in stored] == ["entry 0", "entry 1", "entry 2"] * 2
+    with engine.connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(models.Entry)) == 3
+        assert conn.scalar(select(func.count()).select_from(models.EntryTag)) == 6
+
+def test_writer_failure_fails_callers_and_recovers(engine):
+    class FlakyBind:
+        dialect = engine.dialect
+        failures = 1
+
+        def connect(self):
+            if self.failures:
+                self.failures -= 1
+                raise OSError("database is gone")
+            return engine.connect()
+
+    writer = GroupCommitWriter(FlakyBind(), max_delay_ms=10)
+    with pytest.raises(OSError, match="database is gone"):
+        writer.submit(entry(0)).result(timeout=5)
+    assert writer.submit(entry(1)).result(timeout=5).text == "entry 1"
+    writer.close()
+    with engine.connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(models.Entry)) == 1
+
+def test_failed_writer_does_not_pool_its_pragma(engine):
+    writer = GroupCommitWriter(engine, max_delay_ms=10, durability="off")
+
+    def broken(first):
+        raise RuntimeError("writer bug")
+    writer._collect = broken
+    with pytest.raises(RuntimeError, match="writer bug"):
+        writer.submit(entry(0)).result(timeout=5)
+    writer.close()
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() != 0  # OFF
+
+def test_unknown_durability():
+    with pytest.raises(ValueError, match="GROUP_COMMIT_DURABILITY"):
+        GroupCommitWriter(make_engine("sqlite://"), durability="sometimes")
@@ -0,0 +1,139 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.orm import sessionmaker
+from app.db import Base
+from app import crud, models
+from app.pagination import encode_cursor
+from datetime import datetime, date, timedelta
+
+# --- SETUP ---
+
+SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+USERS = 50
+ENTRIES_PER_USER = 400
+
+@pytest.fixture(scope="module")
+def db():
+    Base.metadata.create_all(bind=engine)
+    start = datetime(2023, 1, 1, 8, 0)
+    rows = []
+    for user_id in range(1, USERS + 1):
+        for i in range(ENTRIES_PER_USER):
+            ts = start + timedelta(hours=7 * i + user_id)
+            rows.append({
+                "user_id": user_id,
+                "text": f"Synthetic entry {i}",
+                "entry_type": models.EntryType.note,
+                "timestamp": ts,
+                "date_only": ts.date(),
+                "tags": f"#topic{i % 10}",
+            })
+    with engine.begin() as conn:
+        conn.execute(insert(models.Entry), rows)
+
+    session = TestingSessionLocal()
+    crud.backfill_tags(session)
+    session.execute(text("ANALYZE"))
+    session.commit()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+def query_plan(db, call, archive=False):
+    """
+    Run a crud call, capture the SELECT it issues and return its EXPLAIN QUERY PLAN details.
+    Export calls also read the user's archive segments, which archive=True captures instead.
+    """
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and ("entry_archives" in statement) == archive:
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        call(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    assert len(captured) == 1
+    statement, parameters = captured[0]
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return [row[-1] for row in rows]
+
+def assert_no_scan(plan):
+    assert not any(step.startswith("SCAN") for step in plan), plan
+
+def assert_uses_index(plan, index_name):
+    assert any(f"USING INDEX {index_name}" in step or f"USING COVERING INDEX {index_name}" in step
+               for step in plan), plan
+    assert not any(step.startswith("SCAN") for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+# --- QUERY PLAN TESTS ---
+
+def test_get_entries_by_date_uses_index(db):
+    plan = query_plan(db, lambda s: crud.get_entries_by_date(s, user_id=7, entry_date=date(2023, 3, 1)))
+    assert_uses_index(plan, "ix_entries_user_date")
+
+def test_list_recent_entries_uses_index(db):
+    plan = query_plan(db, lambda s: crud.list_recent_entries(s, user_id=7, limit=5))
+    assert_uses_index(plan, "ix_entries_user_timestamp")
+
+def test_export_entries_uses_index(db):
+    plan = query_plan(db, lambda s: crud.export_entries(s, user_id=7, start_date=date(2023, 2, 1),
+                                                       end_date=date(2023, 4, 1)))
+    assert_uses_index(plan, "ix_entries_user_date")
+
+def test_export_entries_without_range_uses_index(db):
+    plan = query_plan(db, lambda s: crud.export_entries(s, user_id=7))
+    assert_uses_index(plan, "ix_entries_user_date")
+
+def test_list_recent_entries_deep_page_uses_index(db):
+    cursor = encode_cursor(datetime(2023, 3, 1, 12, 0), 1500)
+    plan = query_plan(db, lambda s: crud.list_recent_entries(s, user_id=7, limit=5, cursor=cursor))
+    assert_uses_index(plan, "ix_entries_user_timestamp")
+
+def test_export_entries_page_uses_index(db):
+    cursor = encode_cursor(date(2023, 3, 1), 1500)
+    plan = query_plan(db, lambda s: crud.export_entries_page(s, user_id=7, limit=100, cursor=cursor))
+    assert_uses_index(plan, "ix_entries_user_date")
+
+def test_archived_segments_are_read_by_key(db):
+    cursor = encode_cursor(date(2023, 3, 1), 1500)
+    plan = query_plan(db, lambda s: crud.export_entries_page(s, user_id=7, start_date=date(2023, 2, 1),
+                                                            limit=100, cursor=cursor), archive=True)
+    assert any(step.startswith("SEARCH entry_archives") and "(user_id=? AND month>?)" in step for step in plan), plan
+    assert_no_scan(plan)
+
+def test_tag_counts_read_the_entry_tags_key(db):
+    plan = query_plan(db, lambda s: crud.tag_counts(s, user_id=7))
+    assert any("entry_tags USING PRIMARY KEY (user_id=?)" in step for step in plan), plan
+    assert_no_scan(plan)
+
+def test_tag_filter_uses_indexes(db):
+    plan = query_plan(db, lambda s: crud.list_recent_entries(s, user_id=7, limit=5, tag="topic3"))
+    # The planner may drive from either side; both are index reads
+    assert any("entry_tags USING PRIMARY KEY" in step for step in plan), plan
+    assert_no_scan(plan)
+
+def test_daily_stats_read_the_primary_key(db):
+    plan = query_plan(db, lambda s: crud.get_daily_stats(s, user_id=7, start_date=date(2024, 6, 1)))
+    assert any("daily_stats USING PRIMARY KEY (user_id=? AND date_only>?)" in step for step in plan), plan
+    assert_no_scan(plan)
+
+def test_pending_prompt_deliveries_use_the_partial_index(db):
+    plan = query_plan(db, lambda s: crud.pending_prompt_deliveries(s, date(2023, 3, 1), after_entry_id=100))
+    assert_uses_index(plan, "ix_entries_prompted_date")
+
+def test_due_prompt_users_read_the_next_prompt_index(db):
+    plan = query_plan(db, lambda s: crud.due_prompt_users(s, datetime(2023, 3, 1, 21, 0)))
+    assert_uses_index(plan, "ix_users_next_prompt_at")
@@ -0,0 +1,223 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import time
+import pytest
+from datetime import date, datetime, time as clock
+from functools import partial
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import sessionmaker
+from api import scheduler
+from app.db import Base, make_engine
+from app import crud, jobs, logic, models, prompt_schedule, schemas
+
+@pytest.fixture
+def sessions(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'jobs.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+def job_run(sessions, job_id="job", run_key="2025-06-30"):
+    with sessions() as db:
+        return crud.get_job_run(db, job_id, run_key)
+
+# --- LEASES ---
+
+def test_only_one_owner_claims_a_run(sessions):
+    with sessions() as db:
+        assert crud.claim_job_run(db, "job", "2025-06-30", "a", 60)
+        assert not crud.claim_job_run(db, "job", "2025-06-30", "b", 60)
+        assert crud.claim_job_run(db, "job", "2025-07-01", "b", 60)
+        crud.finish_job_run(db, "job", "2025-06-30", "a")
+        assert not crud.claim_job_run(db, "job", "2025-06-30", "b", 60)
+    assert job_run(sessions).status == models.JobRunStatus.done
+
+def test_finished_runs_are_pruned_after_the_retention(sessions):
+    with sessions() as db:
+        for run_key in ["old", "recent", "running"]:
+            assert crud.claim_job_run(db, "job", run_key, "a", 60)
+        crud.finish_job_run(db, "job", "old", "a")
+        crud.finish_job_run(db, "job", "recent", "a")
+        db.execute(update(models.JobRun).where(models.JobRun.run_key.in_(["old", "running"]))
+                   .values(started_at=datetime(2025, 6, 1), finished_at=datetime(2025, 6, 1)))
+        db.commit()
+        assert crud.claim_job_run(db, "job", "2025-06-30", "a", 60)
+        crud.finish_job_run(db, "job", "2025-06-30", "a", retention_hours=48)
+        assert set(db.scalars(select(models.JobRun.run_key))) == {"recent", "running", "2025-06-30"}
+
+def test_expired_lease_is_taken_over(sessions):
+    with sessions() as db:
+        assert crud.claim_job_run(db, "job", "2025-06-30", "crashed", -1)
+        assert crud.claim_job_run(db, "job", "2025-06-30", "b", 60)
+        assert not crud.renew_job_run(db, "job", "2025-06-30", "crashed", 60)
+        assert crud.renew_job_run(db, "job", "2025-06-30", "b", 60)
+    run = job_run(sessions)
+    assert (run.owner, run.attempts) == ("b", 2)
+
+# --- RUN EXCLUSIVE ---
+
+def test_concurrent_callers_run_the_job_once(sessions):
+    ran = []
+    barrier = threading.Barrier(6)
+
+    def job():
+        time.sleep(0.05)
+        ran.append(1)
+
+    def worker(n):
+        barrier.wait()
+        jobs.run_exclusive("job", "2025-06-30", job, sessions, owner=f"worker{n}")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(ran) == 1
+    assert not jobs.run_exclusive("job", "2025-06-30", job, sessions, owner="late")
+
+def test_failed_run_is_recorded_and_retried(sessions):
+    def broken():
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError):
+        jobs.run_exclusive("job", "2025-06-30", broken, sessions, owner="a")
+    run = job_run(sessions)
+    assert run.status == models.JobRunStatus.failed
+    assert "disk full" in run.error
+
+    assert jobs.run_exclusive("job", "2025-06-30", lambda: None, sessions, owner="b")
+    run = job_run(sessions)
+    assert (run.status, run.attempts, run.error) == (models.JobRunStatus.done, 2, None)
+
+def test_heartbeat_keeps_the_lease_while_running(sessions):
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow():
+        started.set()
+        finish.wait(5)
+
+    thread = threading.Thread(target=jobs.run_exclusive, args=("job", "2025-06-30", slow, sessions, 0.3, "a"))
+    thread.start()
+    started.wait(5)
+    time.sleep(0.5)  # past the original lease
+    with sessions() as db:
+        assert not crud.claim_job_run(db, "job", "2025-06-30", "b", 0.3)
+    finish.set()
+    thread.join()
+    assert job_run(sessions).status == models.JobRunStatus.done
+
+# --- PROMPT SLOTS ---
+
+def test_next_prompt_at_uses_local_time_rounded_up_to_a_slot():
+    after = datetime(2025, 6, 30, 12, 0)
+    assert prompt_schedule.next_prompt_at("UTC", None, after, 10) == datetime(2025, 6, 30, 21, 0)
+    # 20:00 in Kyiv (UTC+3 in summer)
+    assert prompt_schedule.next_prompt_at("Europe/Kyiv", clock(20, 0), after, 10) == datetime(2025, 6, 30, 17, 0)
+    # 21:00 in Kathmandu (UTC+5:45) is 15:15 UTC, sent in the 15:20 slot
+    assert prompt_schedule.next_prompt_at("Asia/Kathmandu", None, after, 10) == datetime(2025, 6, 30, 15, 20)
+    # Already past today's slot: tomorrow
+    assert prompt_schedule.next_prompt_at("UTC", clock(9, 0), after, 10) == datetime(2025, 7, 1, 9, 0)
+
+def test_next_prompt_at_follows_daylight_saving():
+    # Kyiv moves from UTC+3 to UTC+2 on 2025-10-26
+    before = prompt_schedule.next_prompt_at("Europe/Kyiv", clock(20, 0), datetime(2025, 10, 25, 12, 0), 10)
+    after = prompt_schedule.next_prompt_at("Europe/Kyiv", clock(20, 0), before, 10)
+    assert (before, after) == (datetime(2025, 10, 25, 17, 0), datetime(2025, 10, 26, 18, 0))
+
+def test_prompt_date_is_the_local_day_chosen():
+    # 23:58 in New York rounds up to 04:00 UTC, i.e. local midnight
+    due_at = prompt_schedule.next_prompt_at("America/New_York", clock(23, 58), datetime(2025, 6, 30, 12, 0), 10)
+    assert due_at == datetime(2025, 7, 1, 4, 0)
+    assert prompt_schedule.prompt_date("America/New_York", clock(23, 58), due_at) == date(2025, 6, 30)
+    assert prompt_schedule.prompt_date("Asia/Tokyo", clock(7, 0), datetime(2025, 6, 29, 22, 0)) == date(2025, 6, 30)
+
+def test_user_schedule_follows_profile_changes(sessions):
+    with sessions() as db:
+        user = crud.create_user(db, schemas.UserCreate(external_id=1, timezone="Europe/Kyiv", prompt_time=clock(8, 0)))
+        assert user.next_prompt_at is not None
+        user = crud.update_user_by_id(db, user.id, schemas.UserUpdate(timezone="UTC", prompt_time=clock(8, 0)))
+        assert (user.next_prompt_at.hour, user.next_prompt_at.minute) == (8, 0)
+        crud.deactivate_user(db, user.id)
+        assert crud.get_user_by_id(db, user.id).next_prompt_at is None
+    with pytest.raises(ValueError):
+        schemas.UserCreate(external_id=2, timezone="Mars/Olympus_Mons")
+
+# --- PROMPT TICKS ---
+
+def add_users(sessions, zones):
+    with sessions() as db:
+        db.execute(insert(models.User), [
+            {"external_id": 900 + i, "username": f"u{i}", "timezone": tz_name} for i, tz_name in enumerate(zones)
+        ])
+        db.commit()
+
+def prompted(sessions):
+    with sessions() as db:
+        return db.execute(
+            select(models.Entry.user_id, models.Entry.date_only).where(models.Entry.source == "prompted")
+            .order_by(models.Entry.user_id)
+        ).all()
+
+def test_each_tick_prompts_only_the_due_slot(sessions):
+    add_users(sessions, ["UTC", "Europe/Kyiv", "Europe/Kyiv"])
+    tick = partial(logic.create_due_prompts, session_factory=sessions, prompts=["How was your day?"])
+
+    assert tick(datetime(2025, 6, 30, 12, 0)).users == 0  # schedules everyone, nobody due yet
+    assert tick(datetime(2025, 6, 30, 18, 0)) == (2, {date(2025, 6, 30)})  # 21:00 in Kyiv
+    assert tick(datetime(2025, 6, 30, 18, 10)).users == 0
+    assert tick(datetime(2025, 6, 30, 21, 0)).users == 1
+    assert prompted(sessions) == [(1, date(2025, 6, 30)), (2, date(2025, 6, 30)), (3, date(2025, 6, 30))]
+    with sessions() as db:
+        assert db.scalar(select(func.min(models.User.next_prompt_at))) == datetime(2025, 7, 1, 18, 0)
+
+def test_tick_work_is_bounded_and_the_rest_carries_over(sessions):
+    add_users(sessions, ["UTC"] * 5)
+    tick = partial(logic.create_due_prompts, session_factory=sessions, prompts=["How was your day?"], chunk_size=2)
+    tick(datetime(2025, 6, 30, 12, 0))
+    assert tick(datetime(2025, 6, 30, 21, 0), limit=3).users == 3
+    # A later (or missed-then-resumed) tick picks up the rest
+    assert tick(datetime(2025, 6, 30, 22, 30), limit=3).users == 2
+    assert len(prompted(sessions)) == 5
+
+def test_prompt_tick_runs_once_per_slot(sessions, monkeypatch):
+    monkeypatch.setattr(scheduler, "BOT_TOKEN", None)
+    monkeypatch.setattr(logic, "load_prompts", lambda: ("How was your day?",))
+    add_users(sessions, ["UTC"] * 3)
+    with sessions() as db:
+        crud.schedule_unscheduled_users(db, datetime(2025, 6, 30, 12, 0))
+
+    assert scheduler.run_prompt_tick(datetime(2025, 6, 30, 21, 0), sessions)
+    assert not scheduler.run_prompt_tick(datetime(2025, 6, 30, 21, 5), sessions)
+    assert len(prompted(sessions)) == 3
+    with sessions() as db:
+        assert crud.get_job_run(db, scheduler.PROMPT_TICK, "2025-06-30T21:00").status == models.JobRunStatus.done
+
+def test_standalone_scheduler_prepares_the_shards(monkeypatch):
+    calls = []
+    monkeypatch.setattr(scheduler, "prepare_database", lambda: calls.append("directory"))
+    monkeypatch.setattr(scheduler.sharding.shards, "prepare", lambda: calls.append("shards"))
+    monkeypatch.setattr(scheduler.BlockingScheduler, "start", lambda self: calls.append("start"))
+    scheduler.main()
+    assert calls == ["directory", "shards", "start"]
+
+# --- ARCHIVE ---
+
+def test_archive_runs_once_a_day(sessions, monkeypatch):
+    monkeypatch.setattr(scheduler, "archive_old_entries", partial(logic.archive_old_entries, after_days=30))
+    add_users(sessions, ["UTC"])
+    with sessions() as db:
+        for day in [date(2025, 4, 30), date(2025, 5, 1), date(2025, 6, 29)]:
+            crud.create_entry(db, schemas.EntryIn(user_id=1, text="x", entry_type=models.EntryType.note, date_only=day))
+
+    # 30 days before 2025-06-30 is in May, so April is archived
+    assert scheduler.run_archive(date(2025, 6, 30), sessions)
+    assert not scheduler.run_archive(date(2025, 6, 30), sessions)
+    with sessions() as db:
+        assert db.scalar(select(func.count()).select_from(models.Entry)) == 2
+        assert len(crud.export_entries(db, user_id=1)) == 3
+    assert logic.archive_old_entries(date(2025, 6, 30), sessions, after_days=0) == 0
@@ -0,0 +1,161 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import httpx
+import pytest
+from collections import Counter, defaultdict
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import insert, select
+from sqlalchemy.orm import sessionmaker
+from api.send_prompt import PromptSender, RateLimiter, deliver_prompts
+from app.db import Base, make_engine
+from app import logic, models, prompt_schedule
+
+TOKEN = "123:test"
+NOW = prompt_schedule.utc_now()
+PROMPT_DATE = NOW.date()
+
+# ------------------------
+# Local stand-in for the Telegram Bot API
+# ------------------------
+
+def make_bot_api(blocked=(), throttle_once=(), flaky_once=(), throttle_always=()):
+    api = FastAPI()
+    api.state.calls = Counter()
+    api.state.sent = defaultdict(list)  # chat_id -> loop times of accepted messages
+    api.state.attempts = defaultdict(list)
+
+    @api.post("/bot{token}/sendMessage")
+    async def send_message(token: str, request: Request):
+        body = await request.json()
+        chat_id = body["chat_id"]
+        api.state.calls[chat_id] += 1
+        api.state.attempts[chat_id].append(asyncio.get_running_loop().time())
+        first = api.state.calls[chat_id] == 1
+        if token != TOKEN:
+            return JSONResponse({"ok": False, "error_code": 401, "description": "Unauthorized"}, 401)
+        if chat_id in blocked:
+            return JSONResponse({"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}, 403)
+        if chat_id in throttle_always or chat_id in throttle_once and first:
+            return JSONResponse({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 0",
+                                 "parameters": {"retry_after": 0}}, 429)
+        if chat_id in flaky_once and first:
+            return JSONResponse({"ok": False, "error_code": 502, "description": "Bad Gateway"}, 502)
+        api.state.sent[chat_id].append(asyncio.get_running_loop().time())
+        return {"ok": True, "result": {"message_id": 1000 + chat_id, "chat": {"id": chat_id}, "text": body["text"]}}
+
+    return api
+
+@pytest.fixture
+def sessions(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'prompts.db'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": user_id, "external_id": 500 + user_id, "username": f"user{user_id}", "source": "telegram",
+             "next_prompt_at": NOW}
+            for user_id in range(1, 21)
+        ])
+    logic.create_due_prompts(NOW, session_factory=factory, prompts=["How was your day?"])
+    yield factory
+    engine.dispose()
+
+def deliver(api, sessions, **kwargs):
+    options = {"global_rate": 0, "chat_rate": 0, "backoff": 0, "chunk_size": 7, "flush_size": 3, "concurrency": 4}
+    options.update(kwargs)
+    return asyncio.run(deliver_prompts(PROMPT_DATE, token=TOKEN, base_url="http://telegram", session_factory=sessions,
+                                       transport=httpx.ASGITransport(app=api), **options))
+
+def statuses(sessions):
+    with sessions() as db:
+        return dict(db.execute(select(models.PromptDelivery.entry_id, models.PromptDelivery.status)).all())
+
+# ------------------------
+# Tests
+# ------------------------
+
+def test_delivers_all_prompts_and_records_status(sessions):
+    api = make_bot_api()
+    report = deliver(api, sessions)
+    assert (report.sent, report.failed, report.retry) == (20, 0, 0)
+    assert set(api.state.calls) == set(range(501, 521))
+    assert set(statuses(sessions).values()) == {models.DeliveryStatus.sent}
+    with sessions() as db:
+        assert db.scalar(select(models.PromptDelivery.telegram_message_id).where(models.PromptDelivery.entry_id == 1)) \
+            in {1000 + chat for chat in range(501, 521)}
+
+def test_rerun_sends_nothing(sessions):
+    api = make_bot_api()
+    deliver(api, sessions)
+    report = deliver(api, sessions)
+    assert report.total == 0
+    assert all(count == 1 for count in api.state.calls.values())
+
+def test_retry_after_and_server_errors_are_retried(sessions):
+    api = make_bot_api(throttle_once={501, 502}, flaky_once={503})
+    report = deliver(api, sessions)
+    assert report.sent == 20
+    assert report.throttled == 2
+    assert api.state.calls[501] == api.state.calls[503] == 2
+    with sessions() as db:
+        attempts = dict(db.execute(
+            select(models.User.external_id, models.PromptDelivery.attempts)
+            .join(models.Entry, models.Entry.id == models.PromptDelivery.entry_id)
+            .join(models.User, models.User.id == models.Entry.user_id)
+        ).all())
+    assert attempts[501] == attempts[503] == 2
+    assert attempts[504] == 1
+
+def test_blocked_chat_fails_permanently(sessions):
+    api = make_bot_api(blocked={505})
+    report = deliver(api, sessions)
+    assert (report.sent, report.failed) == (19, 1)
+    assert api.state.calls[505] == 1
+    with sessions() as db:
+        error = db.scalar(select(models.PromptDelivery.error).where(models.PromptDelivery.status == models.DeliveryStatus.failed))
+    assert "blocked" in error
+    assert deliver(api, sessions).total == 0
+
+def test_exhausted_retries_are_picked_up_by_the_next_run(sessions):
+    api = make_bot_api(flaky_once={506})
+    report = deliver(api, sessions, retries=0)
+    assert (report.sent, report.retry) == (19, 1)
+    report = deliver(api, sessions, retries=0)
+    assert (report.sent, report.retry) == (1, 0)
+    assert api.state.calls[506] == 2
+
+def test_throttling_counts_against_the_retries(sessions):
+    api = make_bot_api(throttle_always={508})
+    report = deliver(api, sessions, retries=2)
+    assert (report.sent, report.retry, report.throttled) == (19, 1, 3)
+    assert api.state.calls[508] == 3
+    assert statuses(sessions)[8] == models.DeliveryStatus.retry
+
+def test_global_and_chat_rates_are_respected(sessions):
+    api = make_bot_api(flaky_once={507})
+    report = deliver(api, sessions, global_rate=200, chat_rate=10)
+    assert report.sent == 20
+    # 21 evenly spaced sends at 200/s take at least 0.1 s
+    attempts = sorted(t for times in api.state.attempts.values() for t in times)
+    assert attempts[-1] - attempts[0] >= 0.095
+    retried = api.state.attempts[507]
+    assert retried[1] - retried[0] >= 0.095
+
+def test_rate_limiter_pause_delays_next_slot():
+    async def scenario():
+        limiter = RateLimiter(0)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await limiter.acquire()
+        limiter.pause(0.05)
+        await limiter.acquire()
+        return loop.time() - started
+    assert asyncio.run(scenario()) >= 0.045
+
+def test_sender_requires_token():
+    with pytest.raises(ValueError):
+        PromptSender(None)
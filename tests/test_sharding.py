@@ -0,0 +1,289 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import time
+import pytest
+from collections import Counter
+from datetime import date, datetime
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from app import config, crud, logic, maintenance, models, schemas, sharding
+from app.db import Base, get_async_db, get_db, make_async_engine, make_engine, prepare_database
+from app.sharding import ShardRouter, jump_hash
+from api.main import app
+
+SHARDS = 3
+
+@pytest.fixture
+def cluster(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_CREATE_SCHEMA", True)
+    directory_url = f"sqlite:///{tmp_path / 'directory.db'}"
+    directory = make_engine(directory_url)
+    Base.metadata.create_all(bind=directory)
+    router = ShardRouter([f"sqlite:///{tmp_path / f'shard{n}.db'}" for n in range(SHARDS)],
+                         directory_url=directory_url, directory_engine=directory)
+    router.prepare()
+    crud.user_cache.clear()
+    yield router, sessionmaker(autocommit=False, autoflush=False, bind=directory)
+    crud.user_cache.clear()
+    router.dispose()
+    directory.dispose()
+
+def add_users(router, db, count, placed=True):
+    return [
+        schemas.UserOut.model_validate(crud.create_user(
+            db, schemas.UserCreate(external_id=1000 + n, username=f"user{n}"),
+            shard_id=router.placement(1000 + n) if placed else None
+        ))
+        for n in range(count)
+    ]
+
+def note(user_id, text_, **kw):
+    return schemas.EntryIn(user_id=user_id, text=text_, entry_type=models.EntryType.note,
+                           date_only=date(2025, 4, 1), **kw)
+
+def count_entries(session):
+    return session.scalar(select(func.count()).select_from(models.Entry))
+
+def test_jump_hash_moves_keys_only_to_the_new_shard():
+    before = [jump_hash(key, 4) for key in range(10000)]
+    after = [jump_hash(key, 5) for key in range(10000)]
+    moved = [new for old, new in zip(before, after) if old != new]
+    assert set(moved) == {4}
+    assert 1700 < len(moved) < 2300
+    assert all(2300 < n < 2700 for n in Counter(before).values())
+
+def test_entries_live_on_their_users_shard(cluster):
+    router, directory = cluster
+    with directory() as db:
+        users = add_users(router, db, 12)
+        for user in users:
+            with router.session(db, user.shard_id) as shard_db:
+                crud.create_entry(shard_db, note(user.id, f"by {user.id}", tags="#sharded"))
+
+        assert count_entries(db) == 0
+        for shard_id in range(SHARDS):
+            with router.sessionmaker(shard_id)() as shard_db:
+                owners = set(shard_db.scalars(select(models.Entry.user_id)))
+                assert owners == {user.id for user in users if user.shard_id == shard_id}
+                for user_id in owners:
+                    assert crud.tag_counts(shard_db, user_id) == [("sharded", 1)]
+                    assert crud.change_marker(shard_db, user_id)[0] == 1
+        assert len({user.shard_id for user in users}) == SHARDS
+
+def test_prompts_are_created_and_delivered_per_shard(cluster, monkeypatch):
+    router, directory = cluster
+    monkeypatch.setattr(sharding, "shards", router)
+    with directory() as db:
+        users = add_users(router, db, 6)
+        for user in users:
+            db.get(models.User, user.id).next_prompt_at = datetime(2025, 4, 1, 21, 0)
+        db.commit()
+
+    tick = logic.create_due_prompts(datetime(2025, 4, 1, 21, 5), directory, prompts=["How was your day?"])
+    assert tick.users == 6
+
+    pending = []
+    for shard_id in range(SHARDS):
+        with router.sessionmaker(shard_id)() as shard_db:
+            # Joins the shard's entries with the directory's users through ATTACH
+            pending += crud.pending_prompt_deliveries(shard_db, date(2025, 4, 1))
+    assert sorted(chat_id for _, chat_id, _ in pending) == [user.external_id for user in users]
+    with directory() as db:
+        assert count_entries(db) == 0
+        assert all(user.next_prompt_at > datetime(2025, 4, 1, 21, 5) for user in db.scalars(select(models.User)))
+
+def test_writes_to_other_shards_do_not_wait(cluster):
+    router, directory = cluster
+    with directory() as db:
+        users = add_users(router, db, 12)
+    busy = next(user for user in users if user.shard_id == 0)
+    free = next(user for user in users if user.shard_id == 1)
+
+    # Hold shard 0's write lock, like a long transaction would
+    locker = router.engine(0).raw_connection()
+    locker.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.perf_counter()
+        with router.sessionmaker(1)() as shard_db:
+            crud.create_entry(shard_db, note(free.id, "not blocked"))
+        assert time.perf_counter() - started < 1
+
+        blocked = threading.Event()
+        def write_busy():
+            with router.sessionmaker(0)() as shard_db:
+                crud.create_entry(shard_db, note(busy.id, "waits"))
+            blocked.set()
+        writer = threading.Thread(target=write_busy)
+        writer.start()
+        assert not blocked.wait(0.3)
+    finally:
+        locker.rollback()
+        locker.close()
+    writer.join()
+    assert blocked.is_set()
+
+def test_maintenance_commands_reach_every_shard(cluster, monkeypatch):
+    router, directory = cluster
+    monkeypatch.setattr(sharding, "shards", router)
+    monkeypatch.setattr(maintenance, "SessionLocal", directory)
+    with directory() as db:
+        users = add_users(router, db, 6)
+    shard_ids = {user.shard_id for user in users}
+    assert len(shard_ids) > 1
+    for user in users:
+        with router.sessionmaker(user.shard_id)() as shard_db:
+            # A database from before the message index, with a retried message stored twice
+            shard_db.execute(text("DROP INDEX IF EXISTS ux_entries_message"))
+            for text_ in ("Original coffee", "Retried coffee"):
+                shard_db.add(models.Entry(user_id=user.id, text=text_, entry_type=models.EntryType.note,
+                                          tags="#dup", source="telegram", message_id=5, date_only=date(2025, 4, 1)))
+            shard_db.commit()
+
+    maintenance.dedupe_entries()
+    for shard_id in shard_ids:
+        with router.sessionmaker(shard_id)() as shard_db:
+            shard_db.execute(text("INSERT INTO entries_fts(entries_fts) VALUES ('delete-all')"))
+            shard_db.execute(text("DELETE FROM entry_tags"))
+            shard_db.execute(text("DELETE FROM daily_stats"))
+            shard_db.commit()
+
+    maintenance.rebuild_search()
+    maintenance.backfill_tags()
+    maintenance.rebuild_stats()
+
+    for user in users:
+        with router.sessionmaker(user.shard_id)() as shard_db:
+            assert [e.text for e in crud.export_entries(shard_db, user_id=user.id)] == ["Original coffee"]
+            assert len(crud.search_entries(shard_db, user_id=user.id, q="coffee")) == 1
+            assert crud.tag_counts(shard_db, user.id) == [("dup", 1)]
+            assert [row.count for row in crud.get_daily_stats(shard_db, user_id=user.id)] == [1]
+
+def test_add_columns_lets_a_pre_sharding_directory_rebalance(tmp_path, monkeypatch):
+    directory_url = f"sqlite:///{tmp_path / 'diary.db'}"
+    directory = make_engine(directory_url)
+    Base.metadata.create_all(bind=directory)
+    with directory.begin() as conn:
+        # users as it was before sharding, with one user in it
+        conn.execute(text("ALTER TABLE users DROP COLUMN shard_id"))
+        conn.execute(text("INSERT INTO users (id, external_id, source, timezone) VALUES (1, 1000, 'telegram', 'UTC')"))
+    router = ShardRouter([f"sqlite:///{tmp_path / f'shard{n}.db'}" for n in range(2)],
+                         directory_url=directory_url, directory_engine=directory)
+    monkeypatch.setattr(sharding, "shards", router)
+    monkeypatch.setattr(maintenance, "engine", directory)
+    monkeypatch.setattr(config, "DB_CREATE_SCHEMA", True)
+    router.prepare()
+    with pytest.raises(RuntimeError, match="users.shard_id"):
+        prepare_database(directory)
+
+    maintenance.add_columns()
+    prepare_database(directory)
+    sessions = sessionmaker(autocommit=False, autoflush=False, bind=directory)
+    assert sharding.rebalance(router, sessions, settle_seconds=0) == 1
+    with sessions() as db:
+        assert db.get(models.User, 1).shard_id == router.placement(1000)
+    router.dispose()
+    directory.dispose()
+
+def test_rebalance_moves_entries_and_keeps_versions(cluster, monkeypatch):
+    router, directory = cluster
+    with directory() as db:
+        # Users from before sharding: entries in the directory database
+        users = add_users(router, db, 8, placed=False)
+        for user in users:
+            crud.create_entries_bulk(db, [note(user.id, f"{user.id} #{n}", tags="#moved", message_id=n) for n in range(3)])
+        first = crud.export_entries(db, user_id=users[0].id)[0]
+        crud.record_prompt_deliveries(db, [{"entry_id": first.id, "status": models.DeliveryStatus.sent, "attempts": 1,
+                                            "telegram_message_id": 5, "error": None}])
+        versions = {user.id: crud.change_marker(db, user.id)[0] for user in users}
+
+    # An API process with a stale cache writes to the old place while the move settles
+    def straggler(seconds):
+        with directory() as db:
+            crud.create_entry(db, note(users[0].id, "late", tags="#moved"))
+    monkeypatch.setattr(sharding.time, "sleep", straggler)
+    assert sharding.rebalance(router, directory, settle_seconds=0) == len(users)
+    assert sharding.rebalance(router, directory, settle_seconds=0) == 0
+
+    with directory() as db:
+        assert count_entries(db) == 0
+        assert db.scalar(text("SELECT count(*) FROM entry_tags")) == 0
+        placed = {user.id: db.get(models.User, user.id).shard_id for user in users}
+    for user in users:
+        assert placed[user.id] == router.placement(user.external_id)
+        with router.sessionmaker(placed[user.id])() as shard_db:
+            expected = 4 if user.id == users[0].id else 3
+            assert len(crud.export_entries(shard_db, user_id=user.id)) == expected
+            assert crud.tag_counts(shard_db, user.id) == [("moved", expected)]
+            assert crud.get_daily_stats(shard_db, user.id)[0].count == expected
+            assert crud.change_marker(shard_db, user.id)[0] > versions[user.id]
+            # A retried message is still recognised on the new shard
+            assert crud.create_entry(shard_db, note(user.id, "retry", message_id=0)).text == f"{user.id} #0"
+    with router.sessionmaker(placed[users[0].id])() as shard_db:
+        assert shard_db.scalar(select(func.count()).select_from(models.PromptDelivery)) == 1
+
+def test_rebalance_moves_archived_entries(cluster, monkeypatch):
+    router, directory = cluster
+    monkeypatch.setattr(sharding.time, "sleep", lambda seconds: None)
+    with directory() as db:
+        users = add_users(router, db, 4, placed=False)
+        for user in users:
+            crud.create_entry(db, schemas.EntryIn(user_id=user.id, text="old", entry_type=models.EntryType.note,
+                                                  date_only=date(2023, 1, 5)))
+        for user in users:
+            crud.create_entry(db, note(user.id, "recent"))
+        assert crud.archive_entries(db, before=date(2024, 1, 1)) == len(users)
+
+    assert sharding.rebalance(router, directory, settle_seconds=0) == len(users)
+    with directory() as db:
+        assert db.scalar(select(func.count()).select_from(models.EntryArchive)) == 0
+        assert db.scalar(select(func.count()).select_from(models.DailyStat)) == 0
+    for user in users:
+        with router.sessionmaker(router.placement(user.external_id))() as shard_db:
+            assert [e.text for e in crud.export_entries(shard_db, user_id=user.id)] == ["old", "recent"]
+            assert sum(row.count for row in crud.get_daily_stats(shard_db, user.id)) == 2
+
+def test_api_routes_entries_to_the_users_shard(cluster, monkeypatch, tmp_path):
+    router, directory = cluster
+    monkeypatch.setattr(sharding, "shards", router)
+    async_directory = make_async_engine(str(router.directory_url))
+    async_sessions = async_sessionmaker(async_directory, autoflush=False, expire_on_commit=False)
+
+    def override_get_db():
+        with directory() as db:
+            yield db
+
+    async def override_get_async_db():
+        async with async_sessions() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        client = TestClient(app)
+        user = client.post("/users", json={"external_id": 424242, "username": "sharded"}).json()
+        assert "shard_id" not in user
+        entry = client.post("/entry", json={"user_id": user["id"], "text": "On a shard", "entry_type": "note",
+                                            "tags": "#s", "date_only": "2025-04-02"})
+        assert entry.status_code == 200
+        bulk = client.post("/entries/bulk", json=[{"user_id": user["id"], "text": "Bulk", "entry_type": "idea",
+                                                   "date_only": "2025-04-02"}]).json()
+        assert bulk["created"] == 1
+
+        listed = client.get(f"/list?user_id={user['id']}").json()
+        assert sorted(e["text"] for e in listed) == ["Bulk", "On a shard"]
+        assert client.get(f"/tags?user_id={user['id']}").json() == [{"tag": "s", "count": 1}]
+        assert client.get(f"/stats?user_id={user['id']}&start_date=2025-04-01").json()["total"] == 2
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(get_async_db, None)
+
+    shard_id = router.placement(424242)
+    with router.sessionmaker(shard_id)() as shard_db:
+        assert count_entries(shard_db) == 2
+    with directory() as db:
+        assert count_entries(db) == 0
@@ -0,0 +1,83 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import subprocess
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from app import config, models  # models registers the tables
+from app.db import add_missing_columns, missing_columns, missing_tables, prepare_database
+from benchmarks.startup import ENV, ROOT, import_time_ms
+
+# Worker cold start: importing the app, before its lifespan runs. About 1.1 s
+# when this was set, mostly FastAPI and SQLAlchemy; the slack is for slow CI.
+STARTUP_BUDGET_MS = 2500
+
+def test_import_has_no_side_effects(tmp_path):
+    db_path = tmp_path / "untouched.db"
+    code = (
+        "import sys, threading, api.main\n"
+        "print(threading.active_count(), *sorted(m for m in ('apscheduler', 'httpx', 'app.exporter', 'app.export_jobs')"
+        " if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True,
+                            env={**os.environ, **ENV, "DATABASE_URL": f"sqlite:///{db_path}"})
+    # One thread, no scheduler, no HTTP client, no exporters, no database file
+    assert result.stdout.split() == ["1"]
+    assert not db_path.exists()
+
+def test_import_time_within_budget():
+    median_ms, _ = import_time_ms("api.main", runs=3)
+    assert median_ms < STARTUP_BUDGET_MS, f"import api.main took {median_ms:.0f} ms"
+
+def test_sync_and_async_routes_share_an_in_memory_database():
+    code = (
+        "from fastapi.testclient import TestClient\n"
+        "from api.main import app\n"
+        "from app import crud\n"
+        "with TestClient(app) as client:\n"
+        "    user = client.post('/users', json={'external_id': 1}).json()\n"
+        "    crud.user_cache.clear()\n"
+        "    assert client.get(f\"/users/{user['id']}\").json()['external_id'] == 1\n"
+        "    client.post('/entry', json={'user_id': user['id'], 'text': 'x', 'entry_type': 'note'})\n"
+        "    print(len(client.get(f\"/list?user_id={user['id']}\").json()))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                            env={**os.environ, **ENV, "DATABASE_URL": "sqlite://", "DB_CREATE_SCHEMA": "1"})
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-1] == "1"
+
+def test_prepare_database_creates_only_when_asked(monkeypatch):
+    engine = create_engine("sqlite://")
+    monkeypatch.setattr(config, "DB_CREATE_SCHEMA", False)
+    with pytest.raises(RuntimeError, match="missing tables"):
+        prepare_database(engine)
+
+    monkeypatch.setattr(config, "DB_CREATE_SCHEMA", True)
+    prepare_database(engine)
+    assert missing_tables(engine) == []
+
+    monkeypatch.setattr(config, "DB_CREATE_SCHEMA", False)
+    prepare_database(engine)
+
+def test_prepare_database_refuses_tables_missing_columns(monkeypatch):
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        # users as created before the prompt schedule and sharding
+        conn.execute(text(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, external_id INTEGER, source VARCHAR, username VARCHAR, "
+            "language VARCHAR, is_active BOOLEAN, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO users (id, external_id, source) VALUES (1, 42, 'telegram')"))
+    monkeypatch.setattr(config, "DB_CREATE_SCHEMA", True)
+    with pytest.raises(RuntimeError, match="users.timezone"):
+        prepare_database(engine)
+
+    added = add_missing_columns(engine)
+    assert added == ["users.timezone", "users.prompt_time", "users.next_prompt_at", "users.shard_id"]
+    assert missing_columns(engine) == []
+    prepare_database(engine)
+    with engine.begin() as conn:
+        assert conn.execute(text("SELECT timezone, shard_id FROM users")).one() == ("UTC", None)
+        conn.execute(models.User.__table__.insert().values(external_id=43))
+    assert "ix_users_next_prompt_at" in {index["name"] for index in inspect(engine).get_indexes("users")}